@@ -1,15 +1,38 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import false, true
+from sqlalchemy.orm import joinedload, selectinload
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
-from datetime import datetime
-import pandas as pd
+from datetime import datetime, timedelta
 import os
+import hmac
 import json
 import sys
+import tempfile
+import threading
+import uuid
+import time
+import atexit
+from concurrent.futures import Future
 from io import BytesIO
-from sqlalchemy import inspect, text
 import logging
+from outbox import OutboxWorker
+from events import EventBroker, record_event
+from notifications import UnreadCounter, mark_notifications_read
+from retention import delete_in_batches
+from whatsapp import TwilioSender, WhatsAppDispatcher
+from providers import FakeMessageSender, FakeSheetsClient, FaultProfile, StubSheetsClient
+from google_auth import GoogleCredentialManager
+from google_quota import BACKLOG, INTERACTIVE, GoogleRateLimiter, api_error_status, error_reason
+from sheets import DailySpreadsheets, render_order_grid, write_order_sheet, write_order_tab
+from migrations import pending_migrations, run_migrations
+from catalog import CatalogCache, CatalogEntry, bump_catalog_version, catalog_etag, stamp_catalog_version
+from product_search import DatabaseSearch, ProductSearch
+from reservations import ReservationError, merge_cart_lines, reserve_stock
+from pagination import PaginationError, keyset_page, parse_date_range, parse_page_size
+from db_config import PoolMonitor, enable_sqlite_wal, engine_options
+from metrics import REGISTRY, RequestInstrumentation, track_outbound
+from order_export import iter_csv, iter_export_rows, iter_file_then_remove, write_xlsx
 
 # Load environment variables from .env if python-dotenv is installed
 try:
@@ -24,18 +47,23 @@ except ImportError:
 if os.environ.get('FLASK_ENV') != 'production' and 'localhost' in os.environ.get('GOOGLE_OAUTH_REDIRECT_URI', ''):
     os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 
-try:
-    import gspread
-    from google.oauth2 import service_account
-    from google_auth_oauthlib.flow import Flow
-    from google.oauth2.credentials import Credentials
-    from google.auth.transport.requests import Request
-except ImportError:
-    gspread = None
-    service_account = None
-    Flow = None
-    Credentials = None
-    Request = None
+# The Google libraries take ~0.4s to import, so they are loaded on first use (see load_google_libs;
+# google_auth.py imports google-auth itself)
+gspread = None
+Flow = None
+_google_libs_loaded = False
+
+def load_google_libs():
+    """Import gspread and the OAuth flow on first use. The names stay None if they are not installed."""
+    global gspread, Flow, _google_libs_loaded
+    if _google_libs_loaded:
+        return
+    try:
+        import gspread
+        from google_auth_oauthlib.flow import Flow
+    except ImportError:
+        pass
+    _google_libs_loaded = True
 
 # Fix Windows console encoding for print statements
 if sys.platform == 'win32':
@@ -69,8 +97,16 @@ if database_url:
 else:
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///orders.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# Pool size, pre-ping, recycling and statement timeout (PostgreSQL) or busy timeout (SQLite) - see db_config.py
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'], os.environ)
+# Stock uploads are streamed, so the limit only guards against runaway requests
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', 64)) * 1024 * 1024
+# Product search backend for the order page: 'memory' (default) or 'database' (SQLite FTS5 / PostgreSQL pg_trgm)
+app.config['SEARCH_BACKEND'] = os.environ.get('SEARCH_BACKEND', 'memory').lower()
+# Requests slower than this are logged with their SQL statements (see metrics.py)
+app.config['SLOW_REQUEST_MS'] = float(os.environ.get('SLOW_REQUEST_MS', 1000))
+# Optional bearer token so Prometheus can scrape /admin/metrics without an admin session
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN', '')
 
 # Add custom Jinja2 filter for JSON parsing
 @app.template_filter('from_json')
@@ -84,19 +120,68 @@ app.config['TWILIO_AUTH_TOKEN'] = os.environ.get('TWILIO_AUTH_TOKEN', '')
 app.config['TWILIO_WHATSAPP_FROM'] = os.environ.get('TWILIO_WHATSAPP_FROM', 'whatsapp:+14155238886')
 app.config['ADMIN_WHATSAPP_NUMBER'] = os.environ.get('ADMIN_WHATSAPP_NUMBER', '')
 app.config['TWILIO_CONTENT_SID'] = os.environ.get('TWILIO_CONTENT_SID', '')
+# WhatsApp dispatcher: worker threads, per-request timeout (seconds) and the window
+# in which order alerts are merged into one digest message (0 sends one per order)
+app.config['WHATSAPP_WORKERS'] = int(os.environ.get('WHATSAPP_WORKERS', 2))
+app.config['WHATSAPP_TIMEOUT'] = float(os.environ.get('WHATSAPP_TIMEOUT', 10))
+app.config['WHATSAPP_COALESCE_WINDOW'] = float(os.environ.get('WHATSAPP_COALESCE_WINDOW', 10))
 app.config['GOOGLE_SERVICE_ACCOUNT_FILE'] = os.environ.get('GOOGLE_SERVICE_ACCOUNT_FILE', '')
 app.config['GOOGLE_SERVICE_ACCOUNT_JSON'] = os.environ.get('GOOGLE_SERVICE_ACCOUNT_JSON', '')
 app.config['GOOGLE_DRIVE_FOLDER_ID'] = os.environ.get('GOOGLE_DRIVE_FOLDER_ID', '')
+# 'per_order' creates one spreadsheet per order; 'daily' adds each order as a tab of a shared daily spreadsheet
+app.config['GOOGLE_SHEETS_MODE'] = os.environ.get('GOOGLE_SHEETS_MODE', 'per_order')
+# Access tokens are refreshed in the background this many seconds before they expire;
+# GOOGLE_API_TIMEOUT (seconds) bounds each Sheets/Drive call
+app.config['GOOGLE_TOKEN_REFRESH_MARGIN'] = int(os.environ.get('GOOGLE_TOKEN_REFRESH_MARGIN', 300))
+app.config['GOOGLE_API_TIMEOUT'] = float(os.environ.get('GOOGLE_API_TIMEOUT', 30))
+# Sheets/Drive calls share a token bucket per process (see google_quota.py): GOOGLE_API_RATE_PER_MINUTE
+# with bursts of GOOGLE_API_BURST; with several worker processes, split the project quota between them.
+# Sheets for orders older than GOOGLE_API_BACKLOG_AGE seconds are replayed in the lower-priority lane
+app.config['GOOGLE_API_RATE_PER_MINUTE'] = float(os.environ.get('GOOGLE_API_RATE_PER_MINUTE', 60))
+app.config['GOOGLE_API_BURST'] = int(os.environ.get('GOOGLE_API_BURST', 10))
+app.config['GOOGLE_API_MAX_RETRIES'] = int(os.environ.get('GOOGLE_API_MAX_RETRIES', 5))
+app.config['GOOGLE_API_BACKLOG_AGE'] = int(os.environ.get('GOOGLE_API_BACKLOG_AGE', 300))
+# Provider stand-ins for offline load tests (see providers.py): SHEETS_BACKEND google|fake|stub,
+# WHATSAPP_BACKEND twilio|fake|stub. 'stub' talks HTTP to PROVIDER_STUB_URL; PROVIDER_FAULTS
+# (e.g. latency_ms=200,rate_429=0.05,rate_5xx=0.01) injects latency and errors into the 'fake' ones
+app.config['SHEETS_BACKEND'] = os.environ.get('SHEETS_BACKEND', 'google').lower()
+app.config['WHATSAPP_BACKEND'] = os.environ.get('WHATSAPP_BACKEND', 'twilio').lower()
+app.config['PROVIDER_STUB_URL'] = os.environ.get('PROVIDER_STUB_URL', 'http://127.0.0.1:8090')
+app.config['PROVIDER_FAULTS'] = os.environ.get('PROVIDER_FAULTS', '')
 # OAuth Configuration
 app.config['GOOGLE_OAUTH_CLIENT_ID'] = os.environ.get('GOOGLE_OAUTH_CLIENT_ID', '')
 app.config['GOOGLE_OAUTH_CLIENT_SECRET'] = os.environ.get('GOOGLE_OAUTH_CLIENT_SECRET', '')
 app.config['GOOGLE_OAUTH_REDIRECT_URI'] = os.environ.get('GOOGLE_OAUTH_REDIRECT_URI', 'http://localhost:5000/oauth2callback')
+# Schema migrations and the admin user are set up by `flask --app app migrate` (run on deploy);
+# true does it at startup instead, for hosts without a pre-deploy step
+app.config['AUTO_MIGRATE'] = os.environ.get('AUTO_MIGRATE', 'False').lower() == 'true'
+# Background job queue (Google Sheet backups and WhatsApp alerts run outside the request)
+app.config['OUTBOX_WORKER_ENABLED'] = os.environ.get('OUTBOX_WORKER_ENABLED', 'True').lower() == 'true'
+app.config['OUTBOX_POLL_INTERVAL'] = float(os.environ.get('OUTBOX_POLL_INTERVAL', 5))
+app.config['OUTBOX_MAX_ATTEMPTS'] = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 5))
+# Stock imports run as background jobs; uploads wait here until their job has read them
+app.config['IMPORT_FOLDER'] = os.environ.get('IMPORT_FOLDER', 'uploads')
+# An import still 'running' after this many seconds is assumed crashed and is run again
+app.config['IMPORT_LEASE_TIMEOUT'] = int(os.environ.get('IMPORT_LEASE_TIMEOUT', 1800))
+# Admin dashboard event stream (see events.py): how often each worker checks for new events while a
+# dashboard is connected, how many streams a worker serves at once (each holds one of its threads)
+# and how long a stream stays open before the browser reconnects
+app.config['EVENT_POLL_INTERVAL'] = float(os.environ.get('EVENT_POLL_INTERVAL', 2))
+app.config['EVENT_STREAM_MAX_CLIENTS'] = int(os.environ.get('EVENT_STREAM_MAX_CLIENTS', 2))
+app.config['EVENT_STREAM_SECONDS'] = int(os.environ.get('EVENT_STREAM_SECONDS', 300))
+# Retention job (see retention.py): every RETENTION_INTERVAL seconds, delete read notifications older
+# than NOTIFICATION_RETENTION_DAYS (0 keeps them) and dashboard events older than EVENT_RETENTION_HOURS
+app.config['RETENTION_INTERVAL'] = int(os.environ.get('RETENTION_INTERVAL', 3600))
+app.config['NOTIFICATION_RETENTION_DAYS'] = float(os.environ.get('NOTIFICATION_RETENTION_DAYS', 30))
+app.config['EVENT_RETENTION_HOURS'] = float(os.environ.get('EVENT_RETENTION_HOURS', 24))
 
 
-# Create upload folder if it doesn't exist
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
 db = SQLAlchemy(app)
+with app.app_context():
+    enable_sqlite_wal(db.engine)
+    pool_monitor = PoolMonitor(db.engine)
+    instrumentation = RequestInstrumentation(app, db.engine, slow_request_ms=app.config['SLOW_REQUEST_MS'])
+REGISTRY.gauges('oms_db_pool', 'Database connection pool state and counters.', lambda: pool_monitor.snapshot())
 
 # Database Models
 class User(db.Model):
@@ -113,9 +198,31 @@ class Product(db.Model):
     item_lot_type = db.Column(db.String(200))
     quantity_available = db.Column(db.Integer, default=0)
     mrp = db.Column(db.Float)
+    catalog_version = db.Column(db.Integer, nullable=False, default=0)  # catalog version of the last change
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ux_product_lot_type_code', 'lot_type_code', unique=True),
+        db.Index('ix_product_catalog_version', 'catalog_version'),  # /api/products?since=
+    )
+
+class CatalogVersion(db.Model):
+    """Single row (id=1) counting stock changes; see catalog.py."""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    reset_version = db.Column(db.Integer, nullable=False, default=0)  # last version that deleted all stock
+
+# Products are served from memory; each read checks CatalogVersion so other workers' changes show up
+catalog_cache = CatalogCache(db, Product, CatalogVersion)
+REGISTRY.gauges('oms_catalog_cache', 'Product catalog cache counters.', lambda: catalog_cache.stats)
+# /api/products/search: in-memory trigram index, or FTS5 / pg_trgm with SEARCH_BACKEND=database
+product_search = ProductSearch(
+    catalog_cache,
+    DatabaseSearch(db, app.logger) if app.config['SEARCH_BACKEND'] == 'database' else None
+)
+REGISTRY.gauges('oms_product_search', 'Product search index counters.', product_search.stats)
+
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -123,9 +230,55 @@ class Order(db.Model):
     total_amount = db.Column(db.Float, nullable=False)
     status = db.Column(db.String(20), default='pending')  # pending, downloaded, confirmed, completed
     sheet_url = db.Column(db.String(500))
+    sheet_id = db.Column(db.String(200))  # spreadsheet created for the order, set before it is written
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     user = db.relationship('User', backref=db.backref('orders', lazy=True))
 
+    __table_args__ = (
+        db.Index('ix_order_user_id_created_at', 'user_id', db.desc('created_at')),  # my_orders
+        db.Index('ix_order_created_at', 'created_at'),  # admin order listings
+        db.Index('ix_order_status_created_at', 'status', db.desc('created_at')),  # admin status filter
+    )
+
+    @property
+    def line_items(self):
+        """Line items as dicts; orders that have no order_item rows yet fall back to the JSON blob."""
+        if self.items:
+            return [item.to_dict() for item in self.items]
+        return json.loads(self.order_data) if self.order_data else []
+
+class OrderItem(db.Model):
+    """One line of an order, with the product details as they were when it was placed."""
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
+    # Not a foreign key: products are removed by delete_stock but their orders are kept
+    product_id = db.Column(db.Integer)
+    lot_type_code = db.Column(db.String(100))
+    parent_code = db.Column(db.String(100))
+    item_lot_type = db.Column(db.String(200))
+    quantity = db.Column(db.Integer, nullable=False)
+    mrp = db.Column(db.Float)
+    total = db.Column(db.Float, nullable=False, default=0)
+    order = db.relationship('Order', backref=db.backref(
+        'items', lazy=True, order_by='OrderItem.id', cascade='all, delete-orphan'
+    ))
+
+    __table_args__ = (
+        db.Index('ix_order_item_order_id', 'order_id'),
+        db.Index('ix_order_item_product_id', 'product_id'),  # per-product demand
+    )
+
+    def to_dict(self):
+        return {
+            'product_id': self.product_id,
+            'lot_type_code': self.lot_type_code,
+            'parent_code': self.parent_code,
+            'item_lot_type': self.item_lot_type,
+            'quantity': self.quantity,
+            'mrp': self.mrp,
+            'total': self.total
+        }
+
 class Notification(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
@@ -134,6 +287,12 @@ class Notification(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     order = db.relationship('Order', backref=db.backref('notifications', lazy=True))
 
+    __table_args__ = (
+        db.Index('ix_notification_read_created_at', 'read', 'created_at'),  # unread list on the dashboard
+        db.Index('ix_notification_created_at', 'created_at'),
+        db.Index('ix_notification_order_id', 'order_id'),
+    )
+
 class SavedCart(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -144,122 +303,227 @@ class SavedCart(db.Model):
     
     user = db.relationship('User', backref=db.backref('saved_carts', lazy=True))
 
+    __table_args__ = (db.Index('ix_saved_cart_user_id', 'user_id'),)
+
 class GoogleOAuthToken(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     token_data = db.Column(db.Text, nullable=False)  # JSON string of OAuth token
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+class OutboxJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)  # order_sheet, order_whatsapp
+    payload = db.Column(db.Text, nullable=False)  # JSON string of job arguments
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_outbox_job_status_run_after', 'status', 'run_after'),)
+
+class AdminEvent(db.Model):
+    """Change feed behind /admin/events; see events.py."""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)  # order.created, order.deleted, notification.read, ...
+    data = db.Column(db.Text, nullable=False)  # JSON payload sent to the dashboard
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_admin_event_created_at', 'created_at'),)  # retention cleanup
+
+# Pushes AdminEvent rows to open dashboards; polls only while one is connected
+event_broker = EventBroker(
+    app, db, AdminEvent,
+    poll_interval=app.config['EVENT_POLL_INTERVAL'],
+    max_streams=app.config['EVENT_STREAM_MAX_CLIENTS'],
+    stream_seconds=app.config['EVENT_STREAM_SECONDS']
+)
+REGISTRY.gauges('oms_admin_events', 'Admin dashboard event stream counters.', event_broker.collect_stats)
+# Every change to the unread count writes an AdminEvent, so the newest event id validates the cached count
+unread_counter = UnreadCounter(db, Notification, AdminEvent)
+REGISTRY.gauges('oms_unread_counter', 'Unread notification counter cache.', lambda: unread_counter.stats)
+
+class DailySpreadsheet(db.Model):
+    """The shared spreadsheet of one day (GOOGLE_SHEETS_MODE=daily); see sheets.DailySpreadsheets."""
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(200), unique=True, nullable=False)  # Orders - YYYY-MM-DD
+    spreadsheet_id = db.Column(db.String(200))  # None while the claiming worker creates it
+    claimed_at = db.Column(db.DateTime, nullable=False)
+
+daily_spreadsheets = DailySpreadsheets(db, DailySpreadsheet)
+
+class ImportJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    filename = db.Column(db.String(255), nullable=False)  # as uploaded
+    staged_path = db.Column(db.String(500), nullable=False)  # removed when the job finishes
+    delete_missing = db.Column(db.Boolean, nullable=False, default=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    rows_total = db.Column(db.Integer)  # estimate for the progress bar, None if unknown
+    rows_processed = db.Column(db.Integer, nullable=False, default=0)
+    created = db.Column(db.Integer, nullable=False, default=0)
+    updated = db.Column(db.Integer, nullable=False, default=0)
+    deleted = db.Column(db.Integer, nullable=False, default=0)
+    unchanged = db.Column(db.Integer, nullable=False, default=0)
+    skipped = db.Column(db.Integer, nullable=False, default=0)
+    error_count = db.Column(db.Integer, nullable=False, default=0)
+    errors = db.Column(db.Text)  # JSON list of the first row problems: [{row, error}]
+    timings = db.Column(db.Text)  # JSON of milliseconds per import phase
+    last_error = db.Column(db.Text)  # why the job failed
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def record_progress(self, summary, timings):
+        """Copy the running totals of a StockImportSummary onto the job."""
+        self.rows_processed = summary.rows
+        self.created = summary.created
+        self.updated = summary.updated
+        self.deleted = summary.deleted
+        self.unchanged = summary.unchanged
+        self.skipped = summary.skipped
+        self.error_count = summary.error_count
+        self.errors = json.dumps(summary.errors)
+        self.timings = json.dumps(timings)
+
+    def to_dict(self):
+        end = self.finished_at or datetime.utcnow()
+        elapsed = (end - self.started_at).total_seconds() if self.started_at else 0
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'status': self.status,
+            'delete_missing': self.delete_missing,
+            'rows_total': self.rows_total,
+            'rows_processed': self.rows_processed,
+            'created': self.created,
+            'updated': self.updated,
+            'deleted': self.deleted,
+            'unchanged': self.unchanged,
+            'skipped': self.skipped,
+            'error_count': self.error_count,
+            'errors': json.loads(self.errors) if self.errors else [],
+            'last_error': self.last_error,
+            'elapsed_seconds': round(elapsed, 1),
+            'rows_per_second': round(self.rows_processed / elapsed, 1) if elapsed > 0 else None,
+            'timings_ms': json.loads(self.timings) if self.timings else {},
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'started_at': self.started_at.strftime('%Y-%m-%d %H:%M:%S') if self.started_at else None,
+            'finished_at': self.finished_at.strftime('%Y-%m-%d %H:%M:%S') if self.finished_at else None
+        }
+
 GOOGLE_SCOPES = [
     'https://www.googleapis.com/auth/spreadsheets',
     'https://www.googleapis.com/auth/drive'
 ]
 
+# Credentials are loaded once per process and refreshed in the background before they expire
+google_credentials = GoogleCredentialManager(
+    app, db, GoogleOAuthToken, GOOGLE_SCOPES,
+    refresh_margin=app.config['GOOGLE_TOKEN_REFRESH_MARGIN'],
+    timeout=app.config['GOOGLE_API_TIMEOUT']
+)
+REGISTRY.gauges('oms_google_auth', 'Google credential loads and token refreshes.', google_credentials.collect_stats)
 
-def get_google_credentials():
-    """Return Google credentials - OAuth tokens (preferred) or service account."""
-    if not Credentials and not service_account:
-        app.logger.warning('google-auth is not installed. Skipping Google Sheets backup.')
-        return None
-    
-    cached_credentials = getattr(app, '_google_credentials', None)
-    if cached_credentials:
-        return cached_credentials
-    
-    # Try OAuth credentials first (preferred for personal accounts)
-    if Credentials:
-        try:
-            oauth_token = GoogleOAuthToken.query.first()
-            if oauth_token:
-                app.logger.info('Found OAuth token in database, loading...')
-                token_dict = json.loads(oauth_token.token_data)
-                credentials = Credentials.from_authorized_user_info(token_dict, GOOGLE_SCOPES)
-                
-                # Refresh token if expired
-                if credentials.expired and credentials.refresh_token:
-                    try:
-                        app.logger.info('OAuth token expired, refreshing...')
-                        credentials.refresh(Request())
-                        # Save refreshed token
-                        oauth_token.token_data = json.dumps({
-                            'token': credentials.token,
-                            'refresh_token': credentials.refresh_token,
-                            'token_uri': credentials.token_uri,
-                            'client_id': credentials.client_id,
-                            'client_secret': credentials.client_secret,
-                            'scopes': credentials.scopes
-                        })
-                        db.session.commit()
-                        app.logger.info('OAuth token refreshed successfully.')
-                    except Exception as refresh_error:
-                        app.logger.error(f'Error refreshing OAuth token: {str(refresh_error)}')
-                        return None
-                
-                app._google_credentials = credentials
-                app.logger.info('Google OAuth credentials loaded successfully.')
-                return credentials
-            else:
-                app.logger.warning('No OAuth token found in database. OAuth not authorized. Use /admin/google/authorize to authorize.')
-        except Exception as e:
-            app.logger.warning(f'Error loading OAuth credentials: {str(e)}')
-    
-    # Fall back to service account if OAuth not available
-    # But log a warning that OAuth is preferred
-    if service_account:
-        credentials_json = app.config.get('GOOGLE_SERVICE_ACCOUNT_JSON')
-        credentials_file = app.config.get('GOOGLE_SERVICE_ACCOUNT_FILE')
-        
-        try:
-            if credentials_json:
-                app.logger.warning('Using service account (OAuth not available). Service accounts have storage limitations.')
-                app.logger.info('Loading Google credentials from GOOGLE_SERVICE_ACCOUNT_JSON environment variable.')
-                info = json.loads(credentials_json)
-                credentials = service_account.Credentials.from_service_account_info(info, scopes=GOOGLE_SCOPES)
-            elif credentials_file and os.path.exists(credentials_file):
-                app.logger.warning('Using service account (OAuth not available). Service accounts have storage limitations.')
-                app.logger.info(f'Loading Google credentials from file: {credentials_file}')
-                credentials = service_account.Credentials.from_service_account_file(credentials_file, scopes=GOOGLE_SCOPES)
-            else:
-                app.logger.warning('No Google credentials configured. Use OAuth or set GOOGLE_SERVICE_ACCOUNT_FILE.')
-                return None
-            
-            app._google_credentials = credentials
-            app.logger.info('Google service account credentials loaded successfully.')
-            return credentials
-        except Exception as e:
-            app.logger.error(f'Error loading Google credentials: {str(e)}', exc_info=True)
-            return None
-    
-    return None
+google_rate_limiter = GoogleRateLimiter(
+    per_minute=app.config['GOOGLE_API_RATE_PER_MINUTE'],
+    burst=app.config['GOOGLE_API_BURST'],
+    max_retries=app.config['GOOGLE_API_MAX_RETRIES']
+)
+REGISTRY.gauges('oms_google_api', 'Google Sheets/Drive calls, quota waits, throttling and failures.',
+                google_rate_limiter.collect_stats)
+
+provider_faults = FaultProfile.parse(app.config['PROVIDER_FAULTS'])
+if app.config['SHEETS_BACKEND'] == 'fake':
+    sheets_stand_in = FakeSheetsClient(provider_faults)
+elif app.config['SHEETS_BACKEND'] == 'stub':
+    sheets_stand_in = StubSheetsClient(app.config['PROVIDER_STUB_URL'], timeout=app.config['GOOGLE_API_TIMEOUT'])
+elif app.config['SHEETS_BACKEND'] == 'google':
+    sheets_stand_in = None
+else:
+    raise ValueError(f"Unknown SHEETS_BACKEND: {app.config['SHEETS_BACKEND']}")
+
+
+def sheets_configured():
+    """True when order sheets have somewhere to go: Google credentials or a stand-in backend."""
+    return bool(
+        sheets_stand_in is not None or
+        app.config.get('GOOGLE_SERVICE_ACCOUNT_JSON') or
+        app.config.get('GOOGLE_SERVICE_ACCOUNT_FILE')
+    )
 
 
 def get_gspread_client():
-    """Initialize and cache a gspread client."""
+    """Return the process-wide gspread client (one pooled, authorized HTTP session), rate limited."""
+    if sheets_stand_in is not None:
+        return google_rate_limiter.wrap(sheets_stand_in)
+    load_google_libs()
     if not gspread:
         app.logger.warning('gspread is not installed. Skipping Google Sheets backup.')
         return None
     
-    cached_client = getattr(app, '_gspread_client', None)
-    if cached_client:
-        return cached_client
-    
-    credentials = get_google_credentials()
-    if not credentials:
+    try:
+        client = google_credentials.gspread_client()
+    except Exception as e:
+        app.logger.error(f'Error creating gspread client: {str(e)}', exc_info=True)
+        return None
+    if not client:
         app.logger.warning('Google credentials unavailable. Skipping Sheets backup.')
         return None
+    return google_rate_limiter.wrap(client)
+
+
+def _create_spreadsheet(client, title, folder_id=None):
+    with track_outbound('google_drive', 'create_spreadsheet'):
+        if folder_id:
+            return client.create(title, folder_id=folder_id)
+        return client.create(title)
+
+
+def create_spreadsheet_in_folder(client, title, folder_id, order_id):
+    """Create a spreadsheet in the Drive folder, falling back to root if the folder is unusable."""
+    if not folder_id:
+        app.logger.info('No Google Drive folder ID provided. Creating sheet in root.')
+        return _create_spreadsheet(client, title)
     
+    app.logger.info(f'Using Google Drive folder ID: {folder_id}')
+    try:
+        spreadsheet = _create_spreadsheet(client, title, folder_id)
+        app.logger.info(f'Successfully created sheet in folder for order #{order_id}')
+        return spreadsheet
+    except Exception as folder_error:
+        # Only a missing or unshared folder is worth the fallback; rate limits, outages and a full
+        # Drive would fail the same way in root, so they go to the caller (and the job is retried)
+        if error_reason(folder_error) not in ('not_found', 'permission'):
+            raise
+        app.logger.warning(f'Failed to create sheet in folder (ID: {folder_id}): {str(folder_error)}')
+        app.logger.info(f'Falling back to creating sheet in root for order #{order_id}')
+        return _create_spreadsheet(client, title)
+
+
+def open_order_spreadsheet(client, order):
+    """The spreadsheet an earlier attempt created for ``order``, or None if there is none (any more)."""
+    if not order.sheet_id:
+        return None
     try:
-        client = gspread.authorize(credentials)
-        app._gspread_client = client
-        app.logger.info('gspread client created successfully.')
-        return client
+        with track_outbound('google_sheets', 'open'):
+            return client.open_by_key(order.sheet_id)
     except Exception as e:
-        app.logger.error(f'Error creating gspread client: {str(e)}', exc_info=True)
+        if type(e).__name__ != 'SpreadsheetNotFound' and error_reason(e) != 'not_found':
+            raise
+        app.logger.warning(f'Spreadsheet {order.sheet_id} of order #{order.id} is gone; creating a new one')
         return None
 
-
 def create_order_spreadsheet(order, ba_username=None):
-    """Create a dedicated Google Sheet for the given order and return its URL."""
+    """Write the given order to Google Sheets and return its URL.
+    
+    By default each order gets its own spreadsheet. With GOOGLE_SHEETS_MODE=daily
+    each order becomes a tab of one shared spreadsheet per day instead.
+    """
     client = get_gspread_client()
     if not client:
         return None
@@ -272,8 +536,9 @@ def create_order_spreadsheet(order, ba_username=None):
             ba_username = order.user.username if order.user else 'Unknown BA'
         except Exception:
             ba_username = 'Unknown BA'
-    order_date = order.created_at.strftime('%Y-%m-%d %H:%M:%S') if order.created_at else datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-    sheet_title = f'Order #{order.id} - {ba_username} - {order.created_at.strftime("%Y-%m-%d") if order.created_at else datetime.utcnow().strftime("%Y-%m-%d")}'
+    created_at = order.created_at or datetime.utcnow()
+    order_date = created_at.strftime('%Y-%m-%d %H:%M:%S')
+    sheet_title = f'Order #{order.id} - {ba_username} - {created_at.strftime("%Y-%m-%d")}'
     
     try:
         folder_id = app.config.get('GOOGLE_DRIVE_FOLDER_ID') or None
@@ -281,216 +546,128 @@ def create_order_spreadsheet(order, ba_username=None):
         if not folder_id:
             folder_id = os.environ.get('GOOGLE_DRIVE_FOLDER_ID') or None
         
-        spreadsheet = None
-        
-        # Try to create in folder if folder_id is provided
-        if folder_id:
-            app.logger.info(f'Using Google Drive folder ID: {folder_id}')
-            try:
-                spreadsheet = client.create(sheet_title, folder_id=folder_id)
-                app.logger.info(f'Successfully created sheet in folder for order #{order.id}')
-            except Exception as folder_error:
-                error_str = str(folder_error)
-                # Check if it's a quota error - don't fallback to root if quota is exceeded
-                if 'quota' in error_str.lower() or 'storage' in error_str.lower():
-                    app.logger.error(f'Google Drive storage quota exceeded. Cannot create sheet for order #{order.id}')
-                    raise  # Re-raise quota errors - they'll be caught by outer handler
-                # If folder not found (404) or permission denied (but not quota), fallback to root
-                elif '404' in error_str or 'not found' in error_str.lower() or ('403' in error_str and 'quota' not in error_str.lower()):
-                    app.logger.warning(f'Failed to create sheet in folder (ID: {folder_id}): {error_str}')
-                    app.logger.info(f'Falling back to creating sheet in root for order #{order.id}')
-                    try:
-                        spreadsheet = client.create(sheet_title)
-                    except Exception as root_error:
-                        root_error_str = str(root_error)
-                        # If root also fails with quota, don't try again
-                        if 'quota' in root_error_str.lower() or 'storage' in root_error_str.lower():
-                            app.logger.error(f'Google Drive storage quota exceeded in root as well for order #{order.id}')
-                            raise
-                        else:
-                            raise
-                else:
-                    # Re-raise if it's a different error
-                    raise
-        else:
-            app.logger.info('No Google Drive folder ID provided. Creating sheet in root.')
-            spreadsheet = client.create(sheet_title)
-        worksheet = spreadsheet.sheet1
-        
-        metadata_rows = [
-            ['Order ID', order.id],
-            ['BA Username', ba_username],
-            ['Order Date', order_date],
-            ['Status', order.status or 'pending'],
-            ['']
-        ]
-        worksheet.update('A1', metadata_rows)
-        
-        header_row_index = len(metadata_rows) + 1
-        headers = ['#', 'Lot Type Code', 'Item Type', 'Parent Code', 'Quantity Needed', 'MRP', 'Line Total (₹)']
-        worksheet.update(f'A{header_row_index}', [headers])
-        
         try:
-            order_items = json.loads(order.order_data or '[]')
+            order_items = order.line_items
         except Exception:
             order_items = []
         
-        if order_items:
-            item_rows = []
-            for idx, item in enumerate(order_items, start=1):
-                item_rows.append([
-                    idx,
-                    item.get('lot_type_code') or '',
-                    item.get('item_lot_type') or '',
-                    item.get('parent_code') or '',
-                    item.get('quantity') or 0,
-                    item.get('mrp') or 0,
-                    item.get('total') or 0
-                ])
-            worksheet.update(f'A{header_row_index + 1}', item_rows)
+        # Build the whole grid in memory; it is written with a single batchUpdate call
+        rows = render_order_grid(order.id, ba_username, order_date, order.status, order_items, order.total_amount)
         
-        summary_row_index = header_row_index + len(order_items) + 2
-        worksheet.update(
-            f'A{summary_row_index}',
-            [['Total Amount (₹)', round(order.total_amount or 0, 2)]]
-        )
+        if app.config.get('GOOGLE_SHEETS_MODE') == 'daily':
+            daily_title = f'Orders - {created_at.strftime("%Y-%m-%d")}'
+            spreadsheet = daily_spreadsheets.get(
+                client, daily_title,
+                lambda title: create_spreadsheet_in_folder(client, title, folder_id, order.id)
+            )
+            sheet_url = write_order_tab(spreadsheet, order.id, f'Order #{order.id} - {ba_username}', rows)
+        else:
+            spreadsheet = open_order_spreadsheet(client, order)
+            if spreadsheet is None:
+                spreadsheet = create_spreadsheet_in_folder(client, sheet_title, folder_id, order.id)
+                # Saved before writing: if the write fails, the retried job fills this spreadsheet
+                order.sheet_id = spreadsheet.id
+                db.session.commit()
+            sheet_url = write_order_sheet(spreadsheet, rows)
         
-        app.logger.info(f'Created Google Sheet for order #{order.id}: {spreadsheet.url}')
-        return spreadsheet.url
+        app.logger.info(f'Created Google Sheet for order #{order.id}: {sheet_url}')
+        return sheet_url
     
     except Exception as e:
-        error_msg = str(e)
-        # Get more detailed error information
-        error_details = {
-            'error_type': type(e).__name__,
-            'error_message': error_msg,
-        }
-        
-        # Check for gspread APIError (quota, permissions, etc.)
-        if gspread and hasattr(gspread, 'exceptions'):
-            if isinstance(e, gspread.exceptions.APIError):
-                # Get response details if available
-                if hasattr(e, 'response'):
-                    error_details['status_code'] = getattr(e.response, 'status_code', None)
-                    try:
-                        if hasattr(e.response, 'json'):
-                            error_details['response_body'] = e.response.json()
-                        elif hasattr(e.response, 'text'):
-                            error_details['response_text'] = e.response.text
-                    except Exception as resp_err:
-                        error_details['response_error'] = str(resp_err)
-                
-                # Also check for error details in the exception itself
-                if hasattr(e, 'args') and e.args:
-                    error_details['exception_args'] = str(e.args)
-                
-                # Log full error details
-                app.logger.error(f'Google Sheets APIError for order #{order.id}: {error_details}')
-                
-                if '403' in error_msg or 'quota' in error_msg.lower() or 'storage' in error_msg.lower():
-                    # Service accounts don't have storage quotas - files must be in Shared Drive or use domain-wide delegation
-                    quota_error = f'Google Drive storage quota error for order #{order.id}. Error: {error_msg}. '
-                    quota_error += 'SOLUTION: Service accounts cannot own files. You need to either: '
-                    quota_error += '1) Use a Google Workspace Shared Drive, or 2) Use domain-wide delegation to impersonate a user.'
-                    app.logger.error(quota_error)
-                    print(f"[ERROR] Google Drive storage quota error: {error_msg}")
-                    print(f"[INFO] Service accounts don't have storage quotas. Files must be created in a Shared Drive or via domain-wide delegation.")
-                    print(f"[INFO] Your personal storage has space, but the service account cannot create files in regular folders.")
-                elif '403' in error_msg or 'permission' in error_msg.lower():
-                    perm_error = 'Google Drive permission denied for order #{}: {}'.format(order.id, error_msg)
-                    app.logger.error(perm_error)
-                    print(f"[ERROR] Google Drive permission denied: {error_msg}")
-                else:
-                    api_error = 'Google Sheets API error for order #{}: {}'.format(order.id, error_msg)
-                    app.logger.error(api_error)
-                    print(f"[ERROR] Google Sheets API error: {error_msg}")
-            else:
-                app.logger.error(f'Error creating Google Sheet for order #{order.id}: {error_msg}', exc_info=True)
-                print(f"[ERROR] Error creating Google Sheet: {error_msg}")
+        reason = error_reason(e)
+        status = api_error_status(e)
+        if reason in ('throttled', 'transient'):
+            app.logger.warning(f'Google API still rate limited or unavailable for order #{order.id}; '
+                               f'the sheet will be retried: {str(e)}')
+        elif reason == 'storage_quota':
+            # Service accounts have no Drive storage of their own
+            app.logger.error(f'Google Drive storage quota exceeded for order #{order.id}: {str(e)}. '
+                             'Authorize OAuth at /admin/google/authorize, or have the service account '
+                             'write to a Shared Drive or impersonate a user (domain-wide delegation).')
+        elif reason == 'permission':
+            app.logger.error(f'Google Drive permission denied for order #{order.id}: {str(e)}')
+        elif status is not None:
+            app.logger.error(f'Google Sheets API error {status} for order #{order.id}: {str(e)}')
         else:
-            # Fallback for when gspread exceptions aren't available
-            if '403' in error_msg or 'quota' in error_msg.lower() or 'storage' in error_msg.lower():
-                quota_error = 'Google Drive storage quota exceeded for order #{}. Please free up space in Google Drive or upgrade storage plan.'.format(order.id)
-                app.logger.error(quota_error)
-                print(f"[ERROR] Google Drive storage quota exceeded. Cannot create sheet for order #{order.id}")
-            else:
-                app.logger.error(f'Error creating Google Sheet for order #{order.id}: {error_msg}', exc_info=True)
-                print(f"[ERROR] Error creating Google Sheet: {error_msg}")
+            app.logger.error(f'Error creating Google Sheet for order #{order.id}: {str(e)}', exc_info=True)
         return None
 
-# Create tables
-with app.app_context():
-    db.create_all()
+def migrate_db():
+    """Create missing tables and apply pending schema migrations (``flask --app app migrate``)."""
+    with app.app_context():
+        db.create_all()
 
-    # Ensure legacy databases have the sheet_url column
-    try:
-        inspector = inspect(db.engine)
-        order_columns = [col['name'] for col in inspector.get_columns('order')]
-        if 'sheet_url' not in order_columns:
-            with db.engine.connect() as connection:
-                connection.execute(text('ALTER TABLE "order" ADD COLUMN sheet_url VARCHAR(500)'))
-    except Exception as e:
-        app.logger.warning(f'Could not verify/add sheet_url column: {str(e)}')
-    
-    # Ensure password_hash column is large enough for scrypt hashes (PostgreSQL migration)
-    # This runs BEFORE creating admin user to avoid errors
-    # Migration runs automatically on every deploy - no manual verification needed
-    try:
-        inspector = inspect(db.engine)
-        # Check if user table exists
-        if 'user' in inspector.get_table_names():
-            user_columns = {col['name']: col for col in inspector.get_columns('user')}
-            if 'password_hash' in user_columns:
-                password_hash_col = user_columns['password_hash']
-                col_type_str = str(password_hash_col['type'])
-                # Try to alter column - PostgreSQL will error if already correct, which is fine
-                # Check if it looks like a small VARCHAR (contains 120 or is short)
-                if '120' in col_type_str:
-                    app.logger.info(f'Updating password_hash column from {col_type_str} to VARCHAR(200)')
-                    with db.engine.connect() as connection:
-                        # Try to alter - if it fails because it's already correct, that's OK
-                        try:
-                            connection.execute(text('ALTER TABLE "user" ALTER COLUMN password_hash TYPE VARCHAR(200)'))
-                            connection.commit()
-                            app.logger.info('Successfully updated password_hash column size to 200')
-                        except Exception as alter_error:
-                            # Column might already be correct size - check and log
-                            if 'already' in str(alter_error).lower() or '200' in col_type_str:
-                                app.logger.info('Password hash column is already correct size')
-                            else:
-                                raise  # Re-raise if it's a different error
-    except Exception as e:
-        # If table doesn't exist yet, that's fine - db.create_all() will create it with correct size
-        app.logger.debug(f'Password hash column migration: {str(e)}')
-    
-    # Create/update default admin user
-    admin = User.query.filter_by(username='rtc').first()
-    if admin:
-        # Update existing admin password
-        admin.password_hash = generate_password_hash('rtc1336')
-        admin.role = 'admin'
-    else:
-        # Create new admin user
-        admin = User(
-            username='rtc',
-            password_hash=generate_password_hash('rtc1336'),
-            role='admin'
-        )
-        db.session.add(admin)
-    
-    db.session.commit()
+        # Bring existing tables up to date (columns, indexes, constraints) - see migrations.py
+        try:
+            run_migrations(db.engine, db.metadata, app.logger)
+        except Exception as e:
+            app.logger.error(f'Schema migration failed: {str(e)}', exc_info=True)
+
+def seed_admin(reset_password=False):
+    """Create the default admin user, or with reset_password=True restore its password and role."""
+    with app.app_context():
+        admin = User.query.filter_by(username='rtc').first()
+        if admin and not reset_password:
+            return
+        if admin:
+            admin.password_hash = generate_password_hash('rtc1336')
+            admin.role = 'admin'
+        else:
+            admin = User(
+                username='rtc',
+                password_hash=generate_password_hash('rtc1336'),
+                role='admin'
+            )
+            db.session.add(admin)
+        db.session.commit()
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Create tables, apply pending schema migrations and create the admin user if it is missing."""
+    migrate_db()
+    seed_admin()
+    print('Database schema is up to date.')
+
+@app.cli.command('seed-admin')
+def seed_admin_command():
+    """Create the default admin user or reset its password."""
+    seed_admin(reset_password=True)
+    print('Admin user rtc is ready.')
+
+def create_app():
+    """Return the application ready to serve; used by wsgi.py and ``python app.py``.
+
+    Startup only does what the first request needs. pandas, openpyxl and the
+    Google libraries are imported on first use, and the schema and admin
+    user are left alone: ``flask --app app migrate`` sets them up on deploy.
+    With AUTO_MIGRATE=true pending migrations are applied and a missing admin
+    user is created here instead.
+    """
+    if app.config['AUTO_MIGRATE']:
+        with app.app_context():
+            pending = pending_migrations(db.engine)
+        if pending:
+            app.logger.info(f'Pending schema migrations: {", ".join(pending)}')
+            migrate_db()
+        seed_admin()
+    with app.app_context():
+        schedule_retention_job()
+    if product_search.database_search:
+        with app.app_context():
+            product_search.database_search.install()
+    return app
 
 # WhatsApp notification function
-def send_whatsapp_notification(order_id, ba_username, total_amount, item_count, to_number=None):
-    """Send WhatsApp notification using Twilio Content Template API"""
+def send_whatsapp_notification(order_id, ba_username, total_amount, item_count, to_number=None, wait=False):
+    """Queue a new-order WhatsApp alert on the background dispatcher.
+    
+    Returns the alert's Future (resolving to the dispatcher's result) once it
+    is queued, or False if WhatsApp is not configured. With wait=True the alert
+    skips the coalescing window and the call returns whether Twilio accepted it.
+    """
     try:
-        import requests
-        from requests.auth import HTTPBasicAuth
-        
         account_sid = app.config['TWILIO_ACCOUNT_SID']
         auth_token = app.config['TWILIO_AUTH_TOKEN']
-        from_number = app.config['TWILIO_WHATSAPP_FROM']
-        content_sid = app.config['TWILIO_CONTENT_SID']
         
         # Use admin number if no specific number provided
         if not to_number:
@@ -518,54 +695,13 @@ def send_whatsapp_notification(order_id, ba_username, total_amount, item_count,
         masked_sid = f"{account_sid[:4]}...{account_sid[-4:]}" if len(account_sid) > 8 else "***"
         app.logger.debug(f"Using Twilio Account SID: {masked_sid}")
         
-        # Format number if needed (ensure it starts with whatsapp:)
-        if not to_number.startswith('whatsapp:'):
-            to_number = f'whatsapp:{to_number}'
+        if not wait:
+            return whatsapp_dispatcher.send_order_alert(ba_username, to_number, order_id=order_id)
         
-        # Send a simple text message instead of using the appointment template
         # Message: "YOU HAVE A NEW ORDER FROM (STORE NAME)"
-        message_body = f"YOU HAVE A NEW ORDER FROM {ba_username}"
-        
-        # Twilio API endpoint
-        url = f'https://api.twilio.com/2010-04-01/Accounts/{account_sid}/Messages.json'
-        
-        # Prepare data - using Body instead of ContentSid for simple text message
-        data = {
-            'To': to_number,
-            'From': from_number,
-            'Body': message_body
-        }
-        
-        # Send request with basic auth
-        response = requests.post(
-            url,
-            data=data,
-            auth=HTTPBasicAuth(account_sid, auth_token)
-        )
-        
-        if response.status_code == 201:
-            result = response.json()
-            success_msg = f'[SUCCESS] WhatsApp notification sent successfully! Message SID: {result.get("sid", "unknown")}'
-            app.logger.info(success_msg)
-            print(success_msg)  # Also print to console
-            return True
-        else:
-            error_data = response.json() if response.text else {}
-            error_code = error_data.get('code', 'unknown')
-            error_message = error_data.get('message', response.text)
-            
-            # Provide specific error messages
-            if response.status_code == 401:
-                if error_code == 20003:
-                    error_msg = f'[ERROR] Twilio Authentication Error: Invalid Account SID or Auth Token. Please check your TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN in environment variables or admin settings.'
-                else:
-                    error_msg = f'[ERROR] Twilio Authentication Error ({error_code}): {error_message}'
-            else:
-                error_msg = f'[ERROR] Twilio API error: {response.status_code} - {error_message}'
-            
-            app.logger.error(error_msg)
-            print(error_msg)  # Also print to console
-            return False
+        future = whatsapp_dispatcher.send_message(f"YOU HAVE A NEW ORDER FROM {ba_username}", to_number)
+        result = future.result(timeout=whatsapp_dispatcher.wait_timeout)
+        return result['success']
     
     except Exception as e:
         error_msg = f'[ERROR] Error sending WhatsApp notification: {str(e)}'
@@ -574,13 +710,241 @@ def send_whatsapp_notification(order_id, ba_username, total_amount, item_count,
             print(error_msg)  # Also print to console
         except UnicodeEncodeError:
             print(f"[ERROR] Error sending WhatsApp notification: {repr(e)}")
-        try:
-            import traceback
-            traceback.print_exc()
-        except UnicodeEncodeError:
-            pass
         return False
 
+def whatsapp_configured():
+    """True when Twilio credentials and the admin number are set."""
+    return bool(
+        app.config['TWILIO_ACCOUNT_SID'] and
+        app.config['TWILIO_AUTH_TOKEN'] and
+        app.config['ADMIN_WHATSAPP_NUMBER']
+    )
+
+# Background jobs - run by the outbox worker after the order transaction commits
+def run_order_sheet_job(payload):
+    """Create the Google Sheet backup for an order and store its URL."""
+    order = db.session.get(Order, payload['order_id'])
+    if not order:
+        app.logger.warning(f"Order #{payload['order_id']} no longer exists. Skipping Google Sheet.")
+        return
+    if order.sheet_url:
+        return
+    
+    # Orders placed a moment ago go first; older ones (retries, replays after an outage) use the backlog lane
+    age = datetime.utcnow() - (order.created_at or datetime.utcnow())
+    lane = BACKLOG if age > timedelta(seconds=app.config['GOOGLE_API_BACKLOG_AGE']) else INTERACTIVE
+    with google_rate_limiter.lane(lane):
+        sheet_url = create_order_spreadsheet(order, ba_username=payload.get('ba_username'))
+    if not sheet_url:
+        raise RuntimeError(f'Google Sheet was not created for order #{order.id}')
+    order.sheet_url = sheet_url
+    db.session.commit()
+
+def run_order_whatsapp_job(payload):
+    """Send the new-order WhatsApp alert to the admin.
+
+    Returns a Future, so the job finishes only once Twilio accepted the
+    (possibly coalesced) message and is retried by the outbox if it did not.
+    """
+    alert = send_whatsapp_notification(**payload)
+    if not alert:
+        raise RuntimeError(f"WhatsApp notification failed for order #{payload['order_id']}")
+    delivered = Future()
+
+    def settle(future):
+        result = future.result()
+        if result['success']:
+            delivered.set_result(result)
+        else:
+            delivered.set_exception(RuntimeError(
+                f"WhatsApp notification failed for order #{payload['order_id']}: {result.get('error')}"))
+
+    alert.add_done_callback(settle)
+    return delivered
+
+def make_whatsapp_sender():
+    """The configured WHATSAPP_BACKEND; None lets the dispatcher use Twilio itself."""
+    backend = app.config['WHATSAPP_BACKEND']
+    if backend == 'fake':
+        return FakeMessageSender(provider_faults)
+    if backend == 'stub':
+        return TwilioSender(app.config['PROVIDER_STUB_URL'], pool_size=app.config['WHATSAPP_WORKERS'])
+    if backend != 'twilio':
+        raise ValueError(f'Unknown WHATSAPP_BACKEND: {backend}')
+    return None
+
+whatsapp_dispatcher = WhatsAppDispatcher(
+    app,
+    workers=app.config['WHATSAPP_WORKERS'],
+    timeout=app.config['WHATSAPP_TIMEOUT'],
+    coalesce_window=app.config['WHATSAPP_COALESCE_WINDOW'],
+    sender=make_whatsapp_sender()
+)
+REGISTRY.gauges('oms_whatsapp', 'WhatsApp dispatcher queue and delivery counters.', whatsapp_dispatcher.metrics)
+
+outbox = OutboxWorker(
+    app, db, OutboxJob,
+    poll_interval=app.config['OUTBOX_POLL_INTERVAL'],
+    max_attempts=app.config['OUTBOX_MAX_ATTEMPTS']
+)
+outbox.register('order_sheet', run_order_sheet_job)
+outbox.register('order_whatsapp', run_order_whatsapp_job)
+
+def run_stock_import_job(payload):
+    """Import a staged stock file, committing and recording progress after every batch.
+
+    Batches that were committed stay committed if a later one fails; the
+    import only writes rows that differ, so uploading the file again finishes it.
+    """
+    from stock_import import (PENDING_CATALOG_VERSION, PhaseTimer, StockImportError, count_stock_rows,
+                              import_stock_batches, read_stock_batches, stamp_pending_catalog_version)
+    
+    job_id = payload['import_job_id']
+    job = db.session.get(ImportJob, job_id)
+    if not job or job.status in ('done', 'failed'):
+        return
+    staged_path, filename = job.staged_path, job.filename
+    job.status = 'running'
+    job.started_at = datetime.utcnow()
+    job.rows_total = count_stock_rows(staged_path, filename) if os.path.exists(staged_path) else None
+    db.session.commit()
+    timer = PhaseTimer()
+    
+    def commit_batch(summary, changed, reset):
+        # The batch's product rows are locked already; the version row and event lock come last,
+        # in the same order as place_order and delete_stock (see bump_catalog_version)
+        if changed:
+            catalog_version = bump_catalog_version(db, CatalogVersion, reset=reset)
+            stamp_pending_catalog_version(db, Product, catalog_version)
+            record_event(db, AdminEvent, 'stock.changed', {'catalog_version': catalog_version,
+                                                            'import_job_id': job_id})
+        db.session.get(ImportJob, job_id).record_progress(summary, timer.timings)
+        with timer.phase('commit'):
+            db.session.commit()
+        if changed:
+            catalog_cache.invalidate()
+            event_broker.notify()
+    
+    try:
+        if not os.path.exists(staged_path):
+            raise StockImportError('The uploaded file is no longer available. Please upload it again.')
+        with open(staged_path, 'rb') as stream:
+            summary = import_stock_batches(db, Product, read_stock_batches(stream, filename), timer,
+                                           delete_missing=job.delete_missing,
+                                           extra_values={'catalog_version': PENDING_CATALOG_VERSION},
+                                           on_batch=commit_batch)
+        job = db.session.get(ImportJob, job_id)
+        job.status = 'done'
+        app.logger.info(f'Stock import #{job_id} ({filename}): {summary.counts()} timings_ms={timer.timings}')
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(ImportJob, job_id)
+        job.status = 'failed'
+        job.last_error = str(e)[:2000]
+        app.logger.error(f'Stock import #{job_id} ({filename}) failed: {str(e)}',
+                         exc_info=not isinstance(e, StockImportError))
+    job.finished_at = datetime.utcnow()
+    record_event(db, AdminEvent, 'import.finished', job.to_dict())
+    db.session.commit()
+    event_broker.notify()
+    try:
+        os.remove(staged_path)
+    except OSError:
+        pass
+
+# A separate worker, so a long import never holds up order sheets and alerts
+import_worker = OutboxWorker(
+    app, db, OutboxJob,
+    poll_interval=app.config['OUTBOX_POLL_INTERVAL'],
+    lease_timeout=app.config['IMPORT_LEASE_TIMEOUT']
+)
+import_worker.register('stock_import', run_stock_import_job)
+
+def schedule_retention_job(delay=0):
+    """Queue the retention job unless a run is already waiting; each run queues the next one."""
+    waiting = db.session.query(OutboxJob.id).filter(OutboxJob.kind == 'retention', OutboxJob.status == 'pending').first()
+    if not waiting:
+        outbox.enqueue('retention', {}, delay=delay)
+        db.session.commit()
+
+def run_retention_job(payload):
+    """Delete read notifications and dashboard events past their retention period, in batches."""
+    now = datetime.utcnow()
+    notifications_deleted = 0
+    if app.config['NOTIFICATION_RETENTION_DAYS'] > 0:
+        cutoff = now - timedelta(days=app.config['NOTIFICATION_RETENTION_DAYS'])
+        notifications_deleted = delete_in_batches(db, Notification, [
+            Notification.read == true(), Notification.created_at < cutoff
+        ])
+    # The newest event is always kept, so event ids (and the unread count cache keyed on them) never repeat
+    newest_event = db.session.query(db.func.max(AdminEvent.id)).scalar() or 0
+    events_deleted = delete_in_batches(db, AdminEvent, [
+        AdminEvent.created_at < now - timedelta(hours=app.config['EVENT_RETENTION_HOURS']),
+        AdminEvent.id < newest_event
+    ])
+    if notifications_deleted or events_deleted:
+        app.logger.info(f'Retention: deleted {notifications_deleted} read notifications and {events_deleted} dashboard events')
+    schedule_retention_job(delay=app.config['RETENTION_INTERVAL'])
+
+outbox.register('retention', run_retention_job)
+
+def warm_product_search():
+    with app.app_context():
+        try:
+            product_search.warm()
+        except Exception as e:
+            app.logger.warning(f'Could not prebuild the product search index: {str(e)}')
+
+_background_lock = threading.Lock()
+_background_pid = None
+
+def start_background_workers():
+    """Start the WhatsApp dispatcher and outbox worker threads in this process, and prebuild the search index.
+
+    Threads do not survive fork, so they are started in each serving process
+    (gunicorn's post_fork hook, or the first request) and never at import.
+    """
+    global _background_pid
+    if _background_pid == os.getpid():
+        return
+    with _background_lock:
+        if _background_pid == os.getpid():
+            return
+        whatsapp_dispatcher.start()
+        event_broker.start()
+        google_credentials.start()
+        threading.Thread(target=warm_product_search, name='search-warmup', daemon=True).start()
+        if app.config['OUTBOX_WORKER_ENABLED']:
+            outbox.start()
+            import_worker.start()
+        _background_pid = os.getpid()
+        atexit.register(stop_background_workers)
+
+def stop_background_workers(timeout=None):
+    """Graceful shutdown: finish the in-flight outbox job, then send every queued WhatsApp message.
+
+    Jobs still pending stay in the outbox table for the next worker, and an
+    alert job whose message was not sent is retried once its lease expires. An import
+    cut off by the timeout is run again once its lease expires. Open event
+    streams end at once; browsers reconnect to another worker.
+    """
+    global _background_pid
+    with _background_lock:
+        if _background_pid != os.getpid():
+            return
+        _background_pid = None
+    event_broker.stop(timeout)
+    google_credentials.stop(timeout)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    outbox.stop(timeout)
+    import_worker.stop(None if deadline is None else max(0, deadline - time.monotonic()))
+    whatsapp_dispatcher.stop(None if deadline is None else max(0, deadline - time.monotonic()))
+    app.logger.info('Background workers stopped')
+
+@app.before_request
+def ensure_background_workers():
+    start_background_workers()
+
 # File upload functions removed - files are not sent via WhatsApp
 # Users can download Excel files from the admin dashboard instead
 
@@ -637,23 +1001,17 @@ def order_page():
     if 'user_id' not in session or session.get('role') == 'admin':
         return redirect(url_for('login'))
     
-    products = Product.query.all()
-    product_data = [{
-        'id': product.id,
-        'lot_type_code': product.lot_type_code,
-        'parent_code': product.parent_code,
-        'item_lot_type': product.item_lot_type,
-        'quantity_available': product.quantity_available,
-        'mrp': product.mrp
-    } for product in products]
-    return render_template('order.html', products=product_data)
+    catalog = catalog_cache.get()
+    return render_template('order.html', products_json=catalog.json, catalog_version=catalog.version)
 
 @app.route('/my_orders')
 def my_orders():
     if 'user_id' not in session or session.get('role') != 'ba':
         return redirect(url_for('login'))
     
-    orders = Order.query.filter_by(user_id=session['user_id']).order_by(Order.created_at.desc()).all()
+    orders = (Order.query.filter_by(user_id=session['user_id'])
+              .options(selectinload(Order.items))
+              .order_by(Order.created_at.desc()).all())
     return render_template('my_orders.html', orders=orders)
 
 @app.route('/api/save_cart', methods=['POST'])
@@ -739,16 +1097,63 @@ def clear_saved_cart():
 
 @app.route('/api/products')
 def get_products():
-    """API endpoint to get all products with current quantities"""
-    products = Product.query.all()
-    return jsonify([{
-        'id': p.id,
-        'lot_type_code': p.lot_type_code,
-        'parent_code': p.parent_code,
-        'item_lot_type': p.item_lot_type,
-        'quantity_available': p.quantity_available,
-        'mrp': p.mrp if p.mrp is not None and p.mrp == p.mrp else None
-    } for p in products])
+    """API endpoint to get all products with current quantities.
+    
+    Responses carry an ETag of the catalog version, so unchanged catalogs cost a 304.
+    With ?since=<version> only products changed after that version are returned, as
+    {"version", "full", "products"}; "full" is true when the client must replace its list.
+    """
+    catalog = catalog_cache.get()
+    since = request.args.get('since', type=int)
+    etag = catalog_etag(catalog.version, since)
+    
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    elif since is None:
+        response = app.response_class(catalog.json, mimetype='application/json')
+    else:
+        full = since < catalog.reset_version or since > catalog.version
+        entries = catalog.entries if full else catalog.changed_since(since)
+        body = '{"version":%d,"full":%s,"products":[%s]}' % (
+            catalog.version, 'true' if full else 'false', ','.join(entry.json for entry in entries)
+        )
+        response = app.response_class(body, mimetype='application/json')
+    
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Catalog-Version'] = str(catalog.version)
+    return response
+
+@app.route('/api/products/search')
+def search_products():
+    """Ranked product search: ?q=<text>&limit=<n>&offset=<n>.
+    
+    Every word must match lot type code, parent code or item type (words of
+    three or more characters anywhere, shorter ones as a prefix); the in-memory
+    backend also matches MRP. Returns {"version", "total", "next_offset",
+    "products"} with current stock.
+    """
+    query = request.args.get('q', '').strip()
+    try:
+        limit = parse_page_size(request.args.get('limit'), default=50, maximum=200)
+        offset = int(request.args.get('offset') or 0)
+        if offset < 0:
+            raise ValueError
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+    except ValueError:
+        return jsonify({'error': 'offset must be a non-negative integer'}), 400
+    
+    catalog, total, entries = product_search.search(query, limit, offset)
+    next_offset = offset + limit if offset + limit < total else None
+    body = '{"version":%d,"total":%d,"next_offset":%s,"products":[%s]}' % (
+        catalog.version, total, 'null' if next_offset is None else next_offset,
+        ','.join(entry.json for entry in entries)
+    )
+    response = app.response_class(body, mimetype='application/json')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Search-Backend'] = product_search.backend
+    return response
 
 @app.route('/api/place_order', methods=['POST'])
 def place_order():
@@ -768,32 +1173,23 @@ def place_order():
         if not order_items:
             return jsonify({'error': 'No items in order'}), 400
         
-        # Validate quantities and calculate total
+        # Reserve stock for the whole cart: one query for all products, then a
+        # conditional decrement per line so concurrent orders can never oversell
+        try:
+            lines = merge_cart_lines(order_items)
+            reserved = reserve_stock(db, Product, lines) if lines else []
+        except ReservationError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e), 'shortages': e.shortages}), 400
+        
         total_amount = 0
         order_data = []
-        
-        for item in order_items:
-            product_id = item.get('product_id')
-            quantity = item.get('quantity', 0)
-            
-            if quantity <= 0:
-                continue
-            
-            if not product_id:
-                return jsonify({'error': 'Invalid product ID'}), 400
-            
-            product = db.session.get(Product, product_id)
-            if not product:
-                return jsonify({'error': f'Product {product_id} not found'}), 400
-            
-            if quantity > product.quantity_available:
-                return jsonify({'error': f'Insufficient stock for {product.lot_type_code}. Available: {product.quantity_available}'}), 400
-            
+        for product, quantity in reserved:
             item_total = quantity * (product.mrp or 0)
             total_amount += item_total
             
             order_data.append({
-                'product_id': product_id,
+                'product_id': product.id,
                 'lot_type_code': product.lot_type_code,
                 'parent_code': product.parent_code,
                 'item_lot_type': product.item_lot_type,
@@ -801,9 +1197,6 @@ def place_order():
                 'mrp': product.mrp,
                 'total': item_total
             })
-            
-            # Update product quantity
-            product.quantity_available -= quantity
         
         if not order_data:
             return jsonify({'error': 'No valid items in order'}), 400
@@ -817,6 +1210,7 @@ def place_order():
         )
         db.session.add(order)
         db.session.flush()  # Get order.id before commit
+        db.session.bulk_insert_mappings(OrderItem, [dict(item, order_id=order.id) for item in order_data])
         
         # Create notification for admin
         notification = Notification(
@@ -825,26 +1219,38 @@ def place_order():
         )
         db.session.add(notification)
 
-        # Create dedicated Google Sheet for this order (if configured)
-        sheet_url = None
-        if app.config.get('GOOGLE_SERVICE_ACCOUNT_JSON') or app.config.get('GOOGLE_SERVICE_ACCOUNT_FILE'):
-            try:
-                sheet_url = create_order_spreadsheet(order, ba_username=session.get('username', 'Unknown BA'))
-                if sheet_url:
-                    order.sheet_url = sheet_url
-            except Exception as sheet_error:
-                app.logger.error(f'Error creating Google Sheet (order will still be saved): {str(sheet_error)}', exc_info=True)
-                # Continue even if sheet creation fails - order should still be saved
+        # Queue the Google Sheet backup and WhatsApp alert in the same transaction as the order.
+        # The outbox worker runs them after commit; order.sheet_url is filled in when the sheet exists.
+        if sheets_configured():
+            outbox.enqueue('order_sheet', {
+                'order_id': order.id,
+                'ba_username': session.get('username', 'Unknown BA')
+            })
+        if whatsapp_configured():
+            outbox.enqueue('order_whatsapp', {
+                'order_id': order.id,
+                'ba_username': session['username'],
+                'total_amount': total_amount,
+                'item_count': len(order_data)
+            })
+        else:
+            app.logger.warning('WhatsApp not configured. Skipping order notification.')
+        
+        db.session.flush()  # notification.id for the dashboard event
+        # Bumped last (see bump_catalog_version): the shared version row stays locked only until commit
+        catalog_version = bump_catalog_version(db, CatalogVersion)
+        stamp_catalog_version(db, Product, [product.id for product, _ in reserved], catalog_version)
+        record_event(db, AdminEvent, 'order.created', {
+            'order': dict(order_summary(order, include_items=False), order_data=order_data),
+            'notification': notification_summary(notification)
+        })
         
+        # Capture the new stock for the catalog cache before commit expires the objects
+        cache_entries = [CatalogEntry.from_product(product, catalog_version) for product, _ in reserved]
         db.session.commit()
-        
-        # Send WhatsApp notification
-        send_whatsapp_notification(
-            order_id=order.id,
-            ba_username=session['username'],
-            total_amount=total_amount,
-            item_count=len(order_data)
-        )
+        catalog_cache.write_through(catalog_version, cache_entries)
+        outbox.notify()
+        event_broker.notify()
         
         return jsonify({
             'success': True,
@@ -862,11 +1268,8 @@ def admin_dashboard():
     if 'user_id' not in session or session.get('role') != 'admin':
         return redirect(url_for('login'))
     
-    orders = Order.query.order_by(Order.created_at.desc()).all()
-    notifications = Notification.query.filter_by(read=False).order_by(Notification.created_at.desc()).all()
-    products = Product.query.all()
-    
-    return render_template('admin_dashboard.html', orders=orders, notifications=notifications, products=products)
+    # Orders, notifications and products are fetched page by page by the dashboard's JavaScript
+    return render_template('admin_dashboard.html')
 
 @app.route('/admin/upload_stock', methods=['POST'])
 def upload_stock():
@@ -881,104 +1284,93 @@ def upload_stock():
     if file.filename == '':
         return jsonify({'error': 'No file selected'}), 400
     
-    if file and file.filename.endswith(('.xlsx', '.xls')):
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        
-        try:
-            # Read Excel file
-            df = pd.read_excel(filepath)
-            
-            # Expected columns: Lot Type Code, Parent Code, Item Lot Type: Lot Type, Quantity Available, MRP
-            # Handle different possible column names
-            column_mapping = {}
-            for col in df.columns:
-                col_lower = str(col).lower()
-                if 'lot type code' in col_lower or 'lot_type_code' in col_lower:
-                    column_mapping['lot_type_code'] = col
-                elif 'parent code' in col_lower or 'parent_code' in col_lower:
-                    column_mapping['parent_code'] = col
-                elif 'item lot type' in col_lower or 'item_lot_type' in col_lower:
-                    column_mapping['item_lot_type'] = col
-                elif 'quantity' in col_lower and 'available' in col_lower:
-                    column_mapping['quantity_available'] = col
-                elif 'mrp' in col_lower:
-                    column_mapping['mrp'] = col
-            
-            if 'lot_type_code' not in column_mapping:
-                return jsonify({'error': 'Lot Type Code column not found'}), 400
-            
-            updated_count = 0
-            created_count = 0
-            
-            for _, row in df.iterrows():
-                lot_type_code = str(row[column_mapping['lot_type_code']]).strip()
-                
-                if pd.isna(lot_type_code) or lot_type_code == '':
-                    continue
-                
-                parent_code = str(row[column_mapping.get('parent_code', '')]).strip() if 'parent_code' in column_mapping else None
-                item_lot_type = str(row[column_mapping.get('item_lot_type', '')]).strip() if 'item_lot_type' in column_mapping else None
-                
-                quantity = 0
-                if 'quantity_available' in column_mapping:
-                    try:
-                        quantity = int(float(row[column_mapping['quantity_available']]))
-                    except:
-                        quantity = 0
-                
-                mrp = None
-                if 'mrp' in column_mapping:
-                    try:
-                        val = row[column_mapping['mrp']]
-                        if pd.isna(val):
-                            mrp = None
-                        else:
-                            mrp = float(val)
-                    except:
-                        mrp = None
-                
-                # Check if product exists
-                product = Product.query.filter_by(lot_type_code=lot_type_code).first()
-                
-                if product:
-                    # Update existing product
-                    if 'parent_code' in column_mapping:
-                        product.parent_code = parent_code if parent_code and parent_code != 'nan' else product.parent_code
-                    if 'item_lot_type' in column_mapping:
-                        product.item_lot_type = item_lot_type if item_lot_type and item_lot_type != 'nan' else product.item_lot_type
-                    product.quantity_available = quantity
-                    if 'mrp' in column_mapping and mrp is not None:
-                        product.mrp = mrp
-                    product.updated_at = datetime.utcnow()
-                    updated_count += 1
-                else:
-                    # Create new product
-                    product = Product(
-                        lot_type_code=lot_type_code,
-                        parent_code=parent_code if parent_code and parent_code != 'nan' else None,
-                        item_lot_type=item_lot_type if item_lot_type and item_lot_type != 'nan' else None,
-                        quantity_available=quantity,
-                        mrp=mrp
-                    )
-                    db.session.add(product)
-                    created_count += 1
-            
-            db.session.commit()
-            
-            # Clean up uploaded file
-            os.remove(filepath)
-            
-            return jsonify({
-                'success': True,
-                'message': f'Stock updated successfully! Created: {created_count}, Updated: {updated_count}'
-            })
-            
-        except Exception as e:
-            return jsonify({'error': f'Error processing file: {str(e)}'}), 500
+    # pandas and openpyxl are imported on first use to keep them out of worker startup
+    from stock_import import STOCK_EXTENSIONS, PhaseTimer, StockImportError, import_stock_batches, read_stock_batches
+    
+    if not file.filename.lower().endswith(STOCK_EXTENSIONS):
+        return jsonify({'error': 'Invalid file format. Please upload an Excel (.xlsx or .xls) or CSV file'}), 400
+    
+    dry_run = request.values.get('dry_run', '0').lower() in ('1', 'true')
+    delete_missing = request.values.get('delete_missing', '0').lower() in ('1', 'true')
+    
+    if not dry_run:
+        return start_stock_import(file, delete_missing)
+    
+    # Previews run in the request and only read: batches are diffed against the products, never written
+    try:
+        timer = PhaseTimer()
+        # Read straight from the upload; Werkzeug spools large uploads to an anonymous temp file
+        # Expected columns: Lot Type Code, Parent Code, Item Lot Type: Lot Type, Quantity Available, MRP
+        batches = read_stock_batches(file.stream, file.filename)
+        summary = import_stock_batches(db, Product, batches, timer, delete_missing=delete_missing, dry_run=True)
+        db.session.rollback()  # end the read transaction
+        result = summary.counts()
+        return jsonify({
+            'success': True,
+            'dry_run': True,
+            'message': (f'Preview: {result["created"]} new, {result["updated"]} changed, '
+                        f'{result["deleted"]} to delete, {result["unchanged"]} unchanged'),
+            **result,
+            'preview': summary.preview(),
+            'errors': summary.errors,
+            'timings_ms': timer.timings
+        })
+    
+    except StockImportError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Error processing file: {str(e)}'}), 500
+    finally:
+        file.close()
+
+def start_stock_import(file, delete_missing):
+    """Stage the upload and queue an import job; the admin polls /admin/import_jobs/<id>."""
+    folder = app.config['IMPORT_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    extension = os.path.splitext(file.filename.lower())[1]
+    staged_path = os.path.join(folder, f'import_{uuid.uuid4().hex}{extension}')
+    try:
+        file.save(staged_path)
+        job = ImportJob(
+            user_id=session['user_id'],
+            filename=file.filename[:255],
+            staged_path=staged_path,
+            delete_missing=delete_missing,
+            status='queued'
+        )
+        db.session.add(job)
+        db.session.flush()
+        import_worker.enqueue('stock_import', {'import_job_id': job.id})
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        if os.path.exists(staged_path):
+            os.remove(staged_path)
+        app.logger.error(f'Error queuing stock import: {str(e)}', exc_info=True)
+        return jsonify({'error': f'Error processing file: {str(e)}'}), 500
+    finally:
+        file.close()
+    
+    import_worker.notify()
+    return jsonify({
+        'success': True,
+        'message': 'Import started',
+        'job_id': job.id,
+        'status_url': url_for('import_job_status', job_id=job.id)
+    }), 202
+
+@app.route('/admin/import_jobs/<int:job_id>')
+def import_job_status(job_id):
+    """Progress of a stock import: rows processed, counts, row errors and throughput."""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
     
-    return jsonify({'error': 'Invalid file format. Please upload Excel file (.xlsx or .xls)'}), 400
+    job = db.session.get(ImportJob, job_id)
+    if not job:
+        return jsonify({'error': 'Import job not found'}), 404
+    return jsonify(job.to_dict())
 
 
 @app.route('/admin/delete_stock', methods=['DELETE'])
@@ -987,8 +1379,13 @@ def delete_stock():
         return jsonify({'error': 'Unauthorized'}), 401
 
     try:
+        # Products first, then the version row: the lock order every stock writer uses
         deleted_rows = Product.query.delete()
+        catalog_version = bump_catalog_version(db, CatalogVersion, reset=True)
+        record_event(db, AdminEvent, 'stock.changed', {'catalog_version': catalog_version, 'reset': True})
         db.session.commit()
+        catalog_cache.reset(catalog_version)
+        event_broker.notify()
         return jsonify({
             'success': True,
             'message': f'Stock cleared. Removed {deleted_rows} products.'
@@ -998,47 +1395,262 @@ def delete_stock():
         app.logger.error(f'Error deleting stock: {str(e)}', exc_info=True)
         return jsonify({'error': 'Error deleting stock. Please try again.'}), 500
 
-@app.route('/admin/orders')
-def admin_orders():
-    if 'user_id' not in session or session.get('role') != 'admin':
-        return jsonify({'error': 'Unauthorized'}), 401
-    
-    orders = Order.query.order_by(Order.created_at.desc()).all()
-    return jsonify([{
+def order_filter_criteria(args):
+    """SQL criteria for the ``status``, ``ba``, ``date_from``/``date_to`` and ``ids`` query parameters."""
+    criteria = []
+    start, end = parse_date_range(args.get('date_from'), args.get('date_to'))
+    if args.get('status'):
+        criteria.append(Order.status == args['status'])
+    if args.get('ba'):
+        criteria.append(Order.user_id == db.session.query(User.id).filter_by(username=args['ba']).scalar_subquery())
+    if start:
+        criteria.append(Order.created_at >= start)
+    if end:
+        criteria.append(Order.created_at < end)
+    if args.get('ids'):
+        try:
+            ids = [int(order_id) for order_id in args['ids'].split(',') if order_id.strip()]
+        except ValueError:
+            raise PaginationError('ids must be a comma-separated list of order IDs')
+        criteria.append(Order.id.in_(ids))
+    return criteria
+
+def order_summary(order, include_items=True):
+    """Admin listing row for an order; ``include_items=False`` leaves out the line items."""
+    summary = {
         'id': order.id,
         'username': order.user.username,
-        'order_data': json.loads(order.order_data),
         'total_amount': order.total_amount,
         'status': order.status,
         'sheet_url': order.sheet_url,
         'created_at': order.created_at.strftime('%Y-%m-%d %H:%M:%S')
-    } for order in orders])
+    }
+    if include_items:
+        summary['order_data'] = order.line_items
+    return summary
+
+@app.route('/admin/orders')
+def admin_orders():
+    """One page of orders, newest first.
+
+    Query parameters: ``limit`` (default 50, max 200), ``cursor`` (the
+    ``next_cursor`` of the previous page), ``status``, ``ba`` (username),
+    ``date_from``/``date_to`` (YYYY-MM-DD, inclusive), ``ids`` and
+    ``summary=1`` to leave out the line items.
+    """
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        limit = parse_page_size(request.args.get('limit'))
+        query = Order.query.filter(*order_filter_criteria(request.args)).options(joinedload(Order.user))
+        include_items = request.args.get('summary') not in ('1', 'true')
+        if include_items:
+            query = query.options(selectinload(Order.items))
+        orders, next_cursor = keyset_page(query, Order.created_at, Order.id, request.args.get('cursor'), limit)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'orders': [order_summary(order, include_items) for order in orders],
+        'next_cursor': next_cursor
+    })
+
+def mark_orders_downloaded(criteria, max_id):
+    """Mark every exported pending order as downloaded with one UPDATE and commit."""
+    updated = (Order.query
+               .filter(*criteria, Order.id <= max_id, Order.status == 'pending')
+               .update({'status': 'downloaded'}, synchronize_session=False))
+    db.session.commit()
+    return updated
+
+@app.route('/admin/export_orders')
+def export_orders():
+    """Download the line items of many orders as one XLSX (default) or CSV file.
+
+    Orders are selected with the same filters as /admin/orders. Exported
+    pending orders are marked downloaded unless ``mark_downloaded=0``.
+    """
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        criteria = order_filter_criteria(request.args)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+    export_format = request.args.get('format', 'xlsx').lower()
+    if export_format not in ('xlsx', 'csv'):
+        return jsonify({'error': 'format must be xlsx or csv'}), 400
+    mark_downloaded = request.args.get('mark_downloaded', '1') not in ('0', 'false')
+    
+    # Orders placed while the export runs are left out, so the status UPDATE covers exactly what was exported
+    max_id = db.session.query(db.func.max(Order.id)).scalar() or 0
+    rows = iter_export_rows(db, Order, criteria, max_id)
+    filename = f'orders_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{export_format}'
+    
+    if export_format == 'csv':
+        def generate():
+            yield from iter_csv(rows)
+            if mark_downloaded:
+                mark_orders_downloaded(criteria, max_id)
+        
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
+    
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        write_xlsx(rows, path)
+        if mark_downloaded:
+            mark_orders_downloaded(criteria, max_id)
+    except Exception as e:
+        db.session.rollback()
+        os.remove(path)
+        app.logger.error(f'Error exporting orders: {str(e)}', exc_info=True)
+        return jsonify({'error': f'Error generating export: {str(e)}'}), 500
+    
+    return Response(
+        iter_file_then_remove(path),
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        headers={
+            'Content-Disposition': f'attachment; filename={filename}',
+            'Content-Length': str(os.path.getsize(path))
+        }
+    )
+
+@app.route('/admin/reports/product_demand')
+def product_demand_report():
+    """Ordered quantity and value per product, aggregated in SQL from order_item.
+
+    Accepts the same order filters as /admin/orders.
+    """
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        criteria = order_filter_criteria(request.args)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    query = (db.session.query(
+        OrderItem.lot_type_code,
+        db.func.sum(OrderItem.quantity),
+        db.func.sum(OrderItem.total),
+        db.func.count(db.distinct(OrderItem.order_id))
+    ).join(Order, Order.id == OrderItem.order_id).filter(*criteria))
+    rows = query.group_by(OrderItem.lot_type_code).order_by(db.func.sum(OrderItem.quantity).desc()).all()
+    return jsonify([{
+        'lot_type_code': code,
+        'quantity': int(quantity or 0),
+        'total_amount': round(total or 0, 2),
+        'orders': orders
+    } for code, quantity, total, orders in rows])
+
+def notification_summary(notification):
+    return {
+        'id': notification.id,
+        'order_id': notification.order_id,
+        'message': notification.message,
+        'read': bool(notification.read),
+        'created_at': notification.created_at.strftime('%Y-%m-%d %H:%M:%S')
+    }
 
 @app.route('/admin/notifications')
 def admin_notifications():
+    """One page of notifications, newest first, and the unread count.
+
+    Query parameters: ``limit`` (default 50, max 200), ``cursor`` (the
+    ``next_cursor`` of the previous page) and ``unread=1`` for unread only.
+    """
     if 'user_id' not in session or session.get('role') != 'admin':
         return jsonify({'error': 'Unauthorized'}), 401
     
-    notifications = Notification.query.order_by(Notification.created_at.desc()).limit(50).all()
-    return jsonify([{
-        'id': n.id,
-        'order_id': n.order_id,
-        'message': n.message,
-        'read': n.read,
-        'created_at': n.created_at.strftime('%Y-%m-%d %H:%M:%S')
-    } for n in notifications])
+    try:
+        limit = parse_page_size(request.args.get('limit'))
+        query = Notification.query
+        if request.args.get('unread') in ('1', 'true'):
+            query = query.filter(Notification.read == false())
+        notifications, next_cursor = keyset_page(query, Notification.created_at, Notification.id,
+                                                 request.args.get('cursor'), limit)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'notifications': [notification_summary(n) for n in notifications],
+        'next_cursor': next_cursor,
+        'unread_count': unread_counter.get()
+    })
+
+@app.route('/admin/notifications/unread_count')
+def unread_notification_count():
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify({'unread_count': unread_counter.get()})
 
 @app.route('/admin/mark_notification_read/<int:notification_id>', methods=['POST'])
 def mark_notification_read(notification_id):
     if 'user_id' not in session or session.get('role') != 'admin':
         return jsonify({'error': 'Unauthorized'}), 401
     
-    notification = Notification.query.get_or_404(notification_id)
-    notification.read = True
+    if mark_notifications_read(db, Notification, notification_id=notification_id):
+        record_event(db, AdminEvent, 'notification.read', {'id': notification_id})
+    elif not db.session.query(Notification.id).filter_by(id=notification_id).first():
+        return jsonify({'error': 'Notification not found'}), 404
     db.session.commit()
+    event_broker.notify()
     
     return jsonify({'success': True})
 
+@app.route('/admin/notifications/mark_read', methods=['POST'])
+def mark_notifications_read_up_to():
+    """Mark every notification up to ``up_to_id`` (the newest one the admin has seen) read with one UPDATE."""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        up_to_id = int(data.get('up_to_id'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'up_to_id must be a notification ID'}), 400
+    
+    updated = mark_notifications_read(db, Notification, up_to_id=up_to_id)
+    if updated:
+        record_event(db, AdminEvent, 'notifications.read', {'up_to_id': up_to_id})
+    db.session.commit()
+    event_broker.notify()
+    
+    return jsonify({'success': True, 'updated': updated, 'unread_count': unread_counter.get()})
+
+@app.route('/admin/events')
+def admin_events():
+    """Server-Sent Events stream of dashboard changes.
+
+    Resumes after the ``Last-Event-ID`` header (sent by the browser when it
+    reconnects) or the ``last_event_id`` query parameter. Answers 503 when
+    this worker already serves EVENT_STREAM_MAX_CLIENTS streams.
+    """
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    
+    stream = event_broker.open_stream(last_event_id)
+    if stream is None:
+        response = jsonify({'error': 'Too many open event streams, try again later'})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+    response = Response(stream, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # no proxy buffering of the stream
+    return response
+
 @app.route('/admin/create_ba', methods=['POST'])
 def create_ba():
     if 'user_id' not in session or session.get('role') != 'admin':
@@ -1069,10 +1681,12 @@ def download_order(order_id):
     if 'user_id' not in session or session.get('role') != 'admin':
         return jsonify({'error': 'Unauthorized'}), 401
     
+    import pandas as pd
+    
     try:
         # Get the specific order
         order = Order.query.get_or_404(order_id)
-        order_items = json.loads(order.order_data)
+        order_items = order.line_items
         ba_username = order.user.username
         
         # Prepare data for Excel
@@ -1129,7 +1743,9 @@ def delete_order(order_id):
         Notification.query.filter_by(order_id=order_id).delete()
         
         db.session.delete(order)
+        record_event(db, AdminEvent, 'order.deleted', {'id': order_id})
         db.session.commit()
+        event_broker.notify()
         
         return jsonify({'success': True, 'message': 'Order deleted successfully'})
     
@@ -1138,14 +1754,46 @@ def delete_order(order_id):
         app.logger.error(f'Error deleting order: {str(e)}', exc_info=True)
         return jsonify({'error': f'Error deleting order: {str(e)}'}), 500
 
+@app.route('/admin/jobs')
+def admin_jobs():
+    """Background job queue status: counts per status and the latest failures."""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    counts = dict(db.session.query(OutboxJob.status, db.func.count(OutboxJob.id)).group_by(OutboxJob.status).all())
+    failed = OutboxJob.query.filter_by(status='failed').order_by(OutboxJob.id.desc()).limit(20).all()
+    return jsonify({
+        'counts': counts,
+        'failed': [{
+            'id': job.id,
+            'kind': job.kind,
+            'payload': json.loads(job.payload),
+            'attempts': job.attempts,
+            'last_error': job.last_error,
+            'created_at': job.created_at.strftime('%Y-%m-%d %H:%M:%S')
+        } for job in failed]
+    })
+
+@app.route('/admin/jobs/retry', methods=['POST'])
+def retry_failed_jobs():
+    """Put failed background jobs back on the queue."""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    retried = OutboxJob.query.filter_by(status='failed').update({
+        'status': 'pending',
+        'attempts': 0,
+        'run_after': datetime.utcnow()
+    })
+    db.session.commit()
+    outbox.notify()
+    return jsonify({'success': True, 'message': f'Requeued {retried} failed jobs.'})
+
 @app.route('/admin/whatsapp/test', methods=['POST'])
 def test_whatsapp():
     if 'user_id' not in session or session.get('role') != 'admin':
         return jsonify({'error': 'Unauthorized'}), 401
     
-    import requests
-    from requests.auth import HTTPBasicAuth
-    
     data = request.json
     account_sid = data.get('account_sid', '')
     auth_token = data.get('auth_token', '')
@@ -1157,37 +1805,20 @@ def test_whatsapp():
         if not account_sid or not auth_token or not from_number or not to_number or not content_sid:
             return jsonify({'error': 'All fields are required'}), 400
         
-        # Format numbers
-        if not from_number.startswith('whatsapp:'):
-            from_number = f'whatsapp:{from_number}'
-        if not to_number.startswith('whatsapp:'):
-            to_number = f'whatsapp:{to_number}'
-        
-        # Send a simple text message for testing
-        message_body = "YOU HAVE A NEW ORDER FROM TEST STORE"
-        
-        # Twilio API endpoint
-        url = f'https://api.twilio.com/2010-04-01/Accounts/{account_sid}/Messages.json'
-        
-        # Prepare data - using Body instead of ContentSid for simple text message
-        post_data = {
-            'To': to_number,
-            'From': from_number,
-            'Body': message_body
-        }
-        
-        # Send request with basic auth
-        response = requests.post(
-            url,
-            data=post_data,
-            auth=HTTPBasicAuth(account_sid, auth_token)
+        # Send a simple text message for testing through the same dispatcher as order alerts
+        future = whatsapp_dispatcher.send_message(
+            "YOU HAVE A NEW ORDER FROM TEST STORE",
+            to_number,
+            from_number=from_number,
+            account_sid=account_sid,
+            auth_token=auth_token
         )
+        result = future.result(timeout=whatsapp_dispatcher.wait_timeout)
         
-        if response.status_code == 201:
-            result = response.json()
+        if result['success']:
             return jsonify({'success': True, 'message': f'Test message sent! Message SID: {result.get("sid", "unknown")}'})
         else:
-            return jsonify({'error': f'Twilio API error: {response.status_code} - {response.text}'}), 500
+            return jsonify({'error': result.get('error', 'Twilio API error')}), 500
     
     except Exception as e:
         return jsonify({'error': f'Error sending test message: {str(e)}'}), 500
@@ -1217,7 +1848,8 @@ def save_whatsapp_settings():
         order_id=999,
         ba_username="TEST",
         total_amount=0.00,
-        item_count=0
+        item_count=0,
+        wait=True
     )
     
     if test_result:
@@ -1231,12 +1863,42 @@ def save_whatsapp_settings():
             'message': 'Settings saved but test message failed. Check the console/terminal for error details.'
         })
 
+@app.route('/admin/whatsapp/metrics', methods=['GET'])
+def whatsapp_metrics():
+    """WhatsApp dispatcher queue depth, delivery counts and latency."""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return jsonify(whatsapp_dispatcher.metrics())
+
+@app.route('/admin/metrics', methods=['GET'])
+def admin_metrics():
+    """Prometheus metrics for this worker process (admin session or ``Authorization: Bearer $METRICS_TOKEN``)."""
+    token = app.config.get('METRICS_TOKEN')
+    authorized = session.get('role') == 'admin' and 'user_id' in session
+    if not authorized and token:
+        # Constant-time, so response timing does not reveal how much of the token matched
+        authorized = hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode())
+    if not authorized:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/db/pool', methods=['GET'])
+def db_pool_metrics():
+    """Connection pool usage in this worker process: live checkouts, overflow and hold times."""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return jsonify(pool_monitor.snapshot())
+
 @app.route('/admin/google/authorize', methods=['GET'])
 def google_authorize():
     """Start OAuth flow for Google Drive/Sheets access."""
     if 'user_id' not in session or session.get('role') != 'admin':
         return redirect(url_for('login'))
     
+    load_google_libs()
     if not Flow:
         flash('OAuth libraries not installed. Install google-auth-oauthlib.', 'error')
         return redirect(url_for('admin_dashboard'))
@@ -1295,6 +1957,7 @@ def oauth2callback():
     if 'user_id' not in session or session.get('role') != 'admin':
         return redirect(url_for('login'))
     
+    load_google_libs()
     if not Flow:
         flash('OAuth libraries not installed.', 'error')
         return redirect(url_for('admin_dashboard'))
@@ -1334,34 +1997,22 @@ def oauth2callback():
         
         authorization_response = f"{scheme}://{request.host}{request.full_path}"
         app.logger.info(f'OAuth callback URL: {authorization_response}')
-        flow.fetch_token(authorization_response=authorization_response)
+        with track_outbound('google_oauth', 'fetch_token'):
+            flow.fetch_token(authorization_response=authorization_response)
         
         credentials = flow.credentials
         
-        # Save token to database
-        token_data = {
-            'token': credentials.token,
-            'refresh_token': credentials.refresh_token,
-            'token_uri': credentials.token_uri,
-            'client_id': credentials.client_id,
-            'client_secret': credentials.client_secret,
-            'scopes': credentials.scopes
-        }
+        # Save token to database, with its expiry so every worker knows when to refresh it
+        token_data = json.loads(credentials.to_json())
         
-        # Delete old token if exists
+        # Replace the old token in one transaction
         GoogleOAuthToken.query.delete()
-        db.session.commit()
-        
-        # Save new token
         oauth_token = GoogleOAuthToken(token_data=json.dumps(token_data))
         db.session.add(oauth_token)
         db.session.commit()
         
-        # Clear cached credentials
-        if hasattr(app, '_google_credentials'):
-            delattr(app, '_google_credentials')
-        if hasattr(app, '_gspread_client'):
-            delattr(app, '_gspread_client')
+        # This worker switches now; the others when they next refresh or restart
+        google_credentials.reset()
         
         session.pop('oauth_state', None)
         flash('Google OAuth authorization successful! You can now create Google Sheets.', 'success')
@@ -1403,6 +2054,10 @@ if __name__ == '__main__':
     # Render sets PORT automatically, use it
     # Enable debug mode locally for better error messages
     debug_mode = os.environ.get('FLASK_DEBUG', 'True').lower() == 'true'
+    # Development server only; production runs gunicorn wsgi:app (see gunicorn.conf.py)
+    migrate_db()
+    seed_admin()
+    create_app()
     app.run(debug=debug_mode, host='0.0.0.0', port=port)
 
 
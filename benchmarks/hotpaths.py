@@ -0,0 +1,486 @@
+"""Load test for the ordering hot paths with throughput and latency percentiles.
+
+Seeds synthetic products, BA users and orders, then drives each scenario
+with concurrent clients and reports requests/second and p50/p95/p99 latency.
+Results are written as JSON so runs can be compared across commits:
+
+    python benchmarks/hotpaths.py --products 10000 --orders 100000 --clients 8
+    python benchmarks/hotpaths.py --compare benchmarks/results/<earlier run>.json
+
+By default the app runs in-process on a throwaway SQLite file through the
+Flask test client, with Twilio and Google Sheets answered by the local
+provider stub server from providers.py (``--providers fake`` uses the
+in-process fakes instead). ``--provider-faults`` adds jitter and 429/5xx
+errors, to measure the ordering path while the providers misbehave, e.g.
+
+    python benchmarks/hotpaths.py --scenarios place_order \
+        --provider-faults jitter_ms=200,rate_429=0.1,rate_5xx=0.02
+
+DATABASE_URL points it at another
+database (e.g. a disposable PostgreSQL). ``--server URL`` sends real HTTP
+to a running instance instead; seeding then goes straight to DATABASE_URL,
+which must be the server's database.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ['products', 'products_delta', 'search', 'place_order', 'admin_orders', 'admin_orders_summary',
+             'download_order', 'upload_stock']
+BA_PASSWORD = 'bench'
+SEED_CHUNK = 5000
+
+
+# --- Seeding -------------------------------------------------------------------------------
+
+def seed(oms, args, rng):
+    """Insert synthetic products, BAs and orders unless this database already holds them."""
+    from sqlalchemy import insert
+    from werkzeug.security import generate_password_hash
+
+    db = oms.db
+    with oms.app.app_context():
+        existing = oms.Product.query.filter(oms.Product.lot_type_code.like('BENCH-%')).count()
+        if existing >= args.products:
+            print(f'Reusing seeded data ({existing} benchmark products)')
+        else:
+            started = time.perf_counter()
+            now = datetime.utcnow()
+            version = oms.bump_catalog_version(db, oms.CatalogVersion)
+            rows = [{
+                'lot_type_code': f'BENCH-{i:06d}',
+                'parent_code': f'PARENT-{i // 10:05d}',
+                'item_lot_type': f'Item type {i % 50}',
+                'quantity_available': 1_000_000,
+                'mrp': round(rng.uniform(50, 2000), 2),
+                'catalog_version': version,
+                'created_at': now,
+                'updated_at': now
+            } for i in range(existing, args.products)]
+            for start in range(0, len(rows), SEED_CHUNK):
+                db.session.execute(insert(oms.Product), rows[start:start + SEED_CHUNK])
+            db.session.commit()
+            print(f'Seeded {len(rows)} products in {time.perf_counter() - started:.1f}s')
+
+        password_hash = generate_password_hash(BA_PASSWORD)
+        known = {u.username for u in oms.User.query.filter(oms.User.username.like('bench-ba-%'))}
+        new_users = [{'username': f'bench-ba-{i}', 'password_hash': password_hash, 'role': 'ba', 'created_at': datetime.utcnow()}
+                     for i in range(args.bas) if f'bench-ba-{i}' not in known]
+        if new_users:
+            db.session.execute(insert(oms.User), new_users)
+            db.session.commit()
+
+        user_ids = [u.id for u in oms.User.query.filter(oms.User.username.like('bench-ba-%'))]
+        products = db.session.query(oms.Product.id, oms.Product.lot_type_code, oms.Product.parent_code,
+                                    oms.Product.item_lot_type, oms.Product.mrp).filter(
+            oms.Product.lot_type_code.like('BENCH-%')).all()
+        existing_orders = oms.Order.query.filter(oms.Order.user_id.in_(user_ids)).count()
+        missing = args.orders - existing_orders
+        if missing > 0:
+            started = time.perf_counter()
+            first_day = datetime.utcnow() - timedelta(days=365)
+            statuses = ['pending', 'downloaded', 'confirmed', 'completed']
+            for start in range(0, missing, SEED_CHUNK):
+                batch = min(SEED_CHUNK, missing - start)
+                orders, lines_per_order = [], []
+                for _ in range(batch):
+                    lines = []
+                    for product in rng.sample(products, rng.randint(1, 5)):
+                        quantity = rng.randint(1, 10)
+                        lines.append({
+                            'product_id': product.id,
+                            'lot_type_code': product.lot_type_code,
+                            'parent_code': product.parent_code,
+                            'item_lot_type': product.item_lot_type,
+                            'quantity': quantity,
+                            'mrp': product.mrp,
+                            'total': quantity * (product.mrp or 0)
+                        })
+                    lines_per_order.append(lines)
+                    orders.append({
+                        'user_id': rng.choice(user_ids),
+                        'order_data': json.dumps(lines),
+                        'total_amount': sum(line['total'] for line in lines),
+                        'status': rng.choice(statuses),
+                        'created_at': first_day + timedelta(seconds=rng.randint(0, 365 * 86400))
+                    })
+                order_ids = db.session.execute(insert(oms.Order).returning(oms.Order.id, sort_by_parameter_order=True), orders).scalars().all()
+                items = [dict(line, order_id=order_id) for order_id, lines in zip(order_ids, lines_per_order) for line in lines]
+                db.session.execute(insert(oms.OrderItem), items)
+                db.session.commit()
+            print(f'Seeded {missing} orders in {time.perf_counter() - started:.1f}s')
+
+        order_ids = [row[0] for row in db.session.query(oms.Order.id).filter(oms.Order.user_id.in_(user_ids))
+                     .order_by(oms.Order.id.desc()).limit(5000)]
+        codes = [product.lot_type_code for product in products]
+    return [p.id for p in products], order_ids, codes
+
+
+def stock_sheet(codes, rows, rng):
+    """An upload_stock workbook that updates ``rows`` existing benchmark products."""
+    import pandas as pd
+
+    sample = rng.sample(codes, min(rows, len(codes)))
+    frame = pd.DataFrame({
+        'Lot Type Code': sample,
+        'Parent Code': [f'PARENT-{i % 1000:05d}' for i in range(len(sample))],
+        'Item Lot Type: Lot Type': ['Bench item'] * len(sample),
+        'Quantity Available': [1_000_000] * len(sample),
+        'MRP': [round(rng.uniform(50, 2000), 2) for _ in sample]
+    })
+    buffer = io.BytesIO()
+    frame.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+# --- Clients -------------------------------------------------------------------------------
+
+class TestClient:
+    """Flask test client with the same call shape as HttpClient."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def login(self, username, password):
+        return self.client.post('/login', data={'username': username, 'password': password}).status_code
+
+    def get(self, path, headers=None):
+        response = self.client.get(path, headers=headers)
+        data = response.data
+        response.close()
+        return response.status_code, response.headers, data
+
+    def post_json(self, path, payload):
+        response = self.client.post(path, json=payload)
+        return response.status_code, response.headers, response.data
+
+    def post_file(self, path, field, filename, content):
+        response = self.client.post(path, data={field: (io.BytesIO(content), filename)},
+                                    content_type='multipart/form-data')
+        return response.status_code, response.headers, response.data
+
+
+class HttpClient:
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    def login(self, username, password):
+        return self.session.post(f'{self.base_url}/login', data={'username': username, 'password': password},
+                                 allow_redirects=False).status_code
+
+    def get(self, path, headers=None):
+        response = self.session.get(f'{self.base_url}{path}', headers=headers)
+        return response.status_code, response.headers, response.content
+
+    def post_json(self, path, payload):
+        response = self.session.post(f'{self.base_url}{path}', json=payload)
+        return response.status_code, response.headers, response.content
+
+    def post_file(self, path, field, filename, content):
+        response = self.session.post(f'{self.base_url}{path}', files={field: (filename, content)})
+        return response.status_code, response.headers, response.content
+
+
+# --- Scenarios -----------------------------------------------------------------------------
+
+def make_scenarios(product_ids, order_ids, upload_bytes):
+    """name -> (role, request function(client, rng, state) -> status code)."""
+
+    def products(client, rng, state):
+        status, headers, _ = client.get('/api/products')
+        return status
+
+    def products_delta(client, rng, state):
+        # A BA that already holds the catalog and polls for changes
+        if 'version' not in state:
+            _, headers, _ = client.get('/api/products')
+            state['version'] = headers.get('X-Catalog-Version', '0')
+        status, headers, _ = client.get(f"/api/products?since={state['version']}")
+        state['version'] = headers.get('X-Catalog-Version', state['version'])
+        return status
+
+    def search(client, rng, state):
+        # What a BA types: part of a lot code, a parent code, or an item type
+        code = f'bench-{rng.randrange(len(product_ids)):06d}'
+        query = rng.choice([code[:rng.randint(9, len(code))], f'parent-{rng.randrange(len(product_ids) // 10):05d}',
+                            f'item type {rng.randrange(50)}', 'it'])
+        status, _, _ = client.get(f"/api/products/search?q={query.replace(' ', '+')}&limit=60")
+        return status
+
+    def place_order(client, rng, state):
+        items = [{'product_id': pid, 'quantity': rng.randint(1, 3)}
+                 for pid in rng.sample(product_ids, rng.randint(1, 5))]
+        status, _, _ = client.post_json('/api/place_order', {'items': items})
+        return status
+
+    def admin_orders(client, rng, state, summary=False):
+        # Walk a few pages deep, then start again from the newest orders
+        path = '/admin/orders?limit=50' + ('&summary=1' if summary else '')
+        cursor = state.get('cursor')
+        if cursor and state.get('depth', 0) < 5:
+            path += f'&cursor={cursor}'
+            state['depth'] = state.get('depth', 0) + 1
+        else:
+            state['depth'] = 0
+        status, _, body = client.get(path)
+        if status == 200:
+            state['cursor'] = json.loads(body).get('next_cursor')
+        return status
+
+    def download_order(client, rng, state):
+        status, _, _ = client.get(f'/admin/download_order/{rng.choice(order_ids)}')
+        return status
+
+    def upload_stock(client, rng, state):
+        # Imports run as background jobs; time the upload until its job has finished
+        status, _, body = client.post_file('/admin/upload_stock', 'file', 'bench_stock.xlsx', upload_bytes)
+        if status != 202:
+            return status
+        status_url = json.loads(body)['status_url']
+        while True:
+            status, _, body = client.get(status_url)
+            job_status = json.loads(body).get('status') if status == 200 else 'failed'
+            if job_status == 'done':
+                return 200
+            if job_status == 'failed':
+                return 500
+            time.sleep(0.05)
+
+    return {
+        'products': ('ba', products),
+        'products_delta': ('ba', products_delta),
+        'search': ('ba', search),
+        'place_order': ('ba', place_order),
+        'admin_orders': ('admin', admin_orders),
+        'admin_orders_summary': ('admin', lambda client, rng, state: admin_orders(client, rng, state, summary=True)),
+        'download_order': ('admin', download_order),
+        'upload_stock': ('admin', upload_stock),
+    }
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(name, role, func, make_client, args, total_requests):
+    clients = []
+    for i in range(args.clients):
+        client = make_client()
+        if role == 'admin':
+            client.login('rtc', 'rtc1336')
+        else:
+            client.login(f'bench-ba-{i % args.bas}', BA_PASSWORD)
+        clients.append(client)
+
+    latencies = []
+    statuses = Counter()
+    lock = threading.Lock()
+    remaining = [total_requests]
+    gate = threading.Barrier(args.clients)
+
+    def worker(index):
+        rng = random.Random(f'{name}-{index}')
+        state = {'client': index}
+        client = clients[index]
+        gate.wait()
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            started = time.perf_counter()
+            try:
+                status = func(client, rng, state)
+            except Exception as e:
+                status = f'exception:{type(e).__name__}'
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies.append(elapsed)
+                statuses[str(status)] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    ok = sum(count for status, count in statuses.items() if status.isdigit() and int(status) < 400)
+    return {
+        'requests': len(latencies),
+        'errors': len(latencies) - ok,
+        'statuses': dict(statuses),
+        'wall_seconds': round(wall, 3),
+        'throughput_rps': round(len(latencies) / wall, 1) if wall else None,
+        'mean_ms': round(sum(latencies) / len(latencies), 2) if latencies else None,
+        'p50_ms': round(percentile(latencies, 50), 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95), 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99), 2) if latencies else None,
+        'max_ms': round(latencies[-1], 2) if latencies else None,
+    }
+
+
+# --- Reporting -----------------------------------------------------------------------------
+
+def git_revision():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                  text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                               capture_output=True, text=True).stdout.strip()
+        return revision + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_table(results, baseline=None):
+    header = f"{'scenario':<22}{'reqs':>7}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    if baseline:
+        header += f"{'p95 vs base':>14}"
+    print(header)
+    for name, result in results.items():
+        line = (f"{name:<22}{result['requests']:>7}{result['errors']:>6}{result['throughput_rps'] or 0:>9.1f}"
+                f"{result['p50_ms'] or 0:>10.1f}{result['p95_ms'] or 0:>10.1f}{result['p99_ms'] or 0:>10.1f}")
+        base = (baseline or {}).get(name)
+        if base and base.get('p95_ms') and result.get('p95_ms'):
+            change = (result['p95_ms'] - base['p95_ms']) / base['p95_ms'] * 100
+            line += f'{change:>+13.1f}%'
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--orders', type=int, default=100000)
+    parser.add_argument('--bas', type=int, default=50, help='number of BA accounts')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent clients per scenario')
+    parser.add_argument('--requests', type=int, default=400, help='requests per scenario')
+    parser.add_argument('--upload-requests', type=int, default=10, help='requests for upload_stock')
+    parser.add_argument('--upload-rows', type=int, default=2000, help='rows in the uploaded stock sheet')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated subset to run')
+    parser.add_argument('--stub-latency-ms', type=float, default=50, help='latency of the Twilio/Google stand-ins')
+    parser.add_argument('--providers', choices=['stub', 'fake'], default='stub',
+                        help='HTTP stub server or in-process fakes for Twilio/Google')
+    parser.add_argument('--provider-faults', default='',
+                        help='extra fault settings, e.g. jitter_ms=100,rate_429=0.05,rate_5xx=0.01')
+    parser.add_argument('--server', help='base URL of a running instance instead of the in-process test client')
+    parser.add_argument('--output', help='JSON results path (default benchmarks/results/hotpaths-<commit>-<time>.json)')
+    parser.add_argument('--compare', help='earlier results JSON to compare p95 latency against')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(sorted(unknown))}')
+    if args.server and not os.environ.get('DATABASE_URL'):
+        parser.error('--server needs DATABASE_URL set to the server database for seeding')
+
+    workdir = tempfile.mkdtemp(prefix='oms-bench-')
+    os.environ.setdefault('DATABASE_URL', f'sqlite:///{os.path.join(workdir, "bench.db")}')
+    sys.path.insert(0, ROOT)
+    stub = None
+    if not args.server:
+        from providers import FaultProfile, StubServer
+
+        fault_spec = f'latency_ms={args.stub_latency_ms},{args.provider_faults}'
+        try:
+            faults = FaultProfile.parse(fault_spec, seed=args.seed)
+        except ValueError as e:
+            parser.error(str(e))
+        if args.providers == 'stub':
+            stub = StubServer(faults)
+            os.environ['PROVIDER_STUB_URL'] = stub.start()
+        # Configure Twilio and Google so the outbox jobs run against the stand-ins
+        os.environ.update({
+            'SHEETS_BACKEND': args.providers,
+            'WHATSAPP_BACKEND': args.providers,
+            'PROVIDER_FAULTS': fault_spec,
+            'TWILIO_ACCOUNT_SID': 'AC' + '0' * 32,
+            'TWILIO_AUTH_TOKEN': 'benchmark',
+            'ADMIN_WHATSAPP_NUMBER': 'whatsapp:+10000000000',
+            'SLOW_REQUEST_MS': os.environ.get('SLOW_REQUEST_MS', '60000'),
+        })
+    os.chdir(workdir)
+    import app as oms
+    oms.migrate_db()
+    oms.seed_admin()
+    oms.create_app()
+
+    rng = random.Random(args.seed)
+    product_ids, order_ids, codes = seed(oms, args, rng)
+    upload_bytes = stock_sheet(codes, args.upload_rows, rng) if 'upload_stock' in scenarios else b''
+    available = make_scenarios(product_ids, order_ids, upload_bytes)
+    if args.server:
+        make_client = lambda: HttpClient(args.server)
+    else:
+        make_client = lambda: TestClient(oms.app)
+
+    results = {}
+    for name in scenarios:
+        role, func = available[name]
+        total = args.upload_requests if name == 'upload_stock' else args.requests
+        print(f'Running {name} ({total} requests, {args.clients} clients)...', flush=True)
+        results[name] = run_scenario(name, role, func, make_client, args, total)
+
+    with oms.app.app_context():
+        dialect = oms.db.engine.dialect.name
+    if not args.server:
+        # Flushes waiting WhatsApp digests, so the provider counters below include them
+        oms.stop_background_workers(timeout=10)
+    report = {
+        'revision': git_revision(),
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'python': platform.python_version(),
+        'database': dialect,
+        'mode': 'server' if args.server else 'test_client',
+        'scale': {'products': args.products, 'orders': args.orders, 'bas': args.bas},
+        'clients': args.clients,
+        'stub_latency_ms': None if args.server else args.stub_latency_ms,
+        'providers': None if args.server else {
+            'backend': args.providers,
+            'stats': stub.stats() if stub else dict(oms.provider_faults.stats, faults=oms.provider_faults.describe()),
+            'whatsapp': oms.whatsapp_dispatcher.metrics(),
+        },
+        'scenarios': results,
+    }
+
+    output = args.output or os.path.join(
+        ROOT, 'benchmarks', 'results', f"hotpaths-{report['revision']}-{datetime.utcnow():%Y%m%d%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f).get('scenarios')
+    print()
+    print_table(results, baseline)
+    print(f'\nResults written to {output}')
+
+    if stub:
+        stub.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""Measure cold-start time: importing the app, startup (create_app) and the first request.
+
+Each run is a fresh Python process against a database that is already set
+up, which is what a Render worker sees after spinning down. Pass
+``--ref <git ref>`` to measure an older revision the same way for comparison:
+
+    python benchmarks/startup_time.py --runs 5 --ref HEAD~1
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs inside the child process; wsgi.py is the production entry point when it exists
+PROBE = r'''
+import json, os, sys, time
+started = time.perf_counter()
+sys.path.insert(0, os.environ['OMS_SOURCE'])
+if os.path.exists(os.path.join(os.environ['OMS_SOURCE'], 'wsgi.py')):
+    from wsgi import app
+else:
+    from app import app
+ready = time.perf_counter()
+client = app.test_client()
+response = client.post('/login', data={'username': 'rtc', 'password': 'rtc1336'})
+first = time.perf_counter()
+heavy = [name for name in ('pandas', 'openpyxl', 'gspread', 'google_auth_oauthlib') if name in sys.modules]
+print('RESULT ' + json.dumps({
+    'startup_ms': (ready - started) * 1000,
+    'first_request_ms': (first - ready) * 1000,
+    'status': response.status_code,
+    'heavy_modules': heavy
+}), flush=True)
+'''
+
+
+def export_revision(ref, target):
+    archive = subprocess.run(['git', 'archive', ref], cwd=ROOT, check=True, capture_output=True).stdout
+    subprocess.run(['tar', '-x', '-C', target], input=archive, check=True)
+
+
+def measure(source, runs, workdir):
+    env = dict(os.environ, OMS_SOURCE=source, OUTBOX_WORKER_ENABLED='false',
+               DATABASE_URL=f'sqlite:///{os.path.join(workdir, "startup.db")}')
+    samples = []
+    # The first run creates the database (as a deploy's `flask migrate` would); only the following ones are measured
+    for i in range(runs + 1):
+        run_env = env if i else dict(env, AUTO_MIGRATE='true')
+        result = subprocess.run([sys.executable, '-c', PROBE], cwd=workdir, env=run_env,
+                                capture_output=True, text=True, check=True)
+        if i:
+            # The app logs to stdout too, so pick out the result line
+            line = next(l for l in result.stdout.splitlines() if l.startswith('RESULT '))
+            samples.append(json.loads(line[len('RESULT '):]))
+    return {
+        'startup_ms': statistics.median(s['startup_ms'] for s in samples),
+        'first_request_ms': statistics.median(s['first_request_ms'] for s in samples),
+        'heavy_modules': samples[-1]['heavy_modules']
+    }
+
+
+def report(label, result):
+    print(f"{label:<12} startup {result['startup_ms']:8.1f} ms   first request {result['first_request_ms']:7.1f} ms   "
+          f"heavy modules loaded: {', '.join(result['heavy_modules']) or 'none'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--ref', help='git revision to compare against, e.g. HEAD~1')
+    args = parser.parse_args()
+
+    results = {}
+    if args.ref:
+        with tempfile.TemporaryDirectory(prefix='oms-startup-') as tmp:
+            source = os.path.join(tmp, 'src')
+            os.makedirs(source)
+            export_revision(args.ref, source)
+            results[args.ref] = measure(source, args.runs, tmp)
+    with tempfile.TemporaryDirectory(prefix='oms-startup-') as tmp:
+        results['working tree'] = measure(ROOT, args.runs, tmp)
+
+    for label, result in results.items():
+        report(label, result)
+
+
+if __name__ == '__main__':
+    main()
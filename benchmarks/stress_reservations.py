@@ -0,0 +1,118 @@
+"""Concurrency stress test for stock reservation in /api/place_order.
+
+Many BA clients order the same few products in parallel until stock runs
+out. The run fails (exit code 1) if any product is oversold, goes negative,
+or if the stock left over does not match what the stored orders took.
+
+    python benchmarks/stress_reservations.py --threads 32 --stock 500
+
+Uses a throwaway SQLite file unless DATABASE_URL is set (use a disposable
+PostgreSQL database to exercise SELECT ... FOR UPDATE).
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--products', type=int, default=3)
+    parser.add_argument('--stock', type=int, default=200, help='starting quantity per product')
+    parser.add_argument('--max-qty', type=int, default=5, help='largest quantity per cart line')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='oms-stress-')
+    os.environ.setdefault('DATABASE_URL', f'sqlite:///{os.path.join(workdir, "stress.db")}')
+    os.environ['OUTBOX_WORKER_ENABLED'] = 'false'
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    import app as oms
+    oms.migrate_db()
+    oms.seed_admin()
+    oms.create_app()
+
+    with oms.app.app_context():
+        oms.Order.query.filter(oms.Order.user.has(oms.User.username.like('stress-%'))).delete(synchronize_session=False)
+        oms.Product.query.filter(oms.Product.lot_type_code.like('STRESS-%')).delete(synchronize_session=False)
+        products = [oms.Product(lot_type_code=f'STRESS-{i}', quantity_available=args.stock, mrp=10.0)
+                    for i in range(args.products)]
+        oms.db.session.add_all(products)
+        oms.db.session.commit()
+        product_ids = [p.id for p in products]
+
+    admin = oms.app.test_client()
+    admin.post('/login', data={'username': 'rtc', 'password': 'rtc1336'})
+    for i in range(args.threads):
+        admin.post('/admin/create_ba', json={'username': f'stress-{i}', 'password': 'stress'})
+
+    results = Counter()
+    ordered = Counter()
+    lock = threading.Lock()
+    start_gate = threading.Barrier(args.threads)
+
+    def client_loop(index):
+        client = oms.app.test_client()
+        client.post('/login', data={'username': f'stress-{index}', 'password': 'stress'})
+        rng = random.Random(index)
+        start_gate.wait()
+        sold_out_streak = 0
+        while sold_out_streak < 5:
+            cart = {pid: rng.randint(1, args.max_qty) for pid in rng.sample(product_ids, rng.randint(1, len(product_ids)))}
+            response = client.post('/api/place_order', json={
+                'items': [{'product_id': pid, 'quantity': qty} for pid, qty in cart.items()]
+            })
+            with lock:
+                if response.status_code == 200:
+                    results['ok'] += 1
+                    ordered.update(cart)
+                    sold_out_streak = 0
+                elif response.status_code == 400:
+                    results['short'] += 1
+                    sold_out_streak += 1
+                else:
+                    results[f'http_{response.status_code}'] += 1
+                    sold_out_streak += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client_loop, args=(i,)) for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    failures = []
+    with oms.app.app_context():
+        stored = Counter()
+        for order in oms.Order.query.filter(oms.Order.user.has(oms.User.username.like('stress-%'))):
+            for item in json.loads(order.order_data):
+                stored[item['product_id']] += item['quantity']
+        for pid in product_ids:
+            remaining = oms.db.session.get(oms.Product, pid).quantity_available
+            print(f'product {pid}: start={args.stock} ordered={ordered[pid]} stored={stored[pid]} remaining={remaining}')
+            if remaining < 0:
+                failures.append(f'product {pid} went negative ({remaining})')
+            if stored[pid] + remaining != args.stock:
+                failures.append(f'product {pid} oversold: {stored[pid]} stored + {remaining} left != {args.stock}')
+            if ordered[pid] != stored[pid]:
+                failures.append(f'product {pid}: clients saw {ordered[pid]} accepted, orders hold {stored[pid]}')
+
+    print(f'{sum(results.values())} requests in {elapsed:.2f}s across {args.threads} threads: {dict(results)}')
+    if failures:
+        print('FAILED:\n  ' + '\n  '.join(failures))
+        return 1
+    print('OK: no oversell')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""Product catalog versioning and the in-memory catalog cache.
+
+A single ``catalog_version`` row is bumped in the same transaction as every
+stock change (upload, order, delete), and each changed product is stamped
+with the new version. Clients can then revalidate with an ETag or ask for
+only the products changed since the version they already hold, and each
+worker keeps the catalog in memory until that version moves.
+"""
+import json
+import threading
+
+from sqlalchemy import select, update
+
+
+def catalog_etag(version, since=None):
+    if since is None:
+        return f'catalog-{version}'
+    return f'catalog-{version}-since-{since}'
+
+
+def current_catalog_version(db, version_model):
+    """Return (version, reset_version) as committed in the database."""
+    row = db.session.execute(
+        select(version_model.version, version_model.reset_version).where(version_model.id == 1)
+    ).first()
+    return (row.version, row.reset_version) if row else (0, 0)
+
+
+def bump_catalog_version(db, version_model, reset=False):
+    """Increment the catalog version inside the caller's transaction and return it.
+
+    ``reset=True`` marks a change that cannot be expressed as a delta (all
+    stock deleted), so clients holding an older version reload everything.
+
+    Every stock writer takes its locks in the same order: the product rows
+    first, then this single ``catalog_version`` row, then the event lock of
+    ``record_event``. So call it after the products are written, just before
+    recording the event and committing. That keeps the hot row locked only
+    for the end of the transaction, and concurrent writers cannot deadlock.
+    """
+    values = {'version': version_model.version + 1}
+    if reset:
+        values['reset_version'] = version_model.version + 1
+    result = db.session.execute(update(version_model).where(version_model.id == 1).values(**values))
+    if result.rowcount == 0:
+        db.session.add(version_model(id=1, version=1, reset_version=1 if reset else 0))
+        db.session.flush()
+        return 1
+    return db.session.execute(select(version_model.version).where(version_model.id == 1)).scalar_one()
+
+
+def stamp_catalog_version(db, product_model, product_ids, version):
+    """Set ``catalog_version`` on products the caller's transaction already changed (and locked)."""
+    if product_ids:
+        db.session.execute(
+            update(product_model)
+            .where(product_model.id.in_(sorted(product_ids)))
+            .values(catalog_version=version)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def _html_safe_json(value):
+    """JSON that is also safe to embed in a <script> tag (same escaping as Jinja's tojson)."""
+    return (json.dumps(value, separators=(',', ':'))
+            .replace('<', '\\u003c')
+            .replace('>', '\\u003e')
+            .replace('&', '\\u0026')
+            .replace("'", '\\u0027'))
+
+
+class CatalogEntry:
+    """One cached product, with its JSON encoding prepared once."""
+
+    __slots__ = ('id', 'lot_type_code', 'parent_code', 'item_lot_type', 'quantity_available', 'mrp',
+                 'catalog_version', 'json')
+
+    def __init__(self, id, lot_type_code, parent_code, item_lot_type, quantity_available, mrp, catalog_version):
+        self.id = id
+        self.lot_type_code = lot_type_code
+        self.parent_code = parent_code
+        self.item_lot_type = item_lot_type
+        self.quantity_available = quantity_available
+        # NaN MRPs from old Excel imports are served as null
+        self.mrp = mrp if mrp is not None and mrp == mrp else None
+        self.catalog_version = catalog_version
+        self.json = _html_safe_json(self.to_dict())
+
+    @classmethod
+    def from_product(cls, product, catalog_version):
+        return cls(product.id, product.lot_type_code, product.parent_code, product.item_lot_type,
+                   product.quantity_available, product.mrp, catalog_version)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'lot_type_code': self.lot_type_code,
+            'parent_code': self.parent_code,
+            'item_lot_type': self.item_lot_type,
+            'quantity_available': self.quantity_available,
+            'mrp': self.mrp
+        }
+
+
+class CatalogSnapshot:
+    """Immutable view of the whole catalog at one catalog version."""
+
+    __slots__ = ('version', 'reset_version', 'entries', 'by_id', 'by_code', '_json')
+
+    def __init__(self, version, reset_version, entries):
+        self.version = version
+        self.reset_version = reset_version
+        self.entries = entries
+        self.by_id = {entry.id: entry for entry in entries}
+        self.by_code = {entry.lot_type_code: entry for entry in entries}
+        self._json = None
+
+    @property
+    def json(self):
+        """The full product list as a JSON array string, built from the per-entry encodings."""
+        if self._json is None:
+            self._json = '[' + ','.join(entry.json for entry in self.entries) + ']'
+        return self._json
+
+    def changed_since(self, since):
+        return [entry for entry in self.entries if entry.catalog_version > since]
+
+
+class CatalogCache:
+    """Process-level product catalog served from memory.
+
+    Each read compares the cached version with the single ``catalog_version``
+    row, so a change committed by any worker reloads the cache on the next
+    read. Writers in this process update or drop the snapshot right after
+    commit, so their own follow-up reads skip the reload.
+    """
+
+    def __init__(self, db, product_model, version_model):
+        self.db = db
+        self.product_model = product_model
+        self.version_model = version_model
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'reloads': 0, 'write_throughs': 0}
+
+    def get(self):
+        version, reset_version = current_catalog_version(self.db, self.version_model)
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            self.stats['hits'] += 1
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.version != version:
+                snapshot = self._load(version, reset_version)
+                self._snapshot = snapshot
+                self.stats['reloads'] += 1
+            return snapshot
+
+    def _load(self, version, reset_version):
+        Product = self.product_model
+        rows = self.db.session.query(
+            Product.id, Product.lot_type_code, Product.parent_code, Product.item_lot_type,
+            Product.quantity_available, Product.mrp, Product.catalog_version
+        ).order_by(Product.id).all()
+        return CatalogSnapshot(version, reset_version, [CatalogEntry(*row) for row in rows])
+
+    def write_through(self, version, entries):
+        """Apply CatalogEntry objects committed at ``version`` to the cached snapshot.
+
+        Build the entries before commit (committed ORM objects are expired).
+        Only a snapshot exactly one version behind can be patched; otherwise
+        another worker changed the catalog in between and the cache is dropped.
+        """
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.version != version - 1:
+                self._snapshot = None
+                return
+            changed = {entry.id: entry for entry in entries}
+            merged = [changed.pop(entry.id, entry) for entry in snapshot.entries]
+            merged.extend(changed.values())
+            self._snapshot = CatalogSnapshot(version, snapshot.reset_version, merged)
+            self.stats['write_throughs'] += 1
+
+    def reset(self, version):
+        """Cache an empty catalog after all stock was deleted at ``version``."""
+        with self._lock:
+            self._snapshot = CatalogSnapshot(version, version, [])
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
@@ -0,0 +1,124 @@
+"""Database engine configuration and connection pool monitoring.
+
+PostgreSQL connections get a bounded pool, a liveness check on checkout
+(``pool_pre_ping``), periodic recycling and a server-side statement timeout,
+so idle connections dropped by the server are replaced instead of failing a
+request. SQLite databases are switched to WAL mode with a busy timeout, so
+readers do not block the writer and concurrent writers wait instead of
+failing with "database is locked".
+"""
+import threading
+import time
+
+from sqlalchemy import event
+
+
+def _int_env(env, name, default):
+    value = env.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+def engine_options(database_uri, env):
+    """SQLALCHEMY_ENGINE_OPTIONS for ``database_uri``, tuned from DB_* environment variables."""
+    if database_uri.startswith('sqlite'):
+        # pysqlite's timeout is SQLite's busy timeout, in seconds
+        return {'connect_args': {'timeout': _int_env(env, 'SQLITE_BUSY_TIMEOUT_MS', 15000) / 1000}}
+
+    options = {
+        'pool_size': _int_env(env, 'DB_POOL_SIZE', 5),
+        'max_overflow': _int_env(env, 'DB_MAX_OVERFLOW', 2),
+        'pool_timeout': _int_env(env, 'DB_POOL_TIMEOUT', 30),
+        'pool_recycle': _int_env(env, 'DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': env.get('DB_POOL_PRE_PING', 'true').lower() == 'true',
+    }
+    if database_uri.startswith('postgres'):
+        statement_timeout = _int_env(env, 'DB_STATEMENT_TIMEOUT_MS', 30000)
+        options['connect_args'] = {
+            'connect_timeout': _int_env(env, 'DB_CONNECT_TIMEOUT', 10),
+            'options': f'-c statement_timeout={statement_timeout}',
+            # TCP keepalives stop idle connections from being silently dropped by proxies
+            'keepalives': 1,
+            'keepalives_idle': 60,
+            'keepalives_interval': 10,
+            'keepalives_count': 5,
+        }
+    return options
+
+
+def enable_sqlite_wal(engine, synchronous='NORMAL'):
+    """Use WAL journaling on every new SQLite connection of ``engine``."""
+    if engine.dialect.name != 'sqlite' or engine.url.database in (None, '', ':memory:'):
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute(f'PRAGMA synchronous={synchronous}')
+        cursor.close()
+
+
+class PoolMonitor:
+    """Counts pool events and checkout hold times for one engine."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._lock = threading.Lock()
+        self._checked_out_at = {}
+        self.counters = {
+            'connects': 0,
+            'checkouts': 0,
+            'checkins': 0,
+            'invalidations': 0,
+            'hold_ms_total': 0.0,
+            'hold_ms_max': 0.0,
+        }
+        event.listen(engine, 'connect', self._on_connect)
+        event.listen(engine, 'checkout', self._on_checkout)
+        event.listen(engine, 'checkin', self._on_checkin)
+        event.listen(engine, 'invalidate', self._on_invalidate)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.counters['connects'] += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.counters['checkouts'] += 1
+            self._checked_out_at[id(connection_record)] = time.perf_counter()
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.counters['checkins'] += 1
+            started = self._checked_out_at.pop(id(connection_record), None)
+            if started is not None:
+                held = (time.perf_counter() - started) * 1000
+                self.counters['hold_ms_total'] += held
+                self.counters['hold_ms_max'] = max(self.counters['hold_ms_max'], held)
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.counters['invalidations'] += 1
+
+    def snapshot(self):
+        """Live pool state plus the counters since this process started."""
+        pool = self.engine.pool
+        stats = {'pool_class': type(pool).__name__, 'status': pool.status()}
+        for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+            method = getattr(pool, name, None)
+            if callable(method):
+                stats[name] = method()
+        max_overflow = getattr(pool, '_max_overflow', None)
+        if max_overflow is not None:
+            stats['max_overflow'] = max_overflow
+        with self._lock:
+            counters = dict(self.counters)
+            now = time.perf_counter()
+            oldest = min(self._checked_out_at.values(), default=None)
+        checkins = counters['checkins']
+        counters['hold_ms_avg'] = round(counters['hold_ms_total'] / checkins, 2) if checkins else 0.0
+        counters['hold_ms_total'] = round(counters['hold_ms_total'], 1)
+        counters['hold_ms_max'] = round(counters['hold_ms_max'], 1)
+        counters['longest_current_hold_ms'] = round((now - oldest) * 1000, 1) if oldest is not None else 0.0
+        stats.update(counters)
+        return stats
@@ -0,0 +1,236 @@
+"""Admin dashboard change feed over Server-Sent Events.
+
+Changes the dashboard shows (orders placed or deleted, notifications read,
+stock imports) are written as ``admin_event`` rows in the same transaction as
+the change itself. Each process runs one poller thread, and only while a
+dashboard is connected. It reads new rows with a single indexed query and
+fans them out to every open stream, so an always-open dashboard costs one
+small query per poll interval per worker instead of re-fetching whole lists.
+
+Event ids are row ids. A browser that reconnects sends the last id it saw
+(``Last-Event-ID``) and receives only what it missed; when that is no longer
+available it gets a ``reset`` event and reloads its lists.
+"""
+import json
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import func, select, text
+
+# Arbitrary key for the PostgreSQL advisory lock that makes event ids commit in order
+EVENT_LOCK_KEY = 720452
+BUFFER_SIZE = 1000  # recent events kept in memory for streams and reconnects
+MAX_BACKLOG = 500  # a reconnect that missed more than this reloads instead
+HEARTBEAT_SECONDS = 15
+RECONNECT_MS = 3000
+
+
+def record_event(db, event_model, kind, data):
+    """Add an event to the current session; streams see it once the caller commits.
+
+    Call it last, just before commit. On PostgreSQL a transaction-level lock
+    serializes event writers until they commit, so ids become visible in order
+    and a reader that has seen id N never misses a smaller one committed later.
+    SQLite writers are serialized already.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': EVENT_LOCK_KEY})
+    event = event_model(kind=kind, data=json.dumps(data), created_at=datetime.utcnow())
+    db.session.add(event)
+    db.session.flush()
+    return event
+
+
+def format_event(event_id, kind, data):
+    """One SSE message; ``data`` is a JSON string (never contains a newline)."""
+    return f'id: {event_id}\nevent: {kind}\ndata: {data}\n\n'
+
+
+class EventBroker:
+    """Fan out ``admin_event`` rows to the SSE streams open in this process."""
+
+    def __init__(self, app, db, event_model, poll_interval=2.0, max_streams=2, stream_seconds=300):
+        self.app = app
+        self.db = db
+        self.event_model = event_model
+        self.poll_interval = poll_interval
+        self.max_streams = max_streams
+        self.stream_seconds = stream_seconds
+        self._events = deque(maxlen=BUFFER_SIZE)  # (id, kind, data) read by the poller
+        self._origin = None  # the buffer holds every event after this id; None while idle
+        self._last_id = None
+        self._streams = 0
+        self._cond = threading.Condition()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {'polls': 0, 'events_read': 0, 'events_sent': 0, 'streams_opened': 0,
+                      'streams_rejected': 0, 'resets': 0}
+
+    def collect_stats(self):
+        return dict(self.stats, open_streams=self._streams)
+
+    def notify(self):
+        """Read freshly committed events now instead of at the next poll."""
+        self._wake.set()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='event-broker', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _head(self):
+        return self.db.session.execute(select(func.max(self.event_model.id))).scalar() or 0
+
+    def open_stream(self, last_event_id=None):
+        """Return an SSE generator resuming after ``last_event_id``, or None when all stream slots are taken.
+
+        Runs in the request, which does the only database reads a stream
+        needs; the generator itself only waits on the in-memory buffer.
+        """
+        with self._cond:
+            if self._streams >= self.max_streams:
+                self.stats['streams_rejected'] += 1
+                return None
+            self._streams += 1
+            self.stats['streams_opened'] += 1
+        try:
+            head = self._head() if self._origin is None or (last_event_id or 0) > self._last_id else None
+            with self._cond:
+                if self._origin is None:
+                    self._origin = self._last_id = head
+                origin, last_id = self._origin, self._last_id
+            self._wake.set()
+            backlog, cursor, reset = self._backlog(last_event_id, origin, last_id, head)
+        except Exception:
+            self._release()
+            raise
+        stream = self._stream(backlog, cursor, reset)
+        # Enter the generator's try block, so closing an unread response still frees the slot
+        next(stream)
+        return stream
+
+    def _backlog(self, last_event_id, origin, last_id, head):
+        """Return (events from the database, cursor to continue from in the buffer, reset reason)."""
+        if last_event_id is None:
+            return [], last_id, 'connected'
+        if last_event_id > last_id:
+            # Either the poller has not read the newest commits yet, or the table was recreated
+            if head is not None and last_event_id > head:
+                return [], last_id, 'expired'
+            return [], last_event_id, None
+        if last_event_id >= origin:
+            return [], last_event_id, None
+        Event = self.event_model
+        oldest = self.db.session.execute(select(func.min(Event.id))).scalar()
+        if oldest is None or last_event_id + 1 < oldest:
+            return [], last_id, 'expired'
+        rows = self.db.session.execute(
+            select(Event.id, Event.kind, Event.data)
+            .where(Event.id > last_event_id, Event.id <= origin)
+            .order_by(Event.id)
+            .limit(MAX_BACKLOG + 1)
+        ).all()
+        if len(rows) > MAX_BACKLOG:
+            return [], last_id, 'expired'
+        return [tuple(row) for row in rows], origin, None
+
+    def _release(self):
+        with self._cond:
+            self._streams -= 1
+
+    def _stream(self, backlog, cursor, reset):
+        started = time.monotonic()
+        try:
+            yield
+            yield f'retry: {RECONNECT_MS}\n\n'
+            if reset:
+                self.stats['resets'] += 1
+                yield format_event(cursor, 'reset', json.dumps({'reason': reset}))
+            for event in backlog:
+                self.stats['events_sent'] += 1
+                yield format_event(*event)
+            while not self._stop.is_set():
+                remaining = self.stream_seconds - (time.monotonic() - started)
+                if remaining <= 0:
+                    # End the response so the worker thread is freed; the browser reconnects with Last-Event-ID
+                    return
+                with self._cond:
+                    if self._origin is not None and cursor < self._origin:
+                        # This stream fell further behind than the buffer reaches
+                        cursor, reset, events = self._last_id, 'expired', []
+                    else:
+                        reset = None
+                        events = [event for event in self._events if event[0] > cursor]
+                        if not events:
+                            self._cond.wait(min(HEARTBEAT_SECONDS, remaining))
+                            events = [event for event in self._events if event[0] > cursor]
+                if reset:
+                    self.stats['resets'] += 1
+                    yield format_event(cursor, 'reset', json.dumps({'reason': reset}))
+                elif events:
+                    cursor = events[-1][0]
+                    self.stats['events_sent'] += len(events)
+                    yield ''.join(format_event(*event) for event in events)
+                else:
+                    # Comments keep proxies from closing an idle connection
+                    yield ': keepalive\n\n'
+        finally:
+            self._release()
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._cond:
+                idle = self._streams == 0
+                if idle:
+                    # Nobody is listening: forget the buffer and stop querying until a stream opens
+                    self._events.clear()
+                    self._origin = self._last_id = None
+            if idle:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            try:
+                with self.app.app_context():
+                    self._poll()
+            except Exception as e:
+                self.app.logger.error(f'Event broker poll error: {str(e)}', exc_info=True)
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _poll(self):
+        Event = self.event_model
+        while True:
+            after = self._last_id
+            if after is None:
+                return
+            rows = self.db.session.execute(
+                select(Event.id, Event.kind, Event.data).where(Event.id > after).order_by(Event.id).limit(MAX_BACKLOG)
+            ).all()
+            self.stats['polls'] += 1
+            if not rows:
+                return
+            with self._cond:
+                if self._last_id != after:
+                    return
+                for row in rows:
+                    if len(self._events) == self._events.maxlen:
+                        self._origin = self._events[0][0]
+                    self._events.append(tuple(row))
+                self._last_id = rows[-1].id
+                self._cond.notify_all()
+            self.stats['events_read'] += len(rows)
+            if len(rows) < MAX_BACKLOG:
+                return
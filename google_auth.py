@@ -0,0 +1,258 @@
+"""Google API credentials and one pooled HTTP session per process.
+
+Credentials come from the ``google_oauth_token`` row (preferred) or a
+service account, and are loaded once per process. Every Sheets and Drive
+call goes through a single ``AuthorizedSession``, a requests session with a
+connection pool, so TLS connections to Google are reused from call to call.
+
+A background thread refreshes the access token a few minutes before it
+expires, so Sheets jobs never start with a stale token. OAuth tokens are
+saved back to the row, and a worker that is about to refresh first re-reads
+the row. If another worker has already refreshed, it adopts that token
+instead of requesting its own.
+"""
+import json
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+
+from metrics import track_outbound
+
+
+def _oauth_token_info(credentials):
+    """What is stored in google_oauth_token.token_data, including the expiry."""
+    return json.loads(credentials.to_json())
+
+
+class GoogleCredentialManager:
+    """Load, share and proactively refresh the Google credentials of this process."""
+
+    def __init__(self, app, db, token_model, scopes, refresh_margin=300, check_interval=60,
+                 timeout=30, pool_size=10):
+        self.app = app
+        self.db = db
+        self.token_model = token_model
+        self.scopes = scopes
+        self.refresh_margin = refresh_margin
+        self.check_interval = check_interval
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._credentials = None
+        self._oauth = False
+        self._token_version = None  # (row id, updated_at) of the stored token the credentials match
+        self._session = None
+        self._client = None
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {'loads': 0, 'refreshes': 0, 'refresh_failures': 0, 'adopted': 0}
+
+    def collect_stats(self):
+        stats = dict(self.stats)
+        credentials = self._credentials
+        if credentials is not None and credentials.expiry is not None:
+            stats['expires_in_seconds'] = round((credentials.expiry - datetime.utcnow()).total_seconds())
+        return stats
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='google-token-refresh', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def reset(self):
+        """Forget the loaded credentials and session, e.g. after a new OAuth authorization."""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+            self._credentials = None
+            self._oauth = False
+            self._token_version = None
+            self._session = None
+            self._client = None
+
+    def credentials(self):
+        """Valid credentials, loading them on first use; None if none are configured or usable."""
+        with self._lock:
+            if self._credentials is None:
+                self._credentials = self._load()
+                if self._credentials is None:
+                    return None
+                self.stats['loads'] += 1
+            if not self._credentials.valid and not self._refresh():
+                return None
+            return self._credentials
+
+    def gspread_client(self):
+        """One gspread client per process, sharing the pooled authorized session."""
+        with self._lock:
+            if self._client is not None:
+                return self._client
+            session = self._authorized_session()
+            if session is None:
+                return None
+            import gspread
+            self._client = gspread.authorize(None, session=session)
+            self._client.http_client.set_timeout(self.timeout)
+            self.app.logger.info('gspread client created successfully.')
+            return self._client
+
+    def _authorized_session(self):
+        if self._session is not None:
+            return self._session
+        credentials = self.credentials()
+        if credentials is None:
+            return None
+        from google.auth.transport.requests import AuthorizedSession
+        from requests.adapters import HTTPAdapter
+
+        session = AuthorizedSession(credentials)
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.pool_size)
+        session.mount('https://', adapter)
+        self._session = session
+        return session
+
+    def _load(self):
+        """OAuth credentials from the token row, else the configured service account."""
+        try:
+            from google.oauth2.credentials import Credentials
+        except ImportError:
+            Credentials = None
+        if Credentials:
+            try:
+                row = self._stored_token()
+                if row:
+                    credentials = Credentials.from_authorized_user_info(json.loads(row.token_data), self.scopes)
+                    self._oauth = True
+                    self._token_version = (row.id, row.updated_at)
+                    self.app.logger.info('Google OAuth credentials loaded successfully.')
+                    return credentials
+                self.app.logger.warning('No OAuth token found in database. OAuth not authorized. '
+                                        'Use /admin/google/authorize to authorize.')
+            except Exception as e:
+                self.app.logger.warning(f'Error loading OAuth credentials: {str(e)}')
+
+        try:
+            from google.oauth2 import service_account
+        except ImportError:
+            self.app.logger.warning('google-auth is not installed. Skipping Google Sheets backup.')
+            return None
+        credentials_json = self.app.config.get('GOOGLE_SERVICE_ACCOUNT_JSON')
+        credentials_file = self.app.config.get('GOOGLE_SERVICE_ACCOUNT_FILE')
+        try:
+            if credentials_json:
+                self.app.logger.warning('Using service account (OAuth not available). '
+                                        'Service accounts have storage limitations.')
+                info = json.loads(credentials_json)
+                credentials = service_account.Credentials.from_service_account_info(info, scopes=self.scopes)
+            elif credentials_file:
+                self.app.logger.warning('Using service account (OAuth not available). '
+                                        'Service accounts have storage limitations.')
+                credentials = service_account.Credentials.from_service_account_file(credentials_file,
+                                                                                    scopes=self.scopes)
+            else:
+                self.app.logger.warning('No Google credentials configured. Use OAuth or set GOOGLE_SERVICE_ACCOUNT_FILE.')
+                return None
+        except Exception as e:
+            self.app.logger.error(f'Error loading Google credentials: {str(e)}', exc_info=True)
+            return None
+        self._oauth = False
+        self.app.logger.info('Google service account credentials loaded successfully.')
+        return credentials
+
+    def _expiring(self):
+        expiry = self._credentials.expiry
+        # Tokens stored before the expiry was saved have none; refresh them once to learn it
+        return expiry is None or expiry - datetime.utcnow() < timedelta(seconds=self.refresh_margin)
+
+    def refresh_if_expiring(self):
+        """Refresh the loaded credentials if they expire within the refresh margin. Needs an app context."""
+        with self._lock:
+            if self._credentials is None or not self._expiring():
+                return False
+            return self._refresh()
+
+    def _refresh(self):
+        """Adopt a newer token saved by another worker, or refresh and save one; False if that failed."""
+        credentials = self._credentials
+        if self._oauth:
+            if self._adopt_stored_token() and not self._expiring():
+                return True
+            if not credentials.refresh_token:
+                self.app.logger.error('OAuth token expired and has no refresh token. Authorize again.')
+                return False
+        from google.auth.transport.requests import Request
+        try:
+            with track_outbound('google_oauth', 'refresh'):
+                credentials.refresh(Request())
+        except Exception as e:
+            self.stats['refresh_failures'] += 1
+            self.app.logger.error(f'Error refreshing Google credentials: {str(e)}')
+            return False
+        self.stats['refreshes'] += 1
+        if self._oauth:
+            self._save_token()
+        return True
+
+    def _adopt_stored_token(self):
+        """Take over the token in the row if another worker stored a newer one; True if adopted."""
+        row = self._stored_token()
+        if row is None or (row.id, row.updated_at) == self._token_version:
+            return False
+        from google.oauth2.credentials import Credentials
+        stored = Credentials.from_authorized_user_info(json.loads(row.token_data), self.scopes)
+        # Update in place: the authorized session holds this credentials object
+        self._credentials.token = stored.token
+        self._credentials.expiry = stored.expiry
+        self._token_version = (row.id, row.updated_at)
+        self.stats['adopted'] += 1
+        return True
+
+    def _stored_token(self):
+        """The token row (id, token_data, updated_at), read on its own connection; None if there is none."""
+        table = self.token_model.__table__
+        with self.db.engine.connect() as connection:
+            return connection.execute(
+                select(table.c.id, table.c.token_data, table.c.updated_at).order_by(table.c.id).limit(1)
+            ).first()
+
+    def _save_token(self):
+        """Store the refreshed token, unless another worker saved one meanwhile (theirs is as good).
+
+        The refresh may run inside a Sheets job, so the token is written in
+        its own transaction and never commits or rolls back the job's session.
+        """
+        table = self.token_model.__table__
+        row_id, updated_at = self._token_version
+        now = datetime.utcnow()
+        try:
+            with self.db.engine.begin() as connection:
+                saved = connection.execute(
+                    update(table)
+                    .where(table.c.id == row_id, table.c.updated_at == updated_at)
+                    .values(token_data=json.dumps(_oauth_token_info(self._credentials)), updated_at=now)
+                ).rowcount
+        except Exception as e:
+            self.app.logger.warning(f'Could not save the refreshed OAuth token: {str(e)}')
+            return
+        if saved:
+            self._token_version = (row_id, now)
+            self.app.logger.info('OAuth token refreshed successfully.')
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            if self._credentials is None:
+                # Nothing loaded in this process yet; the first Sheets job loads (and if needed refreshes) it
+                continue
+            try:
+                with self.app.app_context():
+                    self.refresh_if_expiring()
+            except Exception as e:
+                self.app.logger.error(f'Google token refresh error: {str(e)}', exc_info=True)
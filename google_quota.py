@@ -0,0 +1,271 @@
+"""Shared rate limiting for Google Sheets and Drive calls.
+
+Every gspread call the app makes goes through one ``GoogleRateLimiter`` per
+process. A token bucket keeps the process under the Sheets per-minute quota,
+so a burst of orders waits for quota instead of running into it. Calls that
+still get a 429 (or a Drive ``rateLimitExceeded``) or a 5xx are retried with
+exponential backoff and jitter, and a 429 pauses the whole bucket, since the
+quota is shared by every caller. Spreadsheet creation is not idempotent, so
+it is retried only when throttled (see ``RateLimitedClient.create``).
+
+Callers take tokens in one of two lanes. The interactive lane (sheets for
+orders placed a moment ago) goes first whenever both are waiting, and
+backlog work (replaying older orders) never takes the last ``reserve``
+tokens. After a replay has drained the bucket, a new order still finds
+quota left.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+INTERACTIVE = 'interactive'
+BACKLOG = 'backlog'
+LANES = (INTERACTIVE, BACKLOG)
+RATE_LIMIT_REASONS = ('ratelimitexceeded', 'userratelimitexceeded')
+STORAGE_QUOTA_REASONS = ('storagequotaexceeded', 'teamdrivefilelimitexceeded')
+
+
+class RateLimitTimeout(Exception):
+    """No quota became available within the limiter's ``max_wait``."""
+
+
+def api_error_status(error):
+    """The HTTP status of a gspread ``APIError`` (or a stand-in's error), else None."""
+    status = getattr(error, 'status', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status if isinstance(status, int) else None
+
+
+def _api_reasons(error):
+    """Lower-cased reason codes of a Google API error, or the message text when there is no error body."""
+    try:
+        body = error.response.json()['error']
+        reasons = [item.get('reason', '') for item in body.get('errors', [])] + [body.get('status', '')]
+    except Exception:
+        return str(error).lower()
+    return ' '.join(str(reason).lower() for reason in reasons if reason)
+
+
+def _api_message(error):
+    """Lower-cased message of a Google API error body, or the exception text when there is none."""
+    try:
+        return str(error.response.json()['error']['message']).lower()
+    except Exception:
+        return str(error).lower()
+
+
+def classify_error(error):
+    """'throttled' for rate limiting, 'transient' for errors worth retrying, None if retrying cannot help."""
+    status = api_error_status(error)
+    if status == 429 or (status == 403 and any(reason in _api_reasons(error) for reason in RATE_LIMIT_REASONS)):
+        return 'throttled'
+    if status is not None:
+        return 'transient' if status >= 500 else None
+    # Dropped connections and timeouts (requests, google-auth transport); matched by name to avoid the imports
+    if any(cls.__name__ in ('ConnectionError', 'Timeout', 'TransportError') for cls in type(error).__mro__):
+        return 'transient'
+    return None
+
+
+def error_reason(error):
+    """Why a Google call failed, for reporting and for choosing a fallback.
+
+    'throttled' or 'transient' (see ``classify_error``), 'storage_quota' (the
+    Drive owner is out of space), 'permission', 'not_found', 'duplicate_sheet'
+    (an ``addSheet`` for a tab that exists), or None.
+    """
+    kind = classify_error(error)
+    if kind:
+        return kind
+    status = api_error_status(error)
+    if status == 403:
+        reasons = _api_reasons(error)
+        if any(reason in reasons for reason in STORAGE_QUOTA_REASONS) or 'storage quota' in reasons:
+            return 'storage_quota'
+        return 'permission'
+    if status == 404:
+        return 'not_found'
+    # Sheets sends no specific reason code for this 400 (just badRequest), only the message
+    if status == 400 and 'already exists' in _api_message(error):
+        return 'duplicate_sheet'
+    return None
+
+
+def _retry_after(error):
+    value = getattr(getattr(error, 'response', None), 'headers', {}).get('Retry-After')
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class GoogleRateLimiter:
+    """Token bucket with priority lanes, plus retries with backoff, for Google API calls."""
+
+    def __init__(self, per_minute=60, burst=10, reserve=None, max_retries=5, base_backoff=1.0,
+                 max_backoff=32.0, max_wait=120.0):
+        self.rate = per_minute / 60.0
+        self.burst = max(1, burst)
+        self.reserve = self.burst // 4 if reserve is None else min(reserve, self.burst - 1)
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.max_wait = max_wait
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiting = dict.fromkeys(LANES, 0)
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self.stats = {'calls': 0, 'waited': 0, 'wait_seconds': 0.0, 'wait_timeouts': 0, 'throttled': 0,
+                      'transient_errors': 0, 'retries': 0, 'failed': 0, 'interactive_calls': 0, 'backlog_calls': 0}
+
+    def collect_stats(self):
+        with self._cond:
+            self._refill(time.monotonic())
+            return dict(self.stats, wait_seconds=round(self.stats['wait_seconds'], 3), tokens=round(self._tokens, 2),
+                        waiting_interactive=self._waiting[INTERACTIVE], waiting_backlog=self._waiting[BACKLOG])
+
+    @contextmanager
+    def lane(self, name):
+        """Run the Google calls made inside the block (on this thread) in the given lane."""
+        if name not in LANES:
+            raise ValueError(f'Unknown lane "{name}"')
+        previous = getattr(self._local, 'lane', INTERACTIVE)
+        self._local.lane = name
+        try:
+            yield
+        finally:
+            self._local.lane = previous
+
+    def wrap(self, client):
+        return RateLimitedClient(client, self)
+
+    def call(self, func, *args, retry_transient=True, **kwargs):
+        """Call ``func`` once quota allows, retrying throttled (and unless disabled, transient) failures.
+
+        A throttled call was rejected, so repeating it is always safe. Pass
+        ``retry_transient=False`` for calls that are not idempotent, where a
+        5xx or a lost response may hide a request that succeeded.
+        """
+        lane = getattr(self._local, 'lane', INTERACTIVE)
+        for attempt in range(self.max_retries + 1):
+            self._acquire(lane)
+            with self._cond:
+                self.stats['calls'] += 1
+                self.stats[f'{lane}_calls'] += 1
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                kind = classify_error(e)
+                with self._cond:
+                    if kind:
+                        self.stats['throttled' if kind == 'throttled' else 'transient_errors'] += 1
+                    final = kind is None or (kind == 'transient' and not retry_transient)
+                    if final or attempt == self.max_retries:
+                        # Lookups that find nothing (SpreadsheetNotFound) are answers, not failures
+                        if kind or api_error_status(e) is not None:
+                            self.stats['failed'] += 1
+                        raise
+                    self.stats['retries'] += 1
+                delay = min(self.max_backoff, self.base_backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+                if kind == 'throttled':
+                    # Quota is per project/user, not per call: hold every caller back, not just this one
+                    self._pause(max(delay, _retry_after(e) or 0))
+                else:
+                    time.sleep(delay)
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _pause(self, seconds):
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+    def _acquire(self, lane):
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        # Backlog work leaves the reserve alone and yields to any waiting interactive call
+        floor = 1 + (self.reserve if lane == BACKLOG else 0)
+        with self._cond:
+            self._waiting[lane] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    blocked = lane == BACKLOG and self._waiting[INTERACTIVE] > 0
+                    if now >= self._paused_until and self._tokens >= floor and not blocked:
+                        self._tokens -= 1
+                        break
+                    if now >= deadline:
+                        self.stats['wait_timeouts'] += 1
+                        raise RateLimitTimeout(f'No Google API quota available within {self.max_wait:g}s')
+                    if now < self._paused_until:
+                        wait = self._paused_until - now
+                    else:
+                        wait = max(floor - self._tokens, 0.01) / self.rate
+                    self._cond.wait(min(wait, deadline - now))
+            finally:
+                self._waiting[lane] -= 1
+                self._cond.notify_all()
+            waited = time.monotonic() - started
+            if waited > 0.001:
+                self.stats['waited'] += 1
+                self.stats['wait_seconds'] += waited
+
+
+class RateLimitedSpreadsheet:
+    """A gspread spreadsheet whose API calls go through the limiter."""
+
+    def __init__(self, spreadsheet, limiter):
+        self._spreadsheet = spreadsheet
+        self._limiter = limiter
+
+    def batch_update(self, body):
+        return self._limiter.call(self._spreadsheet.batch_update, body)
+
+    def __getattr__(self, name):
+        return getattr(self._spreadsheet, name)
+
+
+class RateLimitedClient:
+    """A gspread client whose spreadsheet creates and lookups (and the spreadsheets they return) are rate limited."""
+
+    def __init__(self, client, limiter):
+        self._client = client
+        self._limiter = limiter
+
+    def create(self, title, folder_id=None):
+        """Create a spreadsheet, without repeating a create that may have succeeded.
+
+        Only throttled attempts are retried. After a transient error the
+        spreadsheet is looked up by title, in case the request went through
+        and only the response was lost; if it is not there the error is
+        raised and the caller's job retries later.
+        """
+        kwargs = {'folder_id': folder_id} if folder_id else {}
+        try:
+            spreadsheet = self._limiter.call(self._client.create, title, retry_transient=False, **kwargs)
+        except Exception as e:
+            if classify_error(e) != 'transient':
+                raise
+            try:
+                return self.open(title)
+            except Exception as lookup_error:
+                if type(lookup_error).__name__ != 'SpreadsheetNotFound':
+                    raise lookup_error from e
+                raise e
+        return RateLimitedSpreadsheet(spreadsheet, self._limiter)
+
+    def open(self, *args, **kwargs):
+        return RateLimitedSpreadsheet(self._limiter.call(self._client.open, *args, **kwargs), self._limiter)
+
+    def open_by_key(self, key):
+        return RateLimitedSpreadsheet(self._limiter.call(self._client.open_by_key, key), self._limiter)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
@@ -0,0 +1,63 @@
+"""Gunicorn settings for ``gunicorn wsgi:app`` (read automatically from the working directory).
+
+Worker processes default to 2 x CPU + 1, capped by how many fit in the
+container's memory limit (WORKER_MEMORY_MB each). Every worker serves
+GUNICORN_THREADS requests concurrently. Override with WEB_CONCURRENCY.
+"""
+import os
+
+
+def _memory_limit_mb():
+    """Container memory limit (cgroup v2 / v1), falling back to physical memory."""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 50:
+            return int(value) // (1024 * 1024)
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def _default_workers():
+    by_cpu = (os.cpu_count() or 1) * 2 + 1
+    memory_mb = _memory_limit_mb()
+    if not memory_mb:
+        return by_cpu
+    by_memory = memory_mb // int(os.environ.get('WORKER_MEMORY_MB', 200))
+    return max(1, min(by_cpu, by_memory))
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 0)) or _default_workers()
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+# Import the app (and run DB setup) once in the master, then fork
+preload_app = True
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+# Recycle workers periodically so slow leaks (pandas, openpyxl) cannot build up
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    from app import app, db, start_background_workers
+
+    with app.app_context():
+        db.engine.dispose(close=False)
+    start_background_workers()
+
+
+def worker_exit(server, worker):
+    from app import stop_background_workers
+
+    # Leave a margin inside graceful_timeout so gunicorn does not kill the drain
+    stop_background_workers(timeout=max(1, graceful_timeout - 5))
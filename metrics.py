@@ -0,0 +1,228 @@
+"""In-process performance metrics in Prometheus text format.
+
+Request latency, SQL query counts and durations, outbound API calls and
+background jobs are recorded into histograms and counters held by this
+worker process, and rendered by /admin/metrics. Each gunicorn worker keeps
+its own numbers; every sample carries a ``pid`` label so scrapes from
+different workers can be told apart and summed.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250, 1000)
+MAX_LOGGED_QUERIES = 50
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self, base_labels):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            labels = base_labels + list(zip(self.labelnames, key))
+            lines.append(f'{self.name}{_format_labels(labels)} {_format_number(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = [0] * len(self.buckets) + [0.0, 0]
+                self._series[key] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self, base_labels):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            labels = base_labels + list(zip(self.labelnames, key))
+            for bound, count in zip(self.buckets, series):
+                bucket_labels = _format_labels(labels + [('le', _format_number(bound))])
+                lines.append(f'{self.name}_bucket{bucket_labels} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(labels)} {series[-2]!r}')
+            lines.append(f'{self.name}_count{_format_labels(labels)} {series[-1]}')
+        return lines
+
+
+class Registry:
+    """Metrics plus gauge callbacks, rendered together in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+        self._gauges = []
+
+    def counter(self, *args, **kwargs):
+        metric = Counter(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs):
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def gauges(self, prefix, documentation, collect):
+        """Register ``collect()`` -> {name: number}; each numeric value becomes a gauge ``<prefix>_<name>``."""
+        self._gauges.append((prefix, documentation, collect))
+
+    def render(self):
+        base_labels = [('pid', os.getpid())]
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(base_labels))
+        for prefix, documentation, collect in self._gauges:
+            try:
+                values = collect()
+            except Exception:
+                continue
+            for name, value in sorted(values.items()):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                metric_name = f'{prefix}_{name}'
+                lines.append(f'# HELP {metric_name} {documentation}')
+                lines.append(f'# TYPE {metric_name} gauge')
+                lines.append(f'{metric_name}{_format_labels(base_labels)} {_format_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'oms_http_request_duration_seconds', 'Request latency by route.', ('endpoint', 'method', 'status'))
+HTTP_REQUEST_QUERIES = REGISTRY.histogram(
+    'oms_http_request_sql_queries', 'SQL statements executed per request.', ('endpoint',), COUNT_BUCKETS)
+HTTP_REQUEST_SQL_SECONDS = REGISTRY.histogram(
+    'oms_http_request_sql_seconds', 'Total SQL time per request.', ('endpoint',))
+SQL_QUERY_SECONDS = REGISTRY.histogram(
+    'oms_sql_query_duration_seconds', 'Duration of single SQL statements.', ('context', 'operation'))
+OUTBOUND_CALL_SECONDS = REGISTRY.histogram(
+    'oms_outbound_call_duration_seconds', 'Calls to Twilio and Google APIs.', ('service', 'operation', 'outcome'))
+BACKGROUND_JOB_SECONDS = REGISTRY.histogram(
+    'oms_background_job_duration_seconds', 'Outbox job run time.', ('kind', 'outcome'))
+SLOW_REQUESTS = REGISTRY.counter(
+    'oms_slow_requests_total', 'Requests slower than SLOW_REQUEST_MS.', ('endpoint',))
+
+
+@contextmanager
+def track_outbound(service, operation):
+    """Time a call to an external API; the outcome label is 'error' if the block raises."""
+    started = time.perf_counter()
+    outcome = 'ok'
+    try:
+        yield
+    except Exception:
+        outcome = 'error'
+        raise
+    finally:
+        OUTBOUND_CALL_SECONDS.observe(time.perf_counter() - started,
+                                      service=service, operation=operation, outcome=outcome)
+
+
+def _operation(statement):
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'UNKNOWN'
+
+
+class RequestInstrumentation:
+    """Per-request latency, SQL statement timing and the slow-request log for one app and engine."""
+
+    def __init__(self, app, engine, slow_request_ms=1000):
+        self.app = app
+        self.slow_request_ms = slow_request_ms
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _before_request(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_queries = []
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('metrics_query_started')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        in_request = has_request_context() and hasattr(g, 'metrics_queries')
+        SQL_QUERY_SECONDS.observe(elapsed, context='request' if in_request else 'background',
+                                  operation=_operation(statement))
+        if in_request:
+            g.metrics_queries.append((statement, elapsed))
+
+    def _after_request(self, response):
+        started = g.pop('metrics_started', None)
+        queries = g.pop('metrics_queries', [])
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        sql_seconds = sum(duration for _, duration in queries)
+        HTTP_REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+        HTTP_REQUEST_QUERIES.observe(len(queries), endpoint=endpoint)
+        HTTP_REQUEST_SQL_SECONDS.observe(sql_seconds, endpoint=endpoint)
+        if elapsed * 1000 >= self.slow_request_ms:
+            SLOW_REQUESTS.inc(endpoint=endpoint)
+            self._log_slow_request(endpoint, elapsed, queries, sql_seconds)
+        return response
+
+    def _log_slow_request(self, endpoint, elapsed, queries, sql_seconds):
+        lines = [
+            f'Slow request {request.method} {endpoint} took {elapsed * 1000:.0f}ms '
+            f'({len(queries)} queries, {sql_seconds * 1000:.0f}ms in SQL)'
+        ]
+        for statement, duration in queries[:MAX_LOGGED_QUERIES]:
+            lines.append(f'  {duration * 1000:8.1f}ms  {" ".join(statement.split())[:300]}')
+        if len(queries) > MAX_LOGGED_QUERIES:
+            lines.append(f'  ... {len(queries) - MAX_LOGGED_QUERIES} more queries')
+        self.app.logger.warning('\n'.join(lines))
@@ -0,0 +1,210 @@
+"""Versioned schema migrations.
+
+``db.create_all()`` only creates missing tables; it never changes existing
+ones. Changes to tables that already hold data (new columns, indexes,
+constraints) are listed here in order. Each one runs once, in its own
+transaction, and is recorded in ``schema_migrations``. Every step is written
+to be safe to re-run, so a process that races another one at startup is
+harmless.
+"""
+import json
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, func, inspect, select, text
+from sqlalchemy.exc import IntegrityError
+
+schema_metadata = MetaData()
+schema_migrations = Table(
+    'schema_migrations', schema_metadata,
+    Column('version', String(50), primary_key=True),
+    Column('applied_at', DateTime, nullable=False)
+)
+
+# Arbitrary key for the PostgreSQL advisory lock that serializes migrations across workers
+MIGRATION_LOCK_KEY = 720451
+
+
+def create_indexes(connection, metadata, names):
+    """Create the named model indexes that do not exist yet."""
+    for table in metadata.tables.values():
+        for index in table.indexes:
+            if index.name in names:
+                index.create(connection, checkfirst=True)
+
+
+def add_order_sheet_url(connection, metadata):
+    """Legacy databases predate Order.sheet_url."""
+    order_columns = [col['name'] for col in inspect(connection).get_columns('order')]
+    if 'sheet_url' not in order_columns:
+        connection.execute(text('ALTER TABLE "order" ADD COLUMN sheet_url VARCHAR(500)'))
+
+
+def widen_password_hash(connection, metadata):
+    """scrypt hashes need VARCHAR(200); early PostgreSQL tables used VARCHAR(120)."""
+    # SQLite does not enforce VARCHAR lengths, so only PostgreSQL needs the change
+    if connection.dialect.name != 'postgresql':
+        return
+    user_columns = {col['name']: col for col in inspect(connection).get_columns('user')}
+    if '120' in str(user_columns['password_hash']['type']):
+        connection.execute(text('ALTER TABLE "user" ALTER COLUMN password_hash TYPE VARCHAR(200)'))
+
+
+def dedupe_products(connection, metadata):
+    """Keep one product per lot_type_code (the most recently updated) before it becomes unique."""
+    product = metadata.tables['product']
+    duplicate_codes = select(product.c.lot_type_code).group_by(product.c.lot_type_code).having(func.count() > 1)
+    rows = connection.execute(
+        select(product.c.id, product.c.lot_type_code)
+        .where(product.c.lot_type_code.in_(duplicate_codes))
+        .order_by(product.c.lot_type_code, product.c.updated_at.desc(), product.c.id.desc())
+    ).all()
+    keep = set()
+    remove = []
+    for product_id, code in rows:
+        if code in keep:
+            remove.append(product_id)
+        else:
+            keep.add(code)
+    for start in range(0, len(remove), 500):
+        connection.execute(product.delete().where(product.c.id.in_(remove[start:start + 500])))
+
+
+def add_hot_query_indexes(connection, metadata):
+    create_indexes(connection, metadata, {
+        'ux_product_lot_type_code',
+        'ix_order_user_id_created_at',
+        'ix_order_created_at',
+        'ix_notification_read_created_at',
+        'ix_notification_created_at',
+        'ix_notification_order_id',
+        'ix_saved_cart_user_id'
+    })
+
+
+def add_catalog_versioning(connection, metadata):
+    """Per-product change stamps and the catalog version row for /api/products delta sync."""
+    product_columns = [col['name'] for col in inspect(connection).get_columns('product')]
+    if 'catalog_version' not in product_columns:
+        connection.execute(text('ALTER TABLE product ADD COLUMN catalog_version INTEGER NOT NULL DEFAULT 0'))
+    create_indexes(connection, metadata, {'ix_product_catalog_version'})
+    catalog_version = metadata.tables['catalog_version']
+    if not connection.execute(select(catalog_version.c.id)).first():
+        connection.execute(catalog_version.insert().values(id=1, version=0, reset_version=0))
+
+
+def add_order_status_index(connection, metadata):
+    create_indexes(connection, metadata, {'ix_order_status_created_at'})
+
+
+def backfill_order_items(connection, metadata):
+    """Copy the line items of existing orders from the order_data JSON blob into order_item."""
+    order = metadata.tables['order']
+    order_item = metadata.tables['order_item']
+    order_item.create(connection, checkfirst=True)
+    create_indexes(connection, metadata, {'ix_order_item_order_id', 'ix_order_item_product_id'})
+    has_items = select(order_item.c.id).where(order_item.c.order_id == order.c.id).exists()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            select(order.c.id, order.c.order_data)
+            .where(order.c.id > last_id, ~has_items)
+            .order_by(order.c.id)
+            .limit(500)
+        ).all()
+        if not rows:
+            break
+        items = []
+        for order_id, order_data in rows:
+            try:
+                lines = json.loads(order_data or '[]')
+            except ValueError:
+                lines = []
+            for line in lines:
+                items.append({
+                    'order_id': order_id,
+                    'product_id': line.get('product_id'),
+                    'lot_type_code': line.get('lot_type_code'),
+                    'parent_code': line.get('parent_code'),
+                    'item_lot_type': line.get('item_lot_type'),
+                    'quantity': int(line.get('quantity') or 0),
+                    'mrp': line.get('mrp'),
+                    'total': line.get('total') or 0
+                })
+        if items:
+            connection.execute(order_item.insert(), items)
+        last_id = rows[-1].id
+
+
+def add_admin_events(connection, metadata):
+    """Change feed for the admin dashboard's event stream."""
+    metadata.tables['admin_event'].create(connection, checkfirst=True)
+    create_indexes(connection, metadata, {'ix_admin_event_created_at'})
+
+
+def add_import_jobs(connection, metadata):
+    """Progress rows for background stock imports (/admin/upload_stock)."""
+    metadata.tables['import_job'].create(connection, checkfirst=True)
+
+
+def add_daily_spreadsheets(connection, metadata):
+    """Claim rows that pick one shared spreadsheet per day across workers (GOOGLE_SHEETS_MODE=daily)."""
+    metadata.tables['daily_spreadsheet'].create(connection, checkfirst=True)
+
+
+def add_order_sheet_id(connection, metadata):
+    """Order.sheet_id remembers a created spreadsheet, so a retried sheet job does not create another."""
+    order_columns = [col['name'] for col in inspect(connection).get_columns('order')]
+    if 'sheet_id' not in order_columns:
+        connection.execute(text('ALTER TABLE "order" ADD COLUMN sheet_id VARCHAR(200)'))
+
+
+MIGRATIONS = [
+    ('0001_order_sheet_url', add_order_sheet_url),
+    ('0002_widen_password_hash', widen_password_hash),
+    ('0003_dedupe_products', dedupe_products),
+    ('0004_hot_query_indexes', add_hot_query_indexes),
+    ('0005_catalog_versioning', add_catalog_versioning),
+    ('0006_order_status_index', add_order_status_index),
+    ('0007_order_items', backfill_order_items),
+    ('0008_admin_events', add_admin_events),
+    ('0009_import_jobs', add_import_jobs),
+    ('0010_daily_spreadsheets', add_daily_spreadsheets),
+    ('0011_order_sheet_id', add_order_sheet_id),
+]
+
+
+def pending_migrations(engine):
+    """Versions not yet recorded in schema_migrations, checked with a single query."""
+    with engine.connect() as connection:
+        if not inspect(connection).has_table('schema_migrations'):
+            return [version for version, _ in MIGRATIONS]
+        applied = set(connection.execute(select(schema_migrations.c.version)).scalars())
+    return [version for version, _ in MIGRATIONS if version not in applied]
+
+
+def run_migrations(engine, metadata, logger):
+    """Apply pending migrations in order and return the versions applied by this call."""
+    with engine.begin() as connection:
+        schema_migrations.create(connection, checkfirst=True)
+
+    applied_now = []
+    for version, migration in MIGRATIONS:
+        try:
+            with engine.begin() as connection:
+                if connection.dialect.name == 'postgresql':
+                    connection.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': MIGRATION_LOCK_KEY})
+                    # Backfills on large tables may run longer than the request statement timeout
+                    connection.execute(text('SET LOCAL statement_timeout = 0'))
+                already_applied = connection.execute(
+                    select(schema_migrations.c.version).where(schema_migrations.c.version == version)
+                ).first()
+                if already_applied:
+                    continue
+                logger.info(f'Applying schema migration {version}')
+                migration(connection, metadata)
+                connection.execute(schema_migrations.insert().values(version=version, applied_at=datetime.utcnow()))
+            applied_now.append(version)
+        except IntegrityError:
+            # Another process recorded the same migration first
+            logger.info(f'Schema migration {version} already applied by another process')
+    return applied_now
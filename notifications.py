@@ -0,0 +1,53 @@
+"""Notification read state: bulk acknowledgement and the cached unread count.
+
+Marking notifications read is a single UPDATE, either for one notification
+or for every one up to an id the admin has seen. The unread count is cached
+in each process and keyed on the newest admin event id. Every change to it
+(an order placed or deleted, notifications read) writes an admin event, so
+reads cost one primary-key lookup and the count is only redone after one of those.
+"""
+import threading
+
+from sqlalchemy import false, func, select, update
+
+
+def mark_notifications_read(db, notification_model, notification_id=None, up_to_id=None):
+    """Mark unread notifications read with one UPDATE in the caller's transaction; returns the rows changed."""
+    Notification = notification_model
+    criteria = [Notification.read == false()]
+    if notification_id is not None:
+        criteria.append(Notification.id == notification_id)
+    if up_to_id is not None:
+        criteria.append(Notification.id <= up_to_id)
+    result = db.session.execute(update(Notification).where(*criteria).values(read=True))
+    return result.rowcount
+
+
+class UnreadCounter:
+    """Process-level count of unread notifications, recounted only after an admin event."""
+
+    def __init__(self, db, notification_model, event_model):
+        self.db = db
+        self.notification_model = notification_model
+        self.event_model = event_model
+        self._cached = None  # (event head, unread count)
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'recounts': 0}
+
+    def get(self):
+        head = self.db.session.execute(select(func.max(self.event_model.id))).scalar() or 0
+        cached = self._cached
+        if cached is not None and cached[0] == head:
+            self.stats['hits'] += 1
+            return cached[1]
+        with self._lock:
+            cached = self._cached
+            if cached is None or cached[0] != head:
+                Notification = self.notification_model
+                count = self.db.session.execute(
+                    select(func.count()).select_from(Notification).where(Notification.read == false())
+                ).scalar()
+                cached = (head, count)
+                self._cached = cached
+                self.stats['recounts'] += 1
+            return cached[1]
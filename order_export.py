@@ -0,0 +1,95 @@
+"""Multi-order export for /admin/export_orders.
+
+Orders are read in id-ordered batches and turned into rows one at a time, so
+only one batch is ever held in memory. CSV is streamed to the client as it is
+produced. XLSX goes through openpyxl's ``write_only`` workbook into a temporary
+file, which is then streamed from disk.
+"""
+import csv
+import io
+import os
+
+from sqlalchemy.orm import joinedload, selectinload
+
+# Same columns as the single-order download, plus where each line came from
+EXPORT_HEADERS = ['Lot Type Code', 'Parent Code', 'Item Lot Type: Lot Type', 'MRP', 'BA Store Name',
+                  'Quantity Needed', 'Order ID', 'Order Date']
+EXPORT_BATCH_SIZE = 500
+CSV_FLUSH_ROWS = 1000
+FILE_CHUNK_SIZE = 64 * 1024
+
+
+def iter_export_rows(db, order_model, criteria, max_id, batch_size=EXPORT_BATCH_SIZE):
+    """Yield one row per line item of the matching orders with ``id <= max_id``, by order id."""
+    Order = order_model
+    last_id = 0
+    while True:
+        orders = (db.session.query(Order)
+                  .filter(*criteria, Order.id > last_id, Order.id <= max_id)
+                  .options(joinedload(Order.user), selectinload(Order.items))
+                  .order_by(Order.id)
+                  .limit(batch_size)
+                  .all())
+        if not orders:
+            return
+        for order in orders:
+            ba_username = order.user.username
+            order_date = order.created_at.strftime('%Y-%m-%d %H:%M:%S') if order.created_at else ''
+            for item in order.line_items:
+                yield [
+                    item.get('lot_type_code') or '',
+                    item.get('parent_code') or '',
+                    item.get('item_lot_type') or '',
+                    item.get('mrp') or 0,
+                    ba_username,
+                    item.get('quantity') or 0,
+                    order.id,
+                    order_date
+                ]
+        last_id = orders[-1].id
+
+
+def iter_csv(rows):
+    """Encode rows as CSV text chunks of up to CSV_FLUSH_ROWS lines, header first."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_HEADERS)
+    pending = 1
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= CSV_FLUSH_ROWS:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if pending:
+        yield buffer.getvalue()
+
+
+def write_xlsx(rows, path):
+    """Write rows to an XLSX file at ``path`` without keeping the sheet in memory. Returns the row count."""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Orders')
+    sheet.append(EXPORT_HEADERS)
+    count = 0
+    for row in rows:
+        sheet.append(row)
+        count += 1
+    workbook.save(path)
+    return count
+
+
+def iter_file_then_remove(path, chunk_size=FILE_CHUNK_SIZE):
+    """Stream a temporary file in chunks and delete it once the response is finished or aborted."""
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
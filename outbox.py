@@ -0,0 +1,182 @@
+"""Durable background job queue (transactional outbox) for slow post-order work.
+
+Jobs are rows written in the same database transaction as the order that needs
+them, so an order is never committed without its follow-up work and the HTTP
+request never waits on Google or Twilio. A worker thread drains the table with
+retries and exponential backoff. Claims are atomic UPDATEs, so several app
+processes can share one table safely.
+
+A handler that hands its work to another thread (e.g. the WhatsApp
+dispatcher) returns a ``Future``. The job stays claimed until the Future
+resolves and is retried if it raised. If the process dies first, the lease
+expires and the job runs again.
+"""
+import json
+import random
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from metrics import BACKGROUND_JOB_SECONDS
+
+
+class OutboxWorker:
+    """Drain pending outbox jobs on a background thread."""
+
+    def __init__(self, app, db, job_model, poll_interval=5.0, batch_size=10,
+                 max_attempts=5, base_backoff=5.0, max_backoff=600.0, lease_timeout=600.0):
+        self.app = app
+        self.db = db
+        self.job_model = job_model
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.lease_timeout = lease_timeout
+        self.handlers = {}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def register(self, kind, handler):
+        """Register ``handler(payload)`` for jobs of the given kind; it may return a Future (see above)."""
+        self.handlers[kind] = handler
+
+    def enqueue(self, kind, payload, delay=0):
+        """Add a job to the current session. The caller commits it with its own transaction."""
+        job = self.job_model(
+            kind=kind,
+            payload=json.dumps(payload),
+            status='pending',
+            attempts=0,
+            run_after=datetime.utcnow() + timedelta(seconds=delay)
+        )
+        self.db.session.add(job)
+        return job
+
+    def notify(self):
+        """Wake the worker so freshly committed jobs run without waiting for the next poll."""
+        self._wake.set()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='outbox-worker', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                processed = self.run_pending()
+            except Exception as e:
+                self.app.logger.error(f'Outbox worker loop error: {str(e)}', exc_info=True)
+                processed = 0
+            # Keep draining while there is a backlog, otherwise sleep until woken or polled
+            if processed < self.batch_size:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def run_pending(self, limit=None):
+        """Run one batch of due jobs and return how many were attempted."""
+        Job = self.job_model
+        with self.app.app_context():
+            self._release_stale()
+            now = datetime.utcnow()
+            # Only kinds with a handler here, so workers for different kinds can share the table
+            job_ids = [row[0] for row in self.db.session.query(Job.id)
+                       .filter(Job.status == 'pending', Job.run_after <= now, Job.kind.in_(list(self.handlers)))
+                       .order_by(Job.id)
+                       .limit(limit or self.batch_size)
+                       .all()]
+            processed = 0
+            for job_id in job_ids:
+                if self._stop.is_set():
+                    break
+                if self._claim(job_id):
+                    self._process(job_id)
+                    processed += 1
+            return processed
+
+    def _claim(self, job_id):
+        Job = self.job_model
+        result = self.db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == 'pending')
+            .values(status='running', locked_at=datetime.utcnow(), attempts=Job.attempts + 1)
+        )
+        self.db.session.commit()
+        return result.rowcount == 1
+
+    def _process(self, job_id):
+        job = self.db.session.get(self.job_model, job_id)
+        handler = self.handlers.get(job.kind)
+        kind = job.kind
+        started = time.perf_counter()
+        try:
+            if not handler:
+                raise RuntimeError(f'No handler registered for job kind "{job.kind}"')
+            result = handler(json.loads(job.payload or '{}'))
+            if isinstance(result, Future):
+                # Still claimed (locked_at set) until the work finishes on the other thread
+                result.add_done_callback(lambda future: self._settle(job_id, kind, started, future))
+                return
+            error = None
+        except Exception as e:
+            self.db.session.rollback()
+            error = e
+        self._finish(job_id, kind, started, error)
+
+    def _settle(self, job_id, kind, started, future):
+        """Finish a job whose handler returned ``future``; runs on the thread that resolved it."""
+        try:
+            with self.app.app_context():
+                self._finish(job_id, kind, started, future.exception())
+        except Exception as e:
+            # The job stays claimed; it runs again once its lease expires
+            self.app.logger.error(f'Outbox job #{job_id} ({kind}) could not be finished: {str(e)}', exc_info=True)
+
+    def _finish(self, job_id, kind, started, error=None):
+        """Mark a job done, or record ``error`` and schedule a retry (or fail it after max_attempts)."""
+        BACKGROUND_JOB_SECONDS.observe(time.perf_counter() - started, kind=kind, outcome='error' if error else 'done')
+        job = self.db.session.get(self.job_model, job_id)
+        job.locked_at = None
+        if error is None:
+            job.status = 'done'
+            job.last_error = None
+        else:
+            job.last_error = str(error)[:2000]
+            if job.attempts >= self.max_attempts:
+                job.status = 'failed'
+                self.app.logger.error(f'Outbox job #{job.id} ({job.kind}) failed after {job.attempts} attempts: {str(error)}')
+            else:
+                delay = self._backoff(job.attempts)
+                job.status = 'pending'
+                job.run_after = datetime.utcnow() + timedelta(seconds=delay)
+                self.app.logger.warning(f'Outbox job #{job.id} ({job.kind}) attempt {job.attempts} failed, retrying in {delay:.0f}s: {str(error)}')
+        self.db.session.commit()
+
+    def _backoff(self, attempts):
+        delay = min(self.max_backoff, self.base_backoff * (2 ** max(attempts - 1, 0)))
+        return delay * random.uniform(0.8, 1.2)
+
+    def _release_stale(self):
+        """Return jobs left 'running' by a crashed worker to the queue."""
+        Job = self.job_model
+        cutoff = datetime.utcnow() - timedelta(seconds=self.lease_timeout)
+        self.db.session.execute(
+            update(Job)
+            .where(Job.status == 'running', Job.locked_at < cutoff, Job.kind.in_(list(self.handlers)))
+            .values(status='pending', locked_at=None)
+        )
+        self.db.session.commit()
@@ -0,0 +1,75 @@
+"""Keyset (cursor) pagination for newest-first listings.
+
+Pages are addressed by the ``(created_at, id)`` of the last row already
+seen rather than an OFFSET, so every page is an index range scan no matter
+how deep the admin scrolls, and new orders arriving between requests do not
+shift rows across page boundaries.
+"""
+import base64
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class PaginationError(ValueError):
+    """A page size, cursor or filter value in the query string is invalid."""
+
+
+def encode_cursor(created_at, row_id):
+    raw = f'{created_at.isoformat()}|{row_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Return (created_at, id) from a cursor produced by encode_cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        created_at, row_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise PaginationError('Invalid cursor')
+
+
+def parse_page_size(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    if value in (None, ''):
+        return default
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        raise PaginationError('limit must be an integer')
+    if size < 1:
+        raise PaginationError('limit must be at least 1')
+    return min(size, maximum)
+
+
+def parse_date_range(date_from, date_to):
+    """Return (start, end) datetimes for inclusive YYYY-MM-DD bounds; ``end`` is exclusive."""
+    try:
+        start = datetime.strptime(date_from, '%Y-%m-%d') if date_from else None
+        end = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1) if date_to else None
+    except ValueError:
+        raise PaginationError('Dates must be YYYY-MM-DD')
+    return start, end
+
+
+def keyset_page(query, created_column, id_column, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """Return (rows, next_cursor) for the page after ``cursor``, newest first.
+
+    One extra row is fetched to know whether another page exists, so the
+    last page returns ``next_cursor=None`` without a count query.
+    """
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            created_column < created_at,
+            and_(created_column == created_at, id_column < row_id)
+        ))
+    rows = query.order_by(created_column.desc(), id_column.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, created_column.key), getattr(last, id_column.key))
@@ -0,0 +1,369 @@
+"""Product search for the order page (/api/products/search).
+
+MemorySearchIndex keeps a trigram index over lot_type_code, parent_code,
+item_lot_type and MRP in each worker, built from the catalog cache. When the
+catalog version moves it is updated incrementally from the changed products;
+only resets (deleted stock) rebuild it. Orders change quantities, not the
+indexed text, so they leave the index untouched.
+
+DatabaseSearch hands the matching to the database instead, for catalogs too
+large to index in every worker: an FTS5 table with the trigram tokenizer on
+SQLite, pg_trgm on PostgreSQL. Both backends return product ids in rank
+order; the caller resolves them against the catalog cache for current stock.
+"""
+import bisect
+import re
+import threading
+from collections import defaultdict
+
+from sqlalchemy import text
+
+# Indexed fields: lot_type_code, parent_code, item_lot_type, MRP. A term matching the lot code outranks the same match on parent code, item type or MRP
+FIELD_WEIGHTS = (4, 3, 2, 1)
+EXACT_SCORE = 100
+PREFIX_SCORE = 40
+SUBSTRING_SCORE = 10
+MAX_TERMS = 5
+_TOKEN_SPLIT = re.compile(r'[^0-9a-z]+')
+
+
+def normalize(value):
+    """Lowercase text with runs of whitespace collapsed; '' for None."""
+    return ' '.join(str(value).lower().split()) if value is not None else ''
+
+
+def query_terms(query):
+    return normalize(query).split()[:MAX_TERMS]
+
+
+def _mrp_text(mrp):
+    # Matches how the order page prints MRPs: 100.0 -> '100', 250.5 -> '250.5'
+    if mrp is None:
+        return ''
+    return str(int(mrp)) if mrp == int(mrp) else repr(mrp)
+
+
+def _document(entry):
+    return (normalize(entry.lot_type_code), normalize(entry.parent_code),
+            normalize(entry.item_lot_type), _mrp_text(entry.mrp))
+
+
+def _trigrams(value):
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def _tokens(document):
+    """Whole field values plus their alphanumeric parts, for prefix lookups of short terms."""
+    tokens = set()
+    for value in document:
+        if value:
+            tokens.add(value)
+            tokens.update(part for part in _TOKEN_SPLIT.split(value) if part)
+    return tokens
+
+
+def _word_start(term):
+    """Pattern for ``term`` at the start of a value or of one of its alphanumeric parts."""
+    return re.compile(r'(?<![0-9a-z])' + re.escape(term))
+
+
+def _term_score(document, term, word_start):
+    best = 0
+    for weight, value in zip(FIELD_WEIGHTS, document):
+        if not value or term not in value:
+            continue
+        if value == term:
+            score = EXACT_SCORE
+        elif word_start.search(value):
+            score = PREFIX_SCORE
+        else:
+            score = SUBSTRING_SCORE
+        best = max(best, score * weight)
+    return best
+
+
+class MemorySearchIndex:
+    """Trigram and token-prefix index over the catalog, kept in step with CatalogCache snapshots."""
+
+    def __init__(self):
+        self.version = None
+        self._documents = {}  # product id -> normalized field values
+        self._grams = defaultdict(set)  # trigram -> product ids
+        self._token_ids = defaultdict(set)  # token -> product ids
+        self._tokens = []  # sorted keys of _token_ids
+        self._lock = threading.Lock()
+        self.stats = {'documents': 0, 'rebuilds': 0, 'incremental_updates': 0, 'documents_reindexed': 0}
+
+    def sync(self, snapshot):
+        """Bring the index to ``snapshot``'s version, incrementally when possible."""
+        if self.version == snapshot.version:
+            return
+        with self._lock:
+            if self.version == snapshot.version:
+                return
+            if self.version is None or snapshot.reset_version > self.version or snapshot.version < self.version:
+                self._rebuild(snapshot.entries)
+            else:
+                self._update(snapshot.changed_since(self.version))
+                # Products can only disappear with a reset; a mismatch means this index missed one
+                if len(self._documents) != len(snapshot.entries):
+                    self._rebuild(snapshot.entries)
+            self.version = snapshot.version
+            self.stats['documents'] = len(self._documents)
+
+    def _rebuild(self, entries):
+        self._documents = {}
+        self._grams = defaultdict(set)
+        self._token_ids = defaultdict(set)
+        for entry in entries:
+            self._add(entry.id, _document(entry))
+        self._tokens = sorted(self._token_ids)
+        self.stats['rebuilds'] += 1
+
+    def _update(self, entries):
+        changed = 0
+        for entry in entries:
+            document = _document(entry)
+            previous = self._documents.get(entry.id)
+            if previous == document:
+                continue
+            if previous is not None:
+                self._remove(entry.id, previous)
+            self._add(entry.id, document)
+            changed += 1
+        if changed:
+            self._tokens = sorted(self._token_ids)
+            self.stats['documents_reindexed'] += changed
+        self.stats['incremental_updates'] += 1
+
+    def _add(self, product_id, document):
+        self._documents[product_id] = document
+        for value in document:
+            for gram in _trigrams(value):
+                self._grams[gram].add(product_id)
+        for token in _tokens(document):
+            self._token_ids[token].add(product_id)
+
+    def _remove(self, product_id, document):
+        for value in document:
+            for gram in _trigrams(value):
+                ids = self._grams.get(gram)
+                if ids is not None:
+                    ids.discard(product_id)
+                    if not ids:
+                        del self._grams[gram]
+        for token in _tokens(document):
+            ids = self._token_ids.get(token)
+            if ids is not None:
+                ids.discard(product_id)
+                if not ids:
+                    del self._token_ids[token]
+
+    def _estimate(self, term):
+        """Upper bound on the matches of a term of three or more characters."""
+        return min(len(self._grams.get(gram, ())) for gram in _trigrams(term))
+
+    def _candidates(self, term):
+        if len(term) >= 3:
+            postings = [self._grams.get(gram) for gram in _trigrams(term)]
+            if not all(postings):
+                return set()
+            postings.sort(key=len)
+            ids = set(postings[0]).intersection(*postings[1:])
+            # Trigrams can all be present without the term itself; confirm the substring
+            return {product_id for product_id in ids if any(term in value for value in self._documents[product_id])}
+        # One or two characters: prefixes of whole values and their parts
+        ids = set()
+        tokens = self._tokens
+        position = bisect.bisect_left(tokens, term)
+        while position < len(tokens) and tokens[position].startswith(term):
+            ids |= self._token_ids[tokens[position]]
+            position += 1
+        return ids
+
+    def search(self, query):
+        """Return [(product_id, score)] for products matching every term, unordered."""
+        terms = query_terms(query)
+        if not terms:
+            return []
+        patterns = [(term, _word_start(term)) for term in terms]
+        with self._lock:
+            documents = self._documents
+            # Short terms are resolved up front (their size is only known that way); long
+            # ones are estimated by their rarest trigram. Start from the most selective.
+            short = {term: self._candidates(term) for term in terms if len(term) < 3}
+            first = min(terms, key=lambda term: len(short[term]) if term in short else self._estimate(term))
+            matches = short[first] if first in short else self._candidates(first)
+            for term in terms:
+                if term == first or not matches:
+                    continue
+                if term in short:
+                    matches = matches & short[term]
+                    continue
+                for gram in _trigrams(term):
+                    matches = matches & self._grams.get(gram, set())
+                matches = {product_id for product_id in matches
+                           if any(term in value for value in documents[product_id])}
+            if not matches:
+                return []
+            return [(product_id, sum(_term_score(documents[product_id], term, word_start)
+                                     for term, word_start in patterns))
+                    for product_id in matches]
+
+
+def _escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class DatabaseSearch:
+    """Search through SQLite FTS5 (trigram tokenizer) or PostgreSQL pg_trgm."""
+
+    # The PostgreSQL index and the query must use exactly this expression
+    PG_DOCUMENT = ("lower(coalesce(lot_type_code, '') || ' ' || coalesce(parent_code, '') || ' ' || "
+                   "coalesce(item_lot_type, ''))")
+
+    def __init__(self, db, logger):
+        self.db = db
+        self.logger = logger
+        self.available = False
+        self.stats = {'queries': 0}
+
+    def install(self):
+        """Create the search table or index if missing. Returns False if the database cannot do it."""
+        engine = self.db.engine
+        try:
+            with engine.begin() as connection:
+                if engine.dialect.name == 'sqlite':
+                    self._install_sqlite(connection)
+                elif engine.dialect.name == 'postgresql':
+                    self._install_postgresql(connection)
+                else:
+                    raise RuntimeError(f'no search support for {engine.dialect.name}')
+        except Exception as e:
+            self.logger.warning(f'Database product search is unavailable ({str(e)}); using the in-memory index')
+            return False
+        self.available = True
+        return True
+
+    def _install_sqlite(self, connection):
+        exists = connection.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'product_search'")).first()
+        if exists:
+            return
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE product_search USING fts5("
+            "lot_type_code, parent_code, item_lot_type, content='product', content_rowid='id', tokenize='trigram')"))
+        # External-content FTS tables are kept in step by triggers; quantity updates do not fire them
+        connection.execute(text(
+            "CREATE TRIGGER product_search_ai AFTER INSERT ON product BEGIN "
+            "INSERT INTO product_search(rowid, lot_type_code, parent_code, item_lot_type) "
+            "VALUES (new.id, new.lot_type_code, new.parent_code, new.item_lot_type); END"))
+        connection.execute(text(
+            "CREATE TRIGGER product_search_ad AFTER DELETE ON product BEGIN "
+            "INSERT INTO product_search(product_search, rowid, lot_type_code, parent_code, item_lot_type) "
+            "VALUES ('delete', old.id, old.lot_type_code, old.parent_code, old.item_lot_type); END"))
+        connection.execute(text(
+            "CREATE TRIGGER product_search_au AFTER UPDATE OF lot_type_code, parent_code, item_lot_type "
+            "ON product BEGIN "
+            "INSERT INTO product_search(product_search, rowid, lot_type_code, parent_code, item_lot_type) "
+            "VALUES ('delete', old.id, old.lot_type_code, old.parent_code, old.item_lot_type); "
+            "INSERT INTO product_search(rowid, lot_type_code, parent_code, item_lot_type) "
+            "VALUES (new.id, new.lot_type_code, new.parent_code, new.item_lot_type); END"))
+        connection.execute(text("INSERT INTO product_search(product_search) VALUES ('rebuild')"))
+
+    def _install_postgresql(self, connection):
+        connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        connection.execute(text(
+            f'CREATE INDEX IF NOT EXISTS ix_product_search_trgm ON product '
+            f'USING gin (({self.PG_DOCUMENT}) gin_trgm_ops)'))
+
+    def search(self, query, limit, offset):
+        """Return (total, [product ids in rank order]) for one page of results."""
+        terms = query_terms(query)
+        if not terms:
+            return 0, []
+        self.stats['queries'] += 1
+        if self.db.engine.dialect.name == 'sqlite':
+            return self._search_sqlite(terms, limit, offset)
+        return self._search_postgresql(terms, limit, offset)
+
+    def _search_sqlite(self, terms, limit, offset):
+        params = {'limit': limit, 'offset': offset}
+        long_terms = [term for term in terms if len(term) >= 3]
+        conditions = []
+        # The trigram tokenizer needs three characters; shorter terms are matched as prefixes
+        for i, term in enumerate(term for term in terms if len(term) < 3):
+            params[f'prefix{i}'] = _escape_like(term) + '%'
+            conditions.append(' OR '.join(f"lower(p.{field}) LIKE :prefix{i} ESCAPE '\\'"
+                                          for field in ('lot_type_code', 'parent_code', 'item_lot_type')))
+        where = ''.join(f' AND ({condition})' for condition in conditions)
+        if long_terms:
+            params['match'] = ' '.join('"' + term.replace('"', '""') + '"' for term in long_terms)
+            source = ('FROM product_search JOIN product p ON p.id = product_search.rowid '
+                      'WHERE product_search MATCH :match')
+            order = 'ORDER BY bm25(product_search, 4.0, 3.0, 2.0), p.lot_type_code'
+        else:
+            source = 'FROM product p WHERE 1 = 1'
+            order = 'ORDER BY p.lot_type_code'
+        session = self.db.session
+        total = session.execute(text(f'SELECT count(*) {source}{where}'), params).scalar()
+        ids = session.execute(text(f'SELECT p.id {source}{where} {order} LIMIT :limit OFFSET :offset'),
+                              params).scalars().all()
+        return total, ids
+
+    def _search_postgresql(self, terms, limit, offset):
+        params = {'limit': limit, 'offset': offset, 'query': ' '.join(terms)}
+        conditions = []
+        for i, term in enumerate(terms):
+            params[f'term{i}'] = f'%{_escape_like(term)}%'
+            conditions.append(f'{self.PG_DOCUMENT} LIKE :term{i}')
+        where = ' AND '.join(conditions)
+        session = self.db.session
+        total = session.execute(text(f'SELECT count(*) FROM product WHERE {where}'), params).scalar()
+        ids = session.execute(text(
+            f'SELECT id FROM product WHERE {where} '
+            f'ORDER BY similarity({self.PG_DOCUMENT}, :query) DESC, lot_type_code LIMIT :limit OFFSET :offset'
+        ), params).scalars().all()
+        return total, ids
+
+
+class ProductSearch:
+    """Ranked, paginated product search over the catalog cache."""
+
+    def __init__(self, catalog_cache, database_search=None):
+        self.catalog_cache = catalog_cache
+        self.database_search = database_search
+        self.index = MemorySearchIndex()
+
+    @property
+    def backend(self):
+        return 'database' if self.database_search and self.database_search.available else 'memory'
+
+    def stats(self):
+        stats = dict(self.index.stats)
+        if self.database_search:
+            stats.update({f'database_{name}': value for name, value in self.database_search.stats.items()})
+        return stats
+
+    def warm(self):
+        """Build the in-memory index ahead of the first search."""
+        if self.backend == 'memory':
+            self.index.sync(self.catalog_cache.get())
+
+    def search(self, query, limit, offset=0):
+        """Return (snapshot, total, entries) for one page of results.
+
+        Matches rank by how well each term matches (exact, prefix, substring;
+        lot code first); ties put products in stock first, then sort by code.
+        """
+        snapshot = self.catalog_cache.get()
+        if self.backend == 'database':
+            total, ids = self.database_search.search(query, limit, offset)
+            entries = [snapshot.by_id[product_id] for product_id in ids if product_id in snapshot.by_id]
+            return snapshot, total, entries
+
+        self.index.sync(snapshot)
+        matches = [(snapshot.by_id[product_id], score) for product_id, score in self.index.search(query)
+                   if product_id in snapshot.by_id]
+        matches.sort(key=lambda match: (-match[1], match[0].quantity_available <= 0, match[0].lot_type_code))
+        return snapshot, len(matches), [entry for entry, _ in matches[offset:offset + limit]]
@@ -0,0 +1,359 @@
+"""Stand-ins for Google Sheets/Drive and Twilio, for offline load tests.
+
+Order sheets are written through a gspread-style client (``create``/``open``/``open_by_key``
+returning spreadsheets with ``batch_update`` and ``url``), and WhatsApp
+messages through a sender with ``send(account_sid, auth_token, data, timeout)``.
+Production uses gspread and Twilio. SHEETS_BACKEND / WHATSAPP_BACKEND can
+swap in instead:
+
+- ``fake``: in-process fakes, no network at all;
+- ``stub``: real HTTP to a local stub server (``python providers.py``), so
+  connection pooling, timeouts and retries are exercised as well.
+
+Both inject latency, 429 quota errors and 5xx failures described by a fault
+spec such as ``latency_ms=200,jitter_ms=100,rate_429=0.05,rate_5xx=0.01``
+(PROVIDER_FAULTS for the fakes, ``--faults`` for the stub server).
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+FAULT_FIELDS = ('latency_ms', 'jitter_ms', 'rate_429', 'rate_5xx')
+
+# Error bodies in the shape each provider returns them
+ERROR_BODIES = {
+    ('sheets', 429): {'error': {'code': 429, 'status': 'RESOURCE_EXHAUSTED', 'message': (
+        "Quota exceeded for quota metric 'Write requests' and limit 'Write requests per minute per user'")}},
+    ('sheets', 503): {'error': {'code': 503, 'status': 'UNAVAILABLE', 'message': 'The service is currently unavailable.'}},
+    ('twilio', 429): {'code': 20429, 'status': 429, 'message': 'Too Many Requests'},
+    ('twilio', 503): {'code': 20500, 'status': 503, 'message': 'Service Unavailable'},
+}
+
+
+class FaultProfile:
+    """Latency and error injection shared by the fakes and the stub server."""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, rate_429=0.0, rate_5xx=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'injected_429': 0, 'injected_5xx': 0}
+
+    @classmethod
+    def parse(cls, spec, seed=None):
+        """Build a profile from ``name=value`` pairs separated by commas; an empty spec injects nothing."""
+        values = {}
+        for part in filter(None, (part.strip() for part in (spec or '').split(','))):
+            name, _, value = part.partition('=')
+            if name.strip() not in FAULT_FIELDS:
+                raise ValueError(f'Unknown fault setting "{name.strip()}" (expected one of {", ".join(FAULT_FIELDS)})')
+            values[name.strip()] = float(value)
+        return cls(seed=seed, **values)
+
+    def describe(self):
+        return {name: getattr(self, name) for name in FAULT_FIELDS}
+
+    def next(self):
+        """Sleep for this call's latency and return the HTTP status to fail it with, or None."""
+        with self._lock:
+            delay = max(0.0, self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+            roll = self._random.random()
+            self.stats['calls'] += 1
+            status = None
+            if roll < self.rate_429:
+                status = 429
+                self.stats['injected_429'] += 1
+            elif roll < self.rate_429 + self.rate_5xx:
+                status = 503
+                self.stats['injected_5xx'] += 1
+        if delay:
+            time.sleep(delay)
+        return status
+
+
+class ProviderAPIError(Exception):
+    """An error status from a sheets stand-in, worded like gspread's APIError."""
+
+    def __init__(self, status, message):
+        super().__init__(f'APIError: [{status}]: {message}')
+        self.status = status
+
+
+class SpreadsheetNotFound(Exception):
+    """Raised by ``open`` like gspread's exception of the same name."""
+
+
+def _sheets_error(status):
+    return ProviderAPIError(status, ERROR_BODIES[('sheets', status)]['error']['message'])
+
+
+# --- In-process fakes -----------------------------------------------------------------------
+
+class FakeSpreadsheet:
+    def __init__(self, client, title):
+        self.client = client
+        self.id = uuid.uuid4().hex
+        self.title = title
+        self.url = f'https://docs.google.com/spreadsheets/d/fake-{self.id}'
+        self.batch_updates = 0
+
+    def batch_update(self, body):
+        status = self.client.faults.next()
+        if status:
+            raise _sheets_error(status)
+        self.batch_updates += 1
+        return {'spreadsheetId': self.id, 'replies': [{} for _ in body.get('requests', [])]}
+
+
+class FakeSheetsClient:
+    """gspread-like client that keeps spreadsheets in memory."""
+
+    def __init__(self, faults=None):
+        self.faults = faults or FaultProfile()
+        self._by_title = {}
+        self._by_key = {}
+        self._lock = threading.Lock()
+
+    def create(self, title, folder_id=None):
+        status = self.faults.next()
+        if status:
+            raise _sheets_error(status)
+        spreadsheet = FakeSpreadsheet(self, title)
+        with self._lock:
+            self._by_title[title] = spreadsheet
+            self._by_key[spreadsheet.id] = spreadsheet
+        return spreadsheet
+
+    def open(self, title):
+        status = self.faults.next()
+        if status:
+            raise _sheets_error(status)
+        with self._lock:
+            spreadsheet = self._by_title.get(title)
+        if spreadsheet is None:
+            raise SpreadsheetNotFound(title)
+        return spreadsheet
+
+    def open_by_key(self, key):
+        status = self.faults.next()
+        if status:
+            raise _sheets_error(status)
+        with self._lock:
+            spreadsheet = self._by_key.get(key)
+        if spreadsheet is None:
+            raise SpreadsheetNotFound(key)
+        return spreadsheet
+
+
+class FakeResponse:
+    """Just enough of ``requests.Response`` for the WhatsApp dispatcher."""
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self._body = body
+        self.text = json.dumps(body)
+
+    def json(self):
+        return self._body
+
+
+class FakeMessageSender:
+    """Accepts WhatsApp messages in memory, answering like Twilio's Messages API."""
+
+    def __init__(self, faults=None):
+        self.faults = faults or FaultProfile()
+        self.sent = 0
+
+    def send(self, account_sid, auth_token, data, timeout):
+        status = self.faults.next()
+        if status:
+            return FakeResponse(status, ERROR_BODIES[('twilio', status)])
+        self.sent += 1
+        return FakeResponse(201, {'sid': f'SM{uuid.uuid4().hex}', 'status': 'queued', 'to': data.get('To')})
+
+
+# --- HTTP stub server and the sheets client that talks to it -------------------------------
+
+class StubSpreadsheet:
+    def __init__(self, client, data):
+        self.client = client
+        self.id = data['id']
+        self.title = data['title']
+        self.url = data['url']
+
+    def batch_update(self, body):
+        return self.client._request('POST', f'/sheets/spreadsheets/{self.id}/batchUpdate', json=body)
+
+
+class StubSheetsClient:
+    """gspread-like client for the stub server's sheets endpoints, over one pooled session."""
+
+    def __init__(self, base_url, timeout=30, pool_size=4):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+    def _request(self, method, path, **kwargs):
+        response = self.session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+        if response.status_code == 404:
+            raise SpreadsheetNotFound(path)
+        if response.status_code >= 400:
+            try:
+                message = response.json()['error']['message']
+            except (ValueError, KeyError, TypeError):
+                message = response.text
+            raise ProviderAPIError(response.status_code, message)
+        return response.json()
+
+    def create(self, title, folder_id=None):
+        return StubSpreadsheet(self, self._request('POST', '/sheets/spreadsheets',
+                                                   json={'title': title, 'folder_id': folder_id}))
+
+    def open(self, title):
+        return StubSpreadsheet(self, self._request('GET', '/sheets/spreadsheets', params={'title': title}))
+
+    def open_by_key(self, key):
+        return StubSpreadsheet(self, self._request('GET', f'/sheets/spreadsheets/{key}'))
+
+
+TWILIO_MESSAGES_PATH = re.compile(r'^/2010-04-01/Accounts/[^/]+/Messages\.json$')
+BATCH_UPDATE_PATH = re.compile(r'^/sheets/spreadsheets/([0-9a-f]+)/batchUpdate$')
+SPREADSHEET_PATH = re.compile(r'^/sheets/spreadsheets/([0-9a-f]+)$')
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real APIs
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/stats':
+            return self._reply(200, self.server.stub.stats())
+        if url.path == '/sheets/spreadsheets':
+            status = self.server.stub.faults.next()
+            if status:
+                return self._reply(status, ERROR_BODIES[('sheets', status)])
+            title = parse_qs(url.query).get('title', [''])[0]
+            spreadsheet = self.server.stub.spreadsheets.get(title)
+            if spreadsheet is None:
+                return self._reply(404, {'error': {'code': 404, 'message': 'Spreadsheet not found'}})
+            return self._reply(200, spreadsheet)
+        match = SPREADSHEET_PATH.match(url.path)
+        if match:
+            status = self.server.stub.faults.next()
+            if status:
+                return self._reply(status, ERROR_BODIES[('sheets', status)])
+            for spreadsheet in list(self.server.stub.spreadsheets.values()):
+                if spreadsheet['id'] == match.group(1):
+                    return self._reply(200, spreadsheet)
+            return self._reply(404, {'error': {'code': 404, 'message': 'Spreadsheet not found'}})
+        self._reply(404, {'error': {'code': 404, 'message': 'Not found'}})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        body = self._body()
+        stub = self.server.stub
+        provider = 'twilio' if TWILIO_MESSAGES_PATH.match(path) else 'sheets'
+        if provider == 'sheets' and path != '/sheets/spreadsheets' and not BATCH_UPDATE_PATH.match(path):
+            return self._reply(404, {'error': {'code': 404, 'message': 'Not found'}})
+        status = stub.faults.next()
+        if status:
+            return self._reply(status, ERROR_BODIES[(provider, status)])
+        if provider == 'twilio':
+            stub.count('messages')
+            fields = parse_qs(body.decode())
+            return self._reply(201, {'sid': f'SM{uuid.uuid4().hex}', 'status': 'queued',
+                                     'to': fields.get('To', [''])[0]})
+        if path == '/sheets/spreadsheets':
+            request = json.loads(body or b'{}')
+            spreadsheet_id = uuid.uuid4().hex
+            spreadsheet = {'id': spreadsheet_id, 'title': request.get('title', ''),
+                           'url': f'https://docs.google.com/spreadsheets/d/stub-{spreadsheet_id}'}
+            stub.spreadsheets[spreadsheet['title']] = spreadsheet
+            stub.count('spreadsheets_created')
+            return self._reply(200, spreadsheet)
+        stub.count('batch_updates')
+        self._reply(200, {'spreadsheetId': BATCH_UPDATE_PATH.match(path).group(1), 'replies': []})
+
+
+class StubServer:
+    """Local HTTP server answering the Twilio Messages API and the stub sheets endpoints."""
+
+    def __init__(self, faults=None, host='127.0.0.1', port=0):
+        self.faults = faults or FaultProfile()
+        self.spreadsheets = {}
+        self._counts = {'messages': 0, 'spreadsheets_created': 0, 'batch_updates': 0}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), _StubHandler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        return dict(counts, **self.faults.stats, faults=self.faults.describe())
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='provider-stub', daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve stand-ins for Twilio and Google Sheets on a local port.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--faults', default='', help='e.g. latency_ms=200,jitter_ms=100,rate_429=0.05,rate_5xx=0.01')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+    stub = StubServer(FaultProfile.parse(args.faults, seed=args.seed), args.host, args.port)
+    print(f'Provider stub listening on {stub.url} (faults: {stub.faults.describe()}); '
+          f'run the app with SHEETS_BACKEND=stub WHATSAPP_BACKEND=stub PROVIDER_STUB_URL={stub.url}', flush=True)
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
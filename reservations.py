@@ -0,0 +1,123 @@
+"""Stock reservation for place_order.
+
+All cart products are read with one ``IN`` query (``SELECT ... FOR UPDATE``
+on databases with row locks, in id order so concurrent orders cannot
+deadlock). Every shortage is reported together before anything is written.
+Each line is then decremented with a conditional UPDATE
+(``quantity_available >= :quantity``), so stock can never go negative, even
+on SQLite where FOR UPDATE is not available.
+"""
+from datetime import datetime
+
+from sqlalchemy import update
+from sqlalchemy.orm.attributes import set_committed_value
+
+
+class ReservationError(Exception):
+    """The cart cannot be reserved; ``shortages`` lists every failing line."""
+
+    def __init__(self, message, shortages=None):
+        super().__init__(message)
+        self.shortages = shortages or []
+
+
+def _whole_number(value):
+    """``value`` as an int if it is a whole number (a JSON integer or a string of digits), else None.
+
+    int() would truncate 2.5 to 2 and turn True into 1.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        try:
+            return int(value.strip())
+        except ValueError:
+            return None
+    return None
+
+
+def merge_cart_lines(items):
+    """Return {product_id: quantity} for positive quantities, adding up repeated products."""
+    lines = {}
+    for item in items:
+        product_id = item.get('product_id')
+        quantity = _whole_number(item.get('quantity', 0))
+        if quantity is None:
+            raise ReservationError(f'Invalid quantity for product {product_id}')
+        if quantity <= 0:
+            continue
+        try:
+            product_id = int(product_id)
+        except (TypeError, ValueError):
+            product_id = None
+        if not product_id:
+            raise ReservationError('Invalid product ID')
+        lines[product_id] = lines.get(product_id, 0) + quantity
+    return lines
+
+
+def _shortage_message(shortages):
+    return '; '.join(
+        f'Insufficient stock for {s["lot_type_code"]}. Available: {s["available"]}' for s in shortages
+    )
+
+
+def reserve_stock(db, product_model, lines):
+    """Decrement stock for every cart line inside the caller's transaction.
+
+    Returns [(product, quantity)] in cart order, with ``quantity_available``
+    already showing the new stock. Raises ReservationError without writing
+    anything if a product is missing or short. The caller commits, or rolls
+    back on error.
+    """
+    Product = product_model
+    products = {
+        p.id: p for p in db.session.query(Product)
+        .filter(Product.id.in_(list(lines)))
+        .order_by(Product.id)
+        .with_for_update()
+    }
+
+    missing = [product_id for product_id in lines if product_id not in products]
+    if missing:
+        raise ReservationError(f'Product {missing[0]} not found')
+
+    shortages = [{
+        'product_id': product_id,
+        'lot_type_code': products[product_id].lot_type_code,
+        'requested': quantity,
+        'available': products[product_id].quantity_available
+    } for product_id, quantity in lines.items() if quantity > products[product_id].quantity_available]
+    if shortages:
+        raise ReservationError(_shortage_message(shortages), shortages)
+
+    now = datetime.utcnow()
+    returning = db.session.get_bind().dialect.update_returning
+    for product_id in sorted(lines):
+        quantity = lines[product_id]
+        stmt = (update(Product)
+                .where(Product.id == product_id, Product.quantity_available >= quantity)
+                .values(quantity_available=Product.quantity_available - quantity, updated_at=now)
+                .execution_options(synchronize_session=False))
+        product = products[product_id]
+        if returning:
+            remaining = db.session.execute(stmt.returning(Product.quantity_available)).scalar_one_or_none()
+            applied = remaining is not None
+        else:
+            applied = db.session.execute(stmt).rowcount == 1
+            remaining = product.quantity_available - quantity
+        if not applied:
+            # Another order took the stock between the read and the write
+            db.session.refresh(product)
+            shortage = {
+                'product_id': product_id,
+                'lot_type_code': product.lot_type_code,
+                'requested': quantity,
+                'available': product.quantity_available
+            }
+            raise ReservationError(_shortage_message([shortage]), [shortage])
+        set_committed_value(product, 'quantity_available', remaining)
+
+    return [(products[product_id], lines[product_id]) for product_id in lines]
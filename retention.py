@@ -0,0 +1,26 @@
+"""Batched cleanup of rows that are only useful for a while.
+
+Read notifications and admin dashboard events are deleted once they pass
+their retention period. Deletes run in small batches, each in its own short
+transaction, so a large backlog never holds the SQLite write lock, or
+PostgreSQL row locks, for long.
+"""
+from sqlalchemy import delete, select
+
+DELETE_BATCH_SIZE = 1000
+
+
+def delete_in_batches(db, model, criteria, batch_size=DELETE_BATCH_SIZE):
+    """Delete the rows of ``model`` matching ``criteria``, committing after each batch; returns the count."""
+    deleted = 0
+    while True:
+        ids = db.session.execute(
+            select(model.id).where(*criteria).order_by(model.id).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            return deleted
+        db.session.execute(delete(model).where(model.id.in_(ids)))
+        db.session.commit()
+        deleted += len(ids)
+        if len(ids) < batch_size:
+            return deleted
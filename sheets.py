@@ -0,0 +1,222 @@
+"""Render order spreadsheets in memory and write them with one Sheets API call.
+
+The whole order grid (metadata, header, line items, total and formatting) is
+built as Sheets API ``RowData`` and sent in a single ``spreadsheets.batchUpdate``
+request, instead of one ``values.update`` per block.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from google_quota import error_reason
+from metrics import track_outbound
+
+ORDER_HEADERS = ['#', 'Lot Type Code', 'Item Type', 'Parent Code', 'Quantity Needed', 'MRP', 'Line Total (₹)']
+
+CURRENCY_FORMAT = {'numberFormat': {'type': 'NUMBER', 'pattern': '#,##0.00'}}
+BOLD_FORMAT = {'textFormat': {'bold': True}}
+HEADER_FORMAT = {
+    'textFormat': {'bold': True},
+    'backgroundColor': {'red': 0.9, 'green': 0.92, 'blue': 0.98}
+}
+MIN_GRID_ROWS = 100
+
+
+def _cell(value, cell_format=None):
+    cell = {}
+    if isinstance(value, bool):
+        cell['userEnteredValue'] = {'boolValue': value}
+    elif isinstance(value, (int, float)):
+        cell['userEnteredValue'] = {'numberValue': value}
+    elif value is not None and value != '':
+        cell['userEnteredValue'] = {'stringValue': str(value)}
+    if cell_format:
+        cell['userEnteredFormat'] = cell_format
+    return cell
+
+
+def _row(values, formats=None):
+    formats = formats or {}
+    return {'values': [_cell(value, formats.get(i)) for i, value in enumerate(values)]}
+
+
+def render_order_grid(order_id, ba_username, order_date, status, items, total_amount):
+    """Return the order sheet as a list of RowData dicts, matching the legacy layout."""
+    label = {0: BOLD_FORMAT}
+    rows = [
+        _row(['Order ID', order_id], label),
+        _row(['BA Username', ba_username], label),
+        _row(['Order Date', order_date], label),
+        _row(['Status', status or 'pending'], label),
+        _row([]),
+        _row(ORDER_HEADERS, {i: HEADER_FORMAT for i in range(len(ORDER_HEADERS))}),
+    ]
+    for idx, item in enumerate(items, start=1):
+        rows.append(_row([
+            idx,
+            item.get('lot_type_code') or '',
+            item.get('item_lot_type') or '',
+            item.get('parent_code') or '',
+            item.get('quantity') or 0,
+            item.get('mrp') or 0,
+            item.get('total') or 0
+        ], {5: CURRENCY_FORMAT, 6: CURRENCY_FORMAT}))
+    rows.append(_row([]))
+    rows.append(_row(
+        ['Total Amount (₹)', round(total_amount or 0, 2)],
+        {0: BOLD_FORMAT, 1: dict(CURRENCY_FORMAT, **BOLD_FORMAT)}
+    ))
+    return rows
+
+
+def order_sheet_requests(sheet_id, rows, title=None, add_sheet=False):
+    """Build the batchUpdate requests that write ``rows`` into one tab."""
+    properties = {
+        'sheetId': sheet_id,
+        'gridProperties': {'rowCount': max(len(rows), MIN_GRID_ROWS), 'columnCount': len(ORDER_HEADERS)}
+    }
+    if title:
+        properties['title'] = title[:100]
+
+    if add_sheet:
+        requests = [{'addSheet': {'properties': properties}}]
+    else:
+        fields = 'gridProperties(rowCount,columnCount)' + (',title' if title else '')
+        requests = [{'updateSheetProperties': {'properties': properties, 'fields': fields}}]
+
+    requests.append({'updateCells': {
+        'start': {'sheetId': sheet_id, 'rowIndex': 0, 'columnIndex': 0},
+        'rows': rows,
+        'fields': 'userEnteredValue,userEnteredFormat'
+    }})
+    requests.append({'autoResizeDimensions': {'dimensions': {
+        'sheetId': sheet_id, 'dimension': 'COLUMNS', 'startIndex': 0, 'endIndex': len(ORDER_HEADERS)
+    }}})
+    return requests
+
+
+def write_order_sheet(spreadsheet, rows, title='Order'):
+    """Fill the first tab of a freshly created spreadsheet in one API call."""
+    # A new spreadsheet's first tab always has sheetId 0, so no metadata fetch is needed
+    with track_outbound('google_sheets', 'batch_update'):
+        spreadsheet.batch_update({'requests': order_sheet_requests(0, rows, title=title)})
+    return spreadsheet.url
+
+
+def write_order_tab(spreadsheet, sheet_id, title, rows):
+    """Add a tab for one order to a shared spreadsheet in one API call and return its URL."""
+    try:
+        with track_outbound('google_sheets', 'batch_update'):
+            spreadsheet.batch_update({'requests': order_sheet_requests(sheet_id, rows, title=title, add_sheet=True)})
+    except Exception as e:
+        # batchUpdate is atomic, so an existing tab means an earlier attempt already wrote it
+        if error_reason(e) != 'duplicate_sheet':
+            raise
+    return f'{spreadsheet.url}#gid={sheet_id}'
+
+
+class DailySpreadsheets:
+    """Find-or-create for the shared spreadsheet that collects each day's orders.
+
+    Every gunicorn worker runs its own outbox, so the choice of spreadsheet is
+    made in the database: ``model`` has a unique title, and the worker whose
+    claim row goes in first opens or creates the spreadsheet and records its
+    id. The other workers wait for that id and open the same spreadsheet. A
+    claim still without an id after ``stale_after`` seconds (its worker died
+    mid-create) may be taken over.
+    """
+
+    def __init__(self, db, model, wait_seconds=60, poll_interval=0.5, stale_after=300):
+        self.db = db
+        self.table = model.__table__
+        self.wait_seconds = wait_seconds
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self._by_title = {}
+        self._lock = threading.Lock()
+
+    def get(self, client, title, create):
+        """Return the spreadsheet named ``title``, calling ``create(title)`` if no worker has one yet."""
+        with self._lock:
+            spreadsheet = self._by_title.get(title)
+            if spreadsheet is None:
+                spreadsheet = self._open_or_create(client, title, create)
+                # Only today's spreadsheet is ever needed again
+                self._by_title = {title: spreadsheet}
+            return spreadsheet
+
+    def clear(self):
+        with self._lock:
+            self._by_title = {}
+
+    def _open_or_create(self, client, title, create):
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            row = self._read(title)
+            if row is not None and row.spreadsheet_id:
+                with track_outbound('google_sheets', 'open'):
+                    return client.open_by_key(row.spreadsheet_id)
+            if row is None or row.claimed_at <= datetime.utcnow() - timedelta(seconds=self.stale_after):
+                claimed_at = self._claim(title, row)
+                if claimed_at is not None:
+                    try:
+                        spreadsheet = self._find_or_create(client, title, create)
+                    except Exception:
+                        self._release(title, claimed_at)
+                        raise
+                    self._record(title, spreadsheet)
+                    return spreadsheet
+            if time.monotonic() >= deadline:
+                # The outbox retries the job later
+                raise RuntimeError(f'Spreadsheet "{title}" is still being created by another worker')
+            time.sleep(self.poll_interval)
+
+    def _find_or_create(self, client, title, create):
+        # Spreadsheets created before the claim table existed are found by title
+        try:
+            with track_outbound('google_sheets', 'open'):
+                return client.open(title)
+        except Exception as e:
+            if type(e).__name__ != 'SpreadsheetNotFound':
+                raise
+        return create(title)
+
+    def _read(self, title):
+        with self.db.engine.connect() as connection:
+            return connection.execute(
+                select(self.table.c.spreadsheet_id, self.table.c.claimed_at).where(self.table.c.title == title)
+            ).first()
+
+    def _claim(self, title, row):
+        """Claim the creation of ``title``; returns the claim time, or None if another worker got it first."""
+        table = self.table
+        now = datetime.utcnow()
+        try:
+            with self.db.engine.begin() as connection:
+                if row is None:
+                    connection.execute(table.insert().values(title=title, claimed_at=now))
+                    return now
+                # Take over a stale claim, unless another worker just did
+                result = connection.execute(table.update().where(
+                    table.c.title == title, table.c.spreadsheet_id.is_(None), table.c.claimed_at == row.claimed_at
+                ).values(claimed_at=now))
+                return now if result.rowcount == 1 else None
+        except IntegrityError:
+            return None
+
+    def _release(self, title, claimed_at):
+        """Drop an unfinished claim so another worker can try."""
+        table = self.table
+        with self.db.engine.begin() as connection:
+            connection.execute(table.delete().where(
+                table.c.title == title, table.c.spreadsheet_id.is_(None), table.c.claimed_at == claimed_at
+            ))
+
+    def _record(self, title, spreadsheet):
+        table = self.table
+        with self.db.engine.begin() as connection:
+            connection.execute(table.update().where(table.c.title == title, table.c.spreadsheet_id.is_(None))
+                               .values(spreadsheet_id=spreadsheet.id))
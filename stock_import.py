@@ -0,0 +1,496 @@
+"""Bulk stock import engine for /admin/upload_stock.
+
+The uploaded file is read from the request stream in fixed-size batches.
+Each batch is normalized with vectorized pandas operations and diffed
+against the stored rows for its codes. Only new rows, rows whose values
+actually changed and (optionally) products missing from the sheet are
+written, with bulk mappings in fixed-size chunks.
+"""
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+from sqlalchemy import delete, select, update
+
+READ_BATCH_SIZE = 5000
+WRITE_CHUNK_SIZE = 1000
+# Codes per IN (...) lookup; stays below SQLite's 32766 bound parameters
+LOOKUP_CHUNK_SIZE = 5000
+# Rows written by an import in progress; replaced by the real catalog version just before commit
+PENDING_CATALOG_VERSION = -1
+STOCK_EXTENSIONS = ('.xlsx', '.xlsm', '.xls', '.csv')
+PREVIEW_LIMIT = 50
+ERROR_LIMIT = 100
+STOCK_FIELDS = ['parent_code', 'item_lot_type', 'quantity_available', 'mrp']
+
+
+class StockImportError(ValueError):
+    """The uploaded sheet cannot be imported (e.g. a required column is missing)."""
+
+
+class PhaseTimer:
+    """Collect wall-clock milliseconds per import phase."""
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            self.timings[name] = round(self.timings.get(name, 0) + elapsed, 1)
+
+
+def map_stock_columns(columns):
+    """Map sheet headers to Product fields using the same loose matching as the legacy importer."""
+    column_mapping = {}
+    for col in columns:
+        col_lower = str(col).lower()
+        if 'lot type code' in col_lower or 'lot_type_code' in col_lower:
+            column_mapping['lot_type_code'] = col
+        elif 'parent code' in col_lower or 'parent_code' in col_lower:
+            column_mapping['parent_code'] = col
+        elif 'item lot type' in col_lower or 'item_lot_type' in col_lower:
+            column_mapping['item_lot_type'] = col
+        elif 'quantity' in col_lower and 'available' in col_lower:
+            column_mapping['quantity_available'] = col
+        elif 'mrp' in col_lower:
+            column_mapping['mrp'] = col
+    if 'lot_type_code' not in column_mapping:
+        raise StockImportError('Lot Type Code column not found')
+    return column_mapping
+
+
+def _unique_headers(values):
+    """Sheet headers as pandas would name them: blanks become 'Unnamed: n', repeats get '.1', '.2'."""
+    headers, counts = [], {}
+    for position, value in enumerate(values):
+        name = f'Unnamed: {position}' if value is None or str(value).strip() == '' else str(value).strip()
+        if name in counts:
+            counts[name] += 1
+            name = f'{name}.{counts[name]}'
+        else:
+            counts[name] = 0
+        headers.append(name)
+    return headers
+
+
+def _xlsx_batches(stream, batch_size):
+    # openpyxl is imported on first use to keep it out of worker startup
+    from openpyxl import load_workbook
+
+    try:
+        workbook = load_workbook(stream, read_only=True, data_only=True)
+    except Exception as e:
+        raise StockImportError(f'Could not read the Excel file: {e}')
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            raise StockImportError('The sheet is empty')
+        columns = _unique_headers(header)
+        width = len(columns)
+        batch, positions = [], []
+        # The index is the data row position, as in the CSV reader (sheet row = index + 2)
+        for position, row in enumerate(rows):
+            if not any(value is not None for value in row):
+                continue
+            batch.append((tuple(row) + (None,) * width)[:width])
+            positions.append(position)
+            if len(batch) >= batch_size:
+                yield pd.DataFrame(batch, columns=columns, index=positions)
+                batch, positions = [], []
+        yield pd.DataFrame(batch, columns=columns, index=positions)
+    finally:
+        workbook.close()
+
+
+def _csv_batches(stream, batch_size):
+    # Codes stay text ('00123' must not become 123); quantities and MRP are coerced later
+    try:
+        reader = pd.read_csv(stream, dtype=str, encoding='utf-8-sig', encoding_errors='replace',
+                             skipinitialspace=True, chunksize=batch_size)
+    except pd.errors.EmptyDataError:
+        raise StockImportError('The sheet is empty')
+    with reader:
+        yielded = False
+        for chunk in reader:
+            yielded = True
+            yield chunk
+        if not yielded:
+            raise StockImportError('The sheet is empty')
+
+
+def read_stock_batches(stream, filename, batch_size=READ_BATCH_SIZE):
+    """Yield the raw rows of an uploaded stock file as DataFrames of at most ``batch_size`` rows.
+
+    XLSX files are read with openpyxl in read-only mode and CSV files with a
+    chunked reader, straight from the upload stream, so memory stays bounded
+    by the batch size rather than the sheet size. Legacy .xls files cannot be
+    streamed and are read whole.
+    """
+    extension = os.path.splitext(filename.lower())[1]
+    if extension == '.csv':
+        return _csv_batches(stream, batch_size)
+    if extension in ('.xlsx', '.xlsm'):
+        return _xlsx_batches(stream, batch_size)
+    if extension == '.xls':
+        return iter([pd.read_excel(stream)])
+    raise StockImportError('Invalid file format. Please upload an Excel (.xlsx or .xls) or CSV file')
+
+
+def _text_column(series):
+    text = series.astype(str).str.strip()
+    return text.where(series.notna() & (text != '') & (text != 'nan'))
+
+
+def _is_number(series):
+    return pd.to_numeric(series, errors='coerce').notna()
+
+
+def stock_row_errors(df, limit=ERROR_LIMIT):
+    """Return (count, sample) of row problems in a raw batch.
+
+    Rows without a code are skipped, and quantities or MRPs that are not
+    numbers are imported as 0 or left blank. Each problem is reported with its
+    sheet row number (header = row 1).
+    """
+    column_mapping = map_stock_columns(df.columns)
+    missing_code = _text_column(df[column_mapping['lot_type_code']]).isna()
+    checks = [(missing_code, lambda index: 'Missing Lot Type Code, row skipped')]
+    for field, label, outcome in (('quantity_available', 'Quantity Available', 'imported as 0'),
+                                  ('mrp', 'MRP', 'left blank')):
+        if field in column_mapping:
+            raw = df[column_mapping[field]]
+            invalid = _text_column(raw).notna() & ~_is_number(raw) & ~missing_code
+            checks.append((invalid, lambda index, raw=raw, label=label, outcome=outcome:
+                           f"{label} '{raw[index]}' is not a number, {outcome}"))
+    count, sample = 0, []
+    for mask, message in checks:
+        count += int(mask.sum())
+        sample.extend((index, message(index)) for index in mask[mask].index[:limit])
+    sample.sort(key=lambda item: item[0])
+    return count, [{'row': int(index) + 2, 'error': error} for index, error in sample[:limit]]
+
+
+def normalize_stock_frame(df):
+    """Return (frame, present_fields) with one cleaned row per lot_type_code.
+
+    Text columns are stripped with missing values as None, quantities are
+    coerced to int (unparseable -> 0) and MRP to float (unparseable -> None).
+    When a code appears more than once the last row wins.
+    """
+    column_mapping = map_stock_columns(df.columns)
+    frame = pd.DataFrame(index=df.index)
+    frame['lot_type_code'] = _text_column(df[column_mapping['lot_type_code']])
+    for field in ('parent_code', 'item_lot_type'):
+        if field in column_mapping:
+            frame[field] = _text_column(df[column_mapping[field]])
+    if 'quantity_available' in column_mapping:
+        quantities = pd.to_numeric(df[column_mapping['quantity_available']], errors='coerce')
+        frame['quantity_available'] = quantities.fillna(0).astype('int64')
+    else:
+        frame['quantity_available'] = 0
+    if 'mrp' in column_mapping:
+        frame['mrp'] = pd.to_numeric(df[column_mapping['mrp']], errors='coerce')
+
+    frame = frame[frame['lot_type_code'].notna()]
+    frame = frame.drop_duplicates(subset='lot_type_code', keep='last')
+    present = set(column_mapping) | {'quantity_available'}
+    return frame, present
+
+
+def _records(frame):
+    """DataFrame rows as dicts with NaN converted to None and numpy scalars to Python types."""
+    clean = frame.astype(object).where(frame.notna(), None)
+    return clean.to_dict('records')
+
+
+def _row_fingerprints(frame):
+    """One 64-bit hash per row over the stock fields, with blanks hashed alike."""
+    canonical = pd.DataFrame({
+        'parent_code': frame['parent_code'].astype(object).where(frame['parent_code'].notna(), ''),
+        'item_lot_type': frame['item_lot_type'].astype(object).where(frame['item_lot_type'].notna(), ''),
+        'quantity_available': frame['quantity_available'].astype('int64'),
+        'mrp': frame['mrp'].astype('float64').fillna(-1.0),
+    }, index=frame.index)
+    return pd.util.hash_pandas_object(canonical, index=False)
+
+
+class StockDiff:
+    """The writes one batch of the sheet needs: new products and changed products."""
+
+    def __init__(self, inserts, updates, unchanged, changes):
+        self.inserts = inserts
+        self.updates = updates
+        self.unchanged = unchanged
+        self.changes = changes  # {lot_type_code: {field: [old, new]}} for updated products
+
+
+class StockImportSummary:
+    """Counts and a capped preview accumulated over all batches of an upload."""
+
+    def __init__(self, limit=PREVIEW_LIMIT):
+        self.limit = limit
+        self.rows = self.created = self.updated = self.deleted = self.unchanged = self.skipped = 0
+        self.error_count = 0
+        self.errors = []  # the first ERROR_LIMIT row problems, see stock_row_errors
+        self._preview = {'created': [], 'updated': [], 'deleted': []}
+
+    @property
+    def has_changes(self):
+        return bool(self.created or self.updated or self.deleted)
+
+    def add(self, diff, repeated=frozenset()):
+        """Count a batch; codes in ``repeated`` were already counted by an earlier batch."""
+        repeated_updates = repeated.intersection(diff.changes)
+        self.created += len(diff.inserts)
+        self.updated += len(diff.updates) - len(repeated_updates)
+        self.unchanged += diff.unchanged - (len(repeated) - len(repeated_updates))
+        self._sample('created', [row['lot_type_code'] for row in diff.inserts])
+        self._sample('updated', [{'lot_type_code': code, 'changes': fields}
+                                 for code, fields in diff.changes.items() if code not in repeated])
+
+    def add_errors(self, count, sample):
+        self.error_count += count
+        self.errors.extend(sample[:ERROR_LIMIT - len(self.errors)])
+
+    def add_deleted(self, codes):
+        self.deleted += len(codes)
+        self._sample('deleted', codes)
+
+    def _sample(self, kind, values):
+        room = self.limit - len(self._preview[kind])
+        if room > 0:
+            self._preview[kind].extend(values[:room])
+
+    def counts(self):
+        return {
+            'created': self.created,
+            'updated': self.updated,
+            'deleted': self.deleted,
+            'unchanged': self.unchanged,
+            'skipped': self.skipped,
+            'error_count': self.error_count
+        }
+
+    def preview(self):
+        """A JSON-ready sample of what was (or would be) written."""
+        return self._preview
+
+
+def _load_stored(db, product_model, codes):
+    """Stored stock fields for ``codes`` as a DataFrame, queried in chunks."""
+    Product = product_model
+    rows = []
+    for start in range(0, len(codes), LOOKUP_CHUNK_SIZE):
+        rows.extend(db.session.execute(select(
+            Product.id, Product.lot_type_code, Product.parent_code, Product.item_lot_type,
+            Product.quantity_available, Product.mrp
+        ).where(Product.lot_type_code.in_(codes[start:start + LOOKUP_CHUNK_SIZE]))).all())
+    stored = pd.DataFrame(rows, columns=['id', 'lot_type_code', *STOCK_FIELDS])
+    stored['quantity_available'] = pd.to_numeric(stored['quantity_available']).fillna(0).astype('int64')
+    stored['mrp'] = pd.to_numeric(stored['mrp'], errors='coerce').astype('float64')
+    return stored
+
+
+def diff_stock_frame(db, product_model, frame, present, timer=None):
+    """Compare a normalized batch with the stored products without writing anything.
+
+    The stored rows for the batch's codes are read with one query per chunk.
+    For existing codes the row the upload would produce (blank cells keep the
+    stored value, as in the legacy importer) is hashed and compared with the
+    hash of the stored row, so only rows whose values actually change become
+    updates. Fingerprints are taken from the current values rather than
+    stored, because place_order changes quantities between uploads.
+    """
+    timer = timer or PhaseTimer()
+    with timer.phase('load_existing'):
+        stored = _load_stored(db, product_model, frame['lot_type_code'].tolist())
+
+    with timer.phase('diff'):
+        incoming = frame.copy()
+        for field in STOCK_FIELDS:
+            if field not in incoming:
+                incoming[field] = None
+        merged = incoming.merge(stored, on='lot_type_code', how='left', suffixes=('', '_stored'))
+        is_new = merged['id'].isna()
+
+        existing = merged[~is_new]
+        before = pd.DataFrame({field: existing[f'{field}_stored'] for field in STOCK_FIELDS}, index=existing.index)
+        # The left join made the stored quantity float; existing rows always have one
+        before['quantity_available'] = before['quantity_available'].astype('int64')
+        after = pd.DataFrame({'quantity_available': existing['quantity_available']}, index=existing.index)
+        for field in ('parent_code', 'item_lot_type', 'mrp'):
+            keep_stored = existing[field].isna() if field in present else pd.Series(True, index=existing.index)
+            after[field] = existing[field].where(~keep_stored, existing[f'{field}_stored'])
+        changed = _row_fingerprints(after) != _row_fingerprints(before)
+
+        now = datetime.utcnow()
+        inserts = [{
+            'lot_type_code': record['lot_type_code'],
+            'parent_code': record.get('parent_code'),
+            'item_lot_type': record.get('item_lot_type'),
+            'quantity_available': record['quantity_available'],
+            'mrp': record.get('mrp'),
+            'created_at': now,
+            'updated_at': now
+        } for record in _records(merged.loc[is_new, ['lot_type_code', *STOCK_FIELDS]])]
+
+        updates, changes = [], {}
+        changed_index = changed[changed].index
+        for record, old, new in zip(_records(existing.loc[changed_index]),
+                                    _records(before.loc[changed_index]),
+                                    _records(after.loc[changed_index])):
+            mapping = {'id': int(record['id']), 'quantity_available': record['quantity_available'], 'updated_at': now}
+            for field in ('parent_code', 'item_lot_type', 'mrp'):
+                if field in present and record.get(field) is not None:
+                    mapping[field] = record[field]
+            updates.append(mapping)
+            changes[record['lot_type_code']] = {
+                field: [old[field], new[field]] for field in STOCK_FIELDS if old[field] != new[field]
+            }
+
+    return StockDiff(inserts, updates, int((~changed).sum()), changes)
+
+
+def apply_stock_diff(db, product_model, diff, timer=None, extra_values=None):
+    """Write a StockDiff in chunks. The caller commits.
+
+    ``extra_values`` are set on every inserted or updated row (e.g. the catalog version).
+    """
+    timer = timer or PhaseTimer()
+    extra_values = extra_values or {}
+    with timer.phase('write'):
+        inserts = [dict(row, **extra_values) for row in diff.inserts]
+        # In id order, like place_order's row locks, so an import batch and an order cannot deadlock
+        updates = sorted((dict(row, **extra_values) for row in diff.updates), key=lambda row: row['id'])
+        for start in range(0, len(inserts), WRITE_CHUNK_SIZE):
+            db.session.bulk_insert_mappings(product_model, inserts[start:start + WRITE_CHUNK_SIZE])
+        for start in range(0, len(updates), WRITE_CHUNK_SIZE):
+            db.session.bulk_update_mappings(product_model, updates[start:start + WRITE_CHUNK_SIZE])
+
+
+def products_not_in(db, product_model, codes):
+    """(id, lot_type_code) of every product whose code is not in ``codes``, in id order. Reads only."""
+    return sorted((product_id, code) for product_id, code in
+                  db.session.query(product_model.id, product_model.lot_type_code) if code not in codes)
+
+
+def delete_products_not_in(db, product_model, codes, timer=None):
+    """Delete every product whose lot_type_code is not in ``codes``. Returns the deleted codes."""
+    timer = timer or PhaseTimer()
+    with timer.phase('delete'):
+        missing = products_not_in(db, product_model, codes)
+        ids = [product_id for product_id, _ in missing]
+        for start in range(0, len(ids), WRITE_CHUNK_SIZE):
+            db.session.execute(
+                delete(product_model)
+                .where(product_model.id.in_(ids[start:start + WRITE_CHUNK_SIZE]))
+                .execution_options(synchronize_session=False)
+            )
+    return [code for _, code in missing]
+
+
+def import_stock_batches(db, product_model, batches, timer=None, delete_missing=False, extra_values=None,
+                         on_batch=None, dry_run=False):
+    """Diff and write a stock sheet one batch at a time. Returns a StockImportSummary.
+
+    ``batches`` yields raw DataFrames (see ``read_stock_batches``); only one
+    batch and the set of codes seen so far are held in memory. A code that
+    appears again in a later batch is written again, so the last row still
+    wins. With ``delete_missing`` products absent from the whole sheet are
+    deleted at the end.
+
+    ``on_batch(summary, changed, reset)`` is called after every batch and
+    after the deletions (``reset=True``); an import job commits there.
+    Without it the caller commits or rolls back the whole import.
+
+    With ``dry_run`` nothing is written or locked: each batch is only
+    diffed, and the products that would be deleted are only queried. A code
+    repeated in a later batch is then previewed by its first row only.
+    """
+    timer = timer or PhaseTimer()
+    summary = StockImportSummary()
+    seen = set()
+    batches = iter(batches)
+    try:
+        while True:
+            with timer.phase('read'):
+                df = next(batches, None)
+            if df is None:
+                break
+            with timer.phase('normalize'):
+                frame, present = normalize_stock_frame(df)
+                summary.add_errors(*stock_row_errors(df))
+            summary.rows += len(df)
+            summary.skipped += len(df) - len(frame)
+            if dry_run:
+                # Earlier batches were not written, so a repeated code would be diffed as new again
+                frame = frame[~frame['lot_type_code'].isin(seen)]
+            changed = False
+            if not frame.empty:
+                diff = diff_stock_frame(db, product_model, frame, present, timer)
+                if not dry_run:
+                    apply_stock_diff(db, product_model, diff, timer, extra_values)
+                codes = set(frame['lot_type_code'])
+                summary.add(diff, repeated=seen & codes)
+                seen |= codes
+                changed = bool(diff.inserts or diff.updates)
+            if on_batch:
+                on_batch(summary, changed, False)
+    finally:
+        # Release the workbook or CSV reader now, before the upload stream is closed
+        close = getattr(batches, 'close', None)
+        if close:
+            close()
+
+    if delete_missing:
+        if not seen:
+            raise StockImportError('The sheet has no stock rows; refusing to delete every product')
+        if dry_run:
+            deleted = [code for _, code in products_not_in(db, product_model, seen)]
+        else:
+            deleted = delete_products_not_in(db, product_model, seen, timer)
+        summary.add_deleted(deleted)
+        if on_batch:
+            on_batch(summary, bool(deleted), True)
+    return summary
+
+
+def stamp_pending_catalog_version(db, product_model, version):
+    """Replace PENDING_CATALOG_VERSION on the rows written by this import with ``version``."""
+    db.session.execute(
+        update(product_model)
+        .where(product_model.catalog_version == PENDING_CATALOG_VERSION)
+        .values(catalog_version=version)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def count_stock_rows(path, filename):
+    """Best-effort number of data rows in a staged stock file, for progress reporting (None if unknown)."""
+    extension = os.path.splitext(filename.lower())[1]
+    if extension == '.csv':
+        with open(path, 'rb') as handle:
+            lines = sum(chunk.count(b'\n') for chunk in iter(lambda: handle.read(1 << 20), b''))
+        return max(lines - 1, 0)
+    if extension in ('.xlsx', '.xlsm'):
+        from openpyxl import load_workbook
+
+        try:
+            workbook = load_workbook(path, read_only=True)
+        except Exception:
+            return None
+        try:
+            # The sheet's stored dimension; blank trailing rows may be included
+            max_row = workbook.active.max_row
+            return max(max_row - 1, 0) if max_row else None
+        finally:
+            workbook.close()
+    return None
@@ -0,0 +1,77 @@
+"""Run the app against a throwaway SQLite database, without background workers or outbound calls."""
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix='oms-tests-')
+
+# Set before app.py is imported: it reads its configuration at import time
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(WORKDIR, "test.db")}'
+os.environ['OUTBOX_WORKER_ENABLED'] = 'false'
+os.environ['SHEETS_BACKEND'] = 'fake'
+os.environ['WHATSAPP_BACKEND'] = 'fake'
+os.chdir(WORKDIR)  # app.log and uploads/ stay out of the checkout
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope='session')
+def oms():
+    import app as oms
+    oms.migrate_db()
+    oms.seed_admin()
+    oms.create_app()
+    return oms
+
+
+@pytest.fixture
+def admin_client(oms):
+    client = oms.app.test_client()
+    client.post('/login', data={'username': 'rtc', 'password': 'rtc1336'})
+    return client
+
+
+@pytest.fixture
+def add_orders(oms):
+    """``add_orders(created_ats, status)`` creates orders of a new BA, one per created_at; returns (username, ids)."""
+    def add(created_ats, status='pending'):
+        username = f'ba-{uuid.uuid4().hex[:8]}'
+        with oms.app.app_context():
+            user = oms.User(username=username, password_hash='x', role='ba')
+            oms.db.session.add(user)
+            oms.db.session.flush()
+            orders = [oms.Order(user_id=user.id, order_data='[]', total_amount=1.0, status=status,
+                                created_at=created_at) for created_at in created_ats]
+            oms.db.session.add_all(orders)
+            oms.db.session.commit()
+            return username, [order.id for order in orders]
+    return add
+
+
+@pytest.fixture
+def add_products(oms):
+    """``add_products(stocks)`` creates one product per starting stock and returns their ids."""
+    def add(stocks):
+        prefix = uuid.uuid4().hex[:8]
+        with oms.app.app_context():
+            products = [oms.Product(lot_type_code=f'{prefix}-{i}', quantity_available=stock, mrp=10.0)
+                        for i, stock in enumerate(stocks)]
+            oms.db.session.add_all(products)
+            oms.db.session.commit()
+            return [product.id for product in products]
+    return add
+
+
+@pytest.fixture
+def ba_client(oms, admin_client):
+    """``ba_client()`` returns a test client logged in as a new BA."""
+    def login():
+        username = f'ba-{uuid.uuid4().hex[:8]}'
+        admin_client.post('/admin/create_ba', json={'username': username, 'password': 'secret'})
+        client = oms.app.test_client()
+        client.post('/login', data={'username': username, 'password': 'secret'})
+        return client
+    return login
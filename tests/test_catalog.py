@@ -0,0 +1,73 @@
+"""Catalog versioning behind /api/products: ETag revalidation and ?since deltas."""
+from catalog import CatalogCache
+
+
+def order(client, product_id, quantity):
+    response = client.post('/api/place_order', json={'items': [{'product_id': product_id, 'quantity': quantity}]})
+    assert response.status_code == 200
+    return response
+
+
+def test_unchanged_catalog_revalidates_with_304(ba_client):
+    client = ba_client()
+    first = client.get('/api/products')
+
+    second = client.get('/api/products', headers={'If-None-Match': first.headers['ETag']})
+
+    assert first.status_code == 200
+    assert second.status_code == 304
+    assert second.get_data() == b''
+    assert second.headers['ETag'] == first.headers['ETag']
+
+
+def test_order_moves_the_version_and_the_delta_holds_only_changed_products(add_products, ba_client):
+    ordered, untouched = add_products([5, 5])
+    client = ba_client()
+    before = client.get('/api/products')
+    version = int(before.headers['X-Catalog-Version'])
+
+    order(client, ordered, 2)
+    after = client.get('/api/products', headers={'If-None-Match': before.headers['ETag']})
+    delta = client.get('/api/products', query_string={'since': version})
+
+    assert after.status_code == 200
+    new_version = int(after.headers['X-Catalog-Version'])
+    assert new_version > version
+    assert {p['id']: p['quantity_available'] for p in after.get_json()}[ordered] == 3
+    body = delta.get_json()
+    assert body['version'] == new_version
+    assert body['full'] is False
+    assert [(p['id'], p['quantity_available']) for p in body['products']] == [(ordered, 3)]
+    assert untouched not in [p['id'] for p in body['products']]
+    # The delta has its own ETag, so it revalidates as well
+    again = client.get('/api/products', query_string={'since': version},
+                       headers={'If-None-Match': delta.headers['ETag']})
+    assert again.status_code == 304
+
+
+def test_unknown_since_version_returns_the_full_list(ba_client):
+    client = ba_client()
+    full = client.get('/api/products')
+    version = int(full.headers['X-Catalog-Version'])
+
+    body = client.get('/api/products', query_string={'since': version + 100}).get_json()
+
+    assert body['full'] is True
+    assert [p['id'] for p in body['products']] == [p['id'] for p in full.get_json()]
+
+
+def test_other_workers_caches_reload_when_the_version_moves(oms, add_products, ba_client):
+    product_id, = add_products([4])
+    client = ba_client()
+    with oms.app.app_context():
+        # A second process's cache, loaded before the order
+        other = CatalogCache(oms.db, oms.Product, oms.CatalogVersion)
+        cached = other.get()
+
+    order(client, product_id, 1)
+
+    with oms.app.app_context():
+        reloaded = other.get()
+    assert reloaded.version > cached.version
+    assert reloaded.by_id[product_id].quantity_available == 3
+    assert other.stats['reloads'] == 2
@@ -0,0 +1,105 @@
+"""The admin event stream: reset events, reconnect backlogs and stream slots."""
+import json
+
+import pytest
+
+import events
+from events import EventBroker, record_event
+
+
+@pytest.fixture
+def broker(oms):
+    # Its own broker, without the poller thread; tests call _poll() themselves
+    return EventBroker(oms.app, oms.db, oms.AdminEvent, max_streams=2)
+
+
+def add_events(oms, count):
+    with oms.app.app_context():
+        ids = [record_event(oms.db, oms.AdminEvent, 'test.event', {'n': n}).id for n in range(count)]
+        oms.db.session.commit()
+        return ids
+
+
+def open_stream(oms, broker, last_event_id=None):
+    with oms.app.app_context():
+        return broker.open_stream(last_event_id)
+
+
+def messages(stream, count):
+    """The next ``count`` chunks of ``stream``, each parsed into (id, event, data)."""
+    parsed = []
+    for _ in range(count):
+        for message in next(stream).strip().split('\n\n'):
+            fields = dict(line.split(': ', 1) for line in message.split('\n'))
+            parsed.append((int(fields['id']), fields['event'], json.loads(fields['data'])))
+    return parsed
+
+
+def test_a_new_stream_starts_with_a_connected_reset(oms, broker):
+    head = add_events(oms, 1)[-1]
+    stream = open_stream(oms, broker)
+
+    assert next(stream) == f'retry: {events.RECONNECT_MS}\n\n'
+    assert messages(stream, 1) == [(head, 'reset', {'reason': 'connected'})]
+    stream.close()
+
+
+def test_a_reconnect_receives_only_the_events_it_missed(oms, broker):
+    ids = add_events(oms, 3)
+    stream = open_stream(oms, broker, ids[0])
+
+    next(stream)
+    assert messages(stream, 2) == [(ids[1], 'test.event', {'n': 1}), (ids[2], 'test.event', {'n': 2})]
+    stream.close()
+
+
+def test_an_id_newer_than_the_table_is_expired(oms, broker):
+    head = add_events(oms, 1)[-1]
+    stream = open_stream(oms, broker, head + 100)
+
+    next(stream)
+    assert messages(stream, 1) == [(head, 'reset', {'reason': 'expired'})]
+    stream.close()
+
+
+def test_a_backlog_longer_than_max_backlog_is_expired(oms, broker, monkeypatch):
+    monkeypatch.setattr(events, 'MAX_BACKLOG', 2)
+    ids = add_events(oms, 4)
+    stream = open_stream(oms, broker, ids[0])
+
+    next(stream)
+    assert messages(stream, 1) == [(ids[-1], 'reset', {'reason': 'expired'})]
+    stream.close()
+
+
+def test_live_events_reach_open_streams(oms, broker):
+    add_events(oms, 1)
+    stream = open_stream(oms, broker)
+    next(stream)
+    messages(stream, 1)  # the connected reset
+
+    ids = add_events(oms, 2)
+    with oms.app.app_context():
+        broker._poll()
+
+    assert messages(stream, 1) == [(ids[0], 'test.event', {'n': 0}), (ids[1], 'test.event', {'n': 1})]
+    assert broker.stats['events_read'] == 2
+    stream.close()
+
+
+def test_streams_beyond_max_streams_are_rejected_until_one_closes(oms, broker):
+    add_events(oms, 1)
+    first = open_stream(oms, broker)
+    second = open_stream(oms, broker)
+
+    assert open_stream(oms, broker) is None
+    assert broker.stats['streams_rejected'] == 1
+
+    # Closing an unread stream frees its slot too
+    first.close()
+    third = open_stream(oms, broker)
+    assert third is not None
+    assert broker.collect_stats()['open_streams'] == 2
+    second.close()
+    third.close()
+    assert broker.collect_stats()['open_streams'] == 0
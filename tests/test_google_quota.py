@@ -0,0 +1,170 @@
+"""Google API error classification, the rate limiter's retries and lanes, and create-without-repeat."""
+import pytest
+
+from google_quota import (BACKLOG, INTERACTIVE, GoogleRateLimiter, RateLimitedClient, RateLimitTimeout,
+                          classify_error, error_reason)
+from providers import ProviderAPIError, SpreadsheetNotFound
+
+
+class FakeResponse:
+    def __init__(self, status, reason='', message=''):
+        self.status_code = status
+        self.headers = {}
+        self._body = {'error': {'code': status, 'message': message, 'errors': [{'reason': reason}]}}
+
+    def json(self):
+        return self._body
+
+
+class APIError(Exception):
+    """Shaped like gspread's APIError: the status and body are on ``response``."""
+
+    def __init__(self, status, reason='', message=''):
+        super().__init__(message)
+        self.response = FakeResponse(status, reason, message)
+
+
+class TransportError(Exception):
+    """Named like google-auth's TransportError, which the classifier matches by name."""
+
+
+def fast_limiter(**kwargs):
+    options = dict(per_minute=60000, burst=10, base_backoff=0.001, max_backoff=0.002, max_wait=1.0)
+    options.update(kwargs)
+    return GoogleRateLimiter(**options)
+
+
+def failing(errors, result='ok'):
+    """A function that raises each of ``errors`` in turn, then returns ``result``."""
+    calls = []
+
+    def func(*args, **kwargs):
+        calls.append(args)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+
+    func.calls = calls
+    return func
+
+
+@pytest.mark.parametrize('error, kind, reason', [
+    (APIError(429), 'throttled', 'throttled'),
+    (APIError(403, 'rateLimitExceeded'), 'throttled', 'throttled'),
+    (APIError(403, 'userRateLimitExceeded'), 'throttled', 'throttled'),
+    (APIError(503), 'transient', 'transient'),
+    (TransportError('connection reset'), 'transient', 'transient'),
+    (APIError(403, 'storageQuotaExceeded'), None, 'storage_quota'),
+    (APIError(403, 'insufficientPermissions'), None, 'permission'),
+    (APIError(404, 'notFound'), None, 'not_found'),
+    (APIError(400, 'badRequest', 'Invalid requests[0].addSheet: A sheet with the name "X" already exists.'),
+     None, 'duplicate_sheet'),
+    (APIError(400, 'badRequest', 'Invalid value'), None, None),
+    (ProviderAPIError(429, 'Quota exceeded'), 'throttled', 'throttled'),
+    (ValueError('bug'), None, None),
+])
+def test_errors_are_classified_by_status_and_reason(error, kind, reason):
+    assert classify_error(error) == kind
+    assert error_reason(error) == reason
+
+
+def test_throttled_and_transient_calls_are_retried():
+    limiter = fast_limiter()
+    func = failing([APIError(429), APIError(503)])
+
+    assert limiter.call(func, 'a') == 'ok'
+    assert len(func.calls) == 3
+    assert limiter.stats['throttled'] == 1
+    assert limiter.stats['transient_errors'] == 1
+    assert limiter.stats['retries'] == 2
+    assert limiter.stats['failed'] == 0
+
+
+def test_errors_that_retrying_cannot_fix_are_raised_at_once():
+    limiter = fast_limiter()
+    func = failing([APIError(403, 'insufficientPermissions')])
+
+    with pytest.raises(APIError):
+        limiter.call(func)
+    assert len(func.calls) == 1
+    assert limiter.stats['failed'] == 1
+
+
+def test_transient_errors_are_not_retried_when_disabled():
+    limiter = fast_limiter()
+    func = failing([APIError(503)])
+
+    with pytest.raises(APIError):
+        limiter.call(func, retry_transient=False)
+    assert len(func.calls) == 1
+
+
+def test_retries_stop_after_max_retries():
+    limiter = fast_limiter(max_retries=2)
+    func = failing([APIError(429)] * 5)
+
+    with pytest.raises(APIError):
+        limiter.call(func)
+    assert len(func.calls) == 3
+    assert limiter.stats['failed'] == 1
+
+
+def test_backlog_lane_leaves_the_reserve_for_interactive_calls():
+    # Practically no refill, so only the initial burst is available
+    limiter = GoogleRateLimiter(per_minute=0.001, burst=4, reserve=2, max_wait=0.05)
+
+    with limiter.lane(BACKLOG):
+        assert limiter.call(lambda: 'b1') == 'b1'
+        assert limiter.call(lambda: 'b2') == 'b2'
+        with pytest.raises(RateLimitTimeout):
+            limiter.call(lambda: 'b3')
+    with limiter.lane(INTERACTIVE):
+        assert limiter.call(lambda: 'i1') == 'i1'
+        assert limiter.call(lambda: 'i2') == 'i2'
+    assert limiter.stats['backlog_calls'] == 2
+    assert limiter.stats['interactive_calls'] == 2
+    assert limiter.stats['wait_timeouts'] == 1
+
+
+def test_unknown_lane_is_rejected():
+    with pytest.raises(ValueError):
+        with fast_limiter().lane('bulk'):
+            pass
+
+
+class FakeClient:
+    def __init__(self, create_errors=(), existing=None):
+        self.create = failing(list(create_errors), result='created')
+        self.existing = existing or {}
+
+    def open(self, title):
+        if title not in self.existing:
+            raise SpreadsheetNotFound(title)
+        return self.existing[title]
+
+
+def test_create_is_not_repeated_after_a_transient_error():
+    client = FakeClient(create_errors=[APIError(503)], existing={'Order #1': 'found'})
+
+    spreadsheet = RateLimitedClient(client, fast_limiter()).create('Order #1')
+
+    # The lost response hid a create that went through; the spreadsheet is found instead of created twice
+    assert spreadsheet._spreadsheet == 'found'
+    assert len(client.create.calls) == 1
+
+
+def test_create_raises_the_original_error_when_nothing_was_created():
+    client = FakeClient(create_errors=[APIError(503)])
+
+    with pytest.raises(APIError):
+        RateLimitedClient(client, fast_limiter()).create('Order #2')
+    assert len(client.create.calls) == 1
+
+
+def test_throttled_creates_are_retried():
+    client = FakeClient(create_errors=[APIError(429)])
+
+    spreadsheet = RateLimitedClient(client, fast_limiter()).create('Order #3')
+
+    assert spreadsheet._spreadsheet == 'created'
+    assert len(client.create.calls) == 2
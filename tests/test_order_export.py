@@ -0,0 +1,83 @@
+"""/admin/export_orders: streamed rows and the single status UPDATE for exported orders."""
+import csv
+import io
+from datetime import datetime, timedelta
+
+from order_export import EXPORT_HEADERS
+
+
+def orders_with_items(oms, add_orders, count, status='pending'):
+    base = datetime(2026, 7, 1, 9, 0, 0)
+    username, ids = add_orders([base + timedelta(minutes=i) for i in range(count)], status=status)
+    with oms.app.app_context():
+        oms.db.session.add_all([oms.OrderItem(order_id=order_id, lot_type_code=f'LOT-{order_id}', quantity=2,
+                                              mrp=10.0, total=20.0) for order_id in ids])
+        oms.db.session.commit()
+    return username, ids
+
+
+def statuses(oms, ids):
+    with oms.app.app_context():
+        return [oms.db.session.get(oms.Order, order_id).status for order_id in ids]
+
+
+def set_status(oms, order_id, status):
+    with oms.app.app_context():
+        oms.db.session.get(oms.Order, order_id).status = status
+        oms.db.session.commit()
+
+
+def test_csv_export_lists_items_and_marks_pending_orders_downloaded(oms, admin_client, add_orders):
+    username, ids = orders_with_items(oms, add_orders, 3)
+    set_status(oms, ids[2], 'confirmed')
+
+    response = admin_client.get('/admin/export_orders', query_string={'format': 'csv', 'ba': username})
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+
+    assert response.status_code == 200
+    assert rows[0] == EXPORT_HEADERS
+    assert [(row[0], row[4], row[5], row[6]) for row in rows[1:]] == [
+        (f'LOT-{order_id}', username, '2', str(order_id)) for order_id in ids
+    ]
+    # Only pending orders move to downloaded; the UPDATE runs once the body has been streamed
+    assert statuses(oms, ids) == ['downloaded', 'downloaded', 'confirmed']
+
+
+def test_export_can_leave_statuses_alone(oms, admin_client, add_orders):
+    username, ids = orders_with_items(oms, add_orders, 2)
+
+    for export_format in ('csv', 'xlsx'):
+        response = admin_client.get('/admin/export_orders', query_string={
+            'format': export_format, 'ba': username, 'mark_downloaded': 0
+        })
+        response.get_data()
+        assert response.status_code == 200
+
+    assert statuses(oms, ids) == ['pending', 'pending']
+
+
+def test_xlsx_export_marks_orders_downloaded(oms, admin_client, add_orders):
+    username, ids = orders_with_items(oms, add_orders, 2)
+
+    response = admin_client.get('/admin/export_orders', query_string={'ba': username})
+
+    assert response.status_code == 200
+    assert response.get_data()[:2] == b'PK'  # a zip container, i.e. an XLSX workbook
+    assert statuses(oms, ids) == ['downloaded', 'downloaded']
+
+
+def test_orders_placed_after_the_export_started_stay_pending(oms, add_orders):
+    username, ids = orders_with_items(oms, add_orders, 3)
+
+    with oms.app.app_context():
+        # The export read max(id) before these orders existed
+        updated = oms.mark_orders_downloaded(oms.order_filter_criteria({'ba': username}), max_id=ids[0])
+
+    assert updated == 1
+    assert statuses(oms, ids) == ['downloaded', 'pending', 'pending']
+
+
+def test_invalid_export_format_is_a_400(admin_client):
+    response = admin_client.get('/admin/export_orders', query_string={'format': 'pdf'})
+
+    assert response.status_code == 400
@@ -0,0 +1,148 @@
+"""The outbox worker: atomic claims, retries with backoff, stale leases and Future-returning handlers."""
+import json
+import uuid
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+
+import pytest
+
+from outbox import OutboxWorker
+
+
+@pytest.fixture
+def worker(oms):
+    # Jobs are picked up only for kinds registered on this worker, so the app's own jobs are left alone
+    return OutboxWorker(oms.app, oms.db, oms.OutboxJob, max_attempts=2, base_backoff=0.0)
+
+
+def kind():
+    return f'test-{uuid.uuid4().hex[:8]}'
+
+
+def enqueue(oms, worker, job_kind, payload=None, **values):
+    with oms.app.app_context():
+        job = worker.enqueue(job_kind, payload or {})
+        for name, value in values.items():
+            setattr(job, name, value)
+        oms.db.session.commit()
+        return job.id
+
+
+def job_state(oms, job_id):
+    with oms.app.app_context():
+        job = oms.db.session.get(oms.OutboxJob, job_id)
+        return {'status': job.status, 'attempts': job.attempts, 'last_error': job.last_error,
+                'locked_at': job.locked_at, 'run_after': job.run_after}
+
+
+def test_job_runs_once_with_its_payload(oms, worker):
+    seen = []
+    job_kind = kind()
+    worker.register(job_kind, seen.append)
+    job_id = enqueue(oms, worker, job_kind, {'order_id': 7})
+
+    assert worker.run_pending() == 1
+    assert worker.run_pending() == 0
+    assert seen == [{'order_id': 7}]
+    state = job_state(oms, job_id)
+    assert (state['status'], state['attempts'], state['locked_at']) == ('done', 1, None)
+
+
+def test_jobs_scheduled_for_later_wait(oms, worker):
+    job_kind = kind()
+    worker.register(job_kind, lambda payload: None)
+    job_id = enqueue(oms, worker, job_kind, run_after=datetime.utcnow() + timedelta(hours=1))
+
+    assert worker.run_pending() == 0
+    assert job_state(oms, job_id)['status'] == 'pending'
+
+
+def test_failed_job_is_retried_then_failed_after_max_attempts(oms, worker):
+    job_kind = kind()
+
+    def handler(payload):
+        raise RuntimeError('provider down')
+
+    worker.register(job_kind, handler)
+    job_id = enqueue(oms, worker, job_kind)
+
+    worker.run_pending()
+    state = job_state(oms, job_id)
+    assert (state['status'], state['attempts'], state['last_error']) == ('pending', 1, 'provider down')
+    assert state['locked_at'] is None
+
+    worker.run_pending()
+    state = job_state(oms, job_id)
+    assert (state['status'], state['attempts']) == ('failed', 2)
+
+
+def test_backoff_grows_and_is_capped():
+    worker = OutboxWorker(None, None, None, base_backoff=5.0, max_backoff=60.0)
+
+    assert 4.0 <= worker._backoff(1) <= 6.0
+    assert 16.0 <= worker._backoff(3) <= 24.0
+    assert worker._backoff(10) <= 72.0
+
+
+def test_a_job_is_claimed_only_once(oms, worker):
+    job_kind = kind()
+    worker.register(job_kind, lambda payload: None)
+    job_id = enqueue(oms, worker, job_kind)
+    other = OutboxWorker(oms.app, oms.db, oms.OutboxJob)
+
+    with oms.app.app_context():
+        assert worker._claim(job_id) is True
+        assert other._claim(job_id) is False
+    state = job_state(oms, job_id)
+    assert (state['status'], state['attempts']) == ('running', 1)
+
+
+def test_stale_lease_is_released_and_the_job_runs_again(oms, worker):
+    seen = []
+    job_kind = kind()
+    worker.register(job_kind, seen.append)
+    worker.lease_timeout = 60
+    stale = enqueue(oms, worker, job_kind, {'n': 1}, status='running', attempts=1,
+                    locked_at=datetime.utcnow() - timedelta(minutes=5))
+    live = enqueue(oms, worker, job_kind, {'n': 2}, status='running', attempts=1, locked_at=datetime.utcnow())
+
+    worker.run_pending()
+
+    assert seen == [{'n': 1}]
+    assert job_state(oms, stale)['status'] == 'done'
+    assert job_state(oms, live)['status'] == 'running'
+
+
+def test_future_job_stays_claimed_until_it_resolves(oms, worker):
+    job_kind = kind()
+    futures = []
+
+    def handler(payload):
+        futures.append(Future())
+        return futures[-1]
+
+    worker.register(job_kind, handler)
+    done_id = enqueue(oms, worker, job_kind)
+    failed_id = enqueue(oms, worker, job_kind)
+
+    assert worker.run_pending() == 2
+    assert job_state(oms, done_id)['status'] == 'running'
+    assert job_state(oms, done_id)['locked_at'] is not None
+
+    futures[0].set_result({'success': True})
+    futures[1].set_exception(RuntimeError('message rejected'))
+
+    assert job_state(oms, done_id)['status'] == 'done'
+    state = job_state(oms, failed_id)
+    assert (state['status'], state['last_error']) == ('pending', 'message rejected')
+
+
+def test_enqueue_is_part_of_the_callers_transaction(oms, worker):
+    job_kind = kind()
+    with oms.app.app_context():
+        worker.enqueue(job_kind, {'order_id': 1})
+        oms.db.session.rollback()
+        assert oms.OutboxJob.query.filter_by(kind=job_kind).count() == 0
+        job = worker.enqueue(job_kind, {'order_id': 2})
+        oms.db.session.commit()
+        assert json.loads(oms.db.session.get(oms.OutboxJob, job.id).payload) == {'order_id': 2}
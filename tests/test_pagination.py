@@ -0,0 +1,88 @@
+"""Keyset cursors for newest-first listings (/admin/orders)."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from pagination import PaginationError, decode_cursor, encode_cursor, parse_date_range, parse_page_size
+
+
+def walk_pages(admin_client, username, limit):
+    """Order ids of every page of /admin/orders for ``username``, and the pages' lengths."""
+    ids, sizes, cursor = [], [], None
+    while True:
+        params = {'ba': username, 'limit': limit, 'summary': 1}
+        if cursor:
+            params['cursor'] = cursor
+        body = admin_client.get('/admin/orders', query_string=params).get_json()
+        ids.extend(order['id'] for order in body['orders'])
+        sizes.append(len(body['orders']))
+        cursor = body['next_cursor']
+        if cursor is None:
+            return ids, sizes
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2026, 1, 2, 3, 4, 5, 678000)
+    assert decode_cursor(encode_cursor(created_at, 42)) == (created_at, 42)
+
+
+@pytest.mark.parametrize('token', ['not-a-cursor', '', encode_cursor(datetime(2026, 1, 1), 1)[:-3] + '!!!'])
+def test_invalid_cursors_are_rejected(token):
+    with pytest.raises(PaginationError):
+        decode_cursor(token)
+
+
+def test_page_size_defaults_and_limits():
+    assert parse_page_size(None) == 50
+    assert parse_page_size('', default=10) == 10
+    assert parse_page_size('500', maximum=200) == 200
+    for value in ('0', '-1', 'ten'):
+        with pytest.raises(PaginationError):
+            parse_page_size(value)
+
+
+def test_date_range_includes_the_whole_last_day():
+    assert parse_date_range('2026-03-01', '2026-03-31') == (datetime(2026, 3, 1), datetime(2026, 4, 1))
+    assert parse_date_range(None, None) == (None, None)
+    with pytest.raises(PaginationError):
+        parse_date_range('01/03/2026', None)
+
+
+def test_pages_cover_every_order_once_newest_first(admin_client, add_orders):
+    base = datetime(2026, 5, 1, 12, 0, 0)
+    # Two pairs share a created_at, so the id must break ties across page boundaries
+    username, ids = add_orders([base, base + timedelta(minutes=1), base + timedelta(minutes=1),
+                                base + timedelta(minutes=2), base + timedelta(minutes=2),
+                                base + timedelta(minutes=3), base - timedelta(days=1)])
+
+    listed, sizes = walk_pages(admin_client, username, limit=2)
+
+    expected = [ids[5], ids[4], ids[3], ids[2], ids[1], ids[0], ids[6]]
+    assert listed == expected
+    assert sizes == [2, 2, 2, 1]
+
+
+def test_new_orders_do_not_shift_later_pages(oms, admin_client, add_orders):
+    base = datetime(2026, 6, 1, 12, 0, 0)
+    username, ids = add_orders([base + timedelta(minutes=i) for i in range(4)])
+    first = admin_client.get('/admin/orders', query_string={'ba': username, 'limit': 2}).get_json()
+
+    with oms.app.app_context():
+        user = oms.User.query.filter_by(username=username).one()
+        oms.db.session.add(oms.Order(user_id=user.id, order_data='[]', total_amount=1.0,
+                                     created_at=base + timedelta(hours=1)))
+        oms.db.session.commit()
+    second = admin_client.get('/admin/orders', query_string={
+        'ba': username, 'limit': 2, 'cursor': first['next_cursor']
+    }).get_json()
+
+    assert [order['id'] for order in first['orders']] == [ids[3], ids[2]]
+    assert [order['id'] for order in second['orders']] == [ids[1], ids[0]]
+    assert second['next_cursor'] is None
+
+
+def test_bad_cursor_is_a_400(admin_client):
+    response = admin_client.get('/admin/orders', query_string={'cursor': 'garbage'})
+
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid cursor'}
@@ -0,0 +1,128 @@
+"""Stock reservation in /api/place_order under concurrent orders."""
+import random
+import threading
+from collections import Counter
+
+
+def place_order_lines(client, lines):
+    return client.post('/api/place_order', json={
+        'items': [{'product_id': product_id, 'quantity': quantity} for product_id, quantity in lines]
+    })
+
+
+def place_order(client, cart):
+    return place_order_lines(client, cart.items())
+
+
+def stock_of(oms, product_ids):
+    with oms.app.app_context():
+        return {product_id: oms.db.session.get(oms.Product, product_id).quantity_available
+                for product_id in product_ids}
+
+
+def ordered_quantities(oms, product_ids):
+    """Quantities per product in stored order_item rows."""
+    with oms.app.app_context():
+        rows = oms.db.session.query(oms.OrderItem.product_id, oms.db.func.sum(oms.OrderItem.quantity)) \
+            .filter(oms.OrderItem.product_id.in_(product_ids)).group_by(oms.OrderItem.product_id)
+        return Counter(dict(rows.all()))
+
+
+def test_concurrent_orders_never_oversell(oms, add_products, ba_client):
+    starting_stock = 60
+    product_ids = add_products([starting_stock] * 3)
+    clients = [ba_client() for _ in range(8)]
+    accepted = Counter()
+    shortage_reports = []
+    errors = []
+    lock = threading.Lock()
+    start_gate = threading.Barrier(len(clients))
+
+    def order_until_sold_out(index):
+        rng = random.Random(index)
+        start_gate.wait()
+        sold_out_streak = 0
+        while sold_out_streak < 5:
+            cart = {product_id: rng.randint(1, 6)
+                    for product_id in rng.sample(product_ids, rng.randint(1, len(product_ids)))}
+            response = place_order(clients[index], cart)
+            with lock:
+                if response.status_code == 200:
+                    accepted.update(cart)
+                    sold_out_streak = 0
+                elif response.status_code == 400:
+                    shortage_reports.append((cart, response.get_json()))
+                    sold_out_streak += 1
+                else:
+                    errors.append((response.status_code, response.get_data(as_text=True)))
+                    return
+
+    threads = [threading.Thread(target=order_until_sold_out, args=(i,)) for i in range(len(clients))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    remaining = stock_of(oms, product_ids)
+    stored = ordered_quantities(oms, product_ids)
+    for product_id in product_ids:
+        assert remaining[product_id] >= 0
+        assert stored[product_id] + remaining[product_id] == starting_stock
+        assert stored[product_id] == accepted[product_id]
+
+    assert shortage_reports
+    for cart, body in shortage_reports:
+        assert body['shortages']
+        for shortage in body['shortages']:
+            assert shortage['requested'] == cart[shortage['product_id']]
+            assert 0 <= shortage['available'] < shortage['requested']
+
+
+def test_shortage_report_lists_every_short_line(oms, add_products, ba_client):
+    product_ids = add_products([5, 2, 8])
+    first, second, third = product_ids
+    client = ba_client()
+    with oms.app.app_context():
+        codes = {product_id: oms.db.session.get(oms.Product, product_id).lot_type_code for product_id in product_ids}
+
+    response = place_order(client, {first: 7, second: 3, third: 8})
+
+    assert response.status_code == 400
+    assert response.get_json()['shortages'] == [
+        {'product_id': first, 'lot_type_code': codes[first], 'requested': 7, 'available': 5},
+        {'product_id': second, 'lot_type_code': codes[second], 'requested': 3, 'available': 2},
+    ]
+    # Nothing is reserved when any line is short
+    assert stock_of(oms, product_ids) == {first: 5, second: 2, third: 8}
+    assert ordered_quantities(oms, product_ids) == Counter()
+
+
+def test_repeated_lines_are_reserved_together(oms, add_products, ba_client):
+    product_id, = add_products([3])
+    client = ba_client()
+
+    response = place_order_lines(client, [(product_id, 2), (product_id, 2)])
+    assert response.status_code == 400
+    assert response.get_json()['shortages'][0]['requested'] == 4
+    assert stock_of(oms, [product_id]) == {product_id: 3}
+
+    response = place_order_lines(client, [(product_id, 2), (product_id, 1)])
+    assert response.status_code == 200
+    assert stock_of(oms, [product_id]) == {product_id: 0}
+    assert ordered_quantities(oms, [product_id]) == Counter({product_id: 3})
+
+
+def test_quantities_must_be_whole_numbers(oms, add_products, ba_client):
+    product_id, = add_products([10])
+    client = ba_client()
+
+    for quantity in (2.5, True, '1.5', 'two', None, [1]):
+        response = place_order_lines(client, [(product_id, quantity)])
+        assert response.status_code == 400, quantity
+        assert response.get_json()['error'] == f'Invalid quantity for product {product_id}'
+    assert stock_of(oms, [product_id]) == {product_id: 10}
+
+    response = place_order_lines(client, [(product_id, '3')])
+    assert response.status_code == 200
+    assert stock_of(oms, [product_id]) == {product_id: 7}
@@ -0,0 +1,103 @@
+"""The stock import diff: fingerprints, blank cells, repeated codes and dry runs."""
+import io
+import uuid
+
+from stock_import import import_stock_batches, read_stock_batches
+
+HEADER = 'Lot Type Code,Parent Code,Item Lot Type,Quantity Available,MRP\n'
+
+
+def sheet(rows):
+    """CSV bytes for ``rows`` of (code, parent, lot type, quantity, mrp)."""
+    return (HEADER + ''.join(','.join(str(value) for value in row) + '\n' for row in rows)).encode()
+
+
+def run_import(oms, data, **kwargs):
+    with oms.app.app_context():
+        batches = read_stock_batches(io.BytesIO(data), 'stock.csv', batch_size=2)
+        summary = import_stock_batches(oms.db, oms.Product, batches, **kwargs)
+        oms.db.session.commit()
+        return summary
+
+
+def stored(oms, codes):
+    with oms.app.app_context():
+        products = oms.Product.query.filter(oms.Product.lot_type_code.in_(codes)).all()
+        return {p.lot_type_code: (p.parent_code, p.item_lot_type, p.quantity_available, p.mrp) for p in products}
+
+
+def codes(count):
+    prefix = uuid.uuid4().hex[:8]
+    return [f'{prefix}-{i}' for i in range(count)]
+
+
+def test_reimporting_the_same_sheet_changes_nothing(oms):
+    a, b, c = codes(3)
+    data = sheet([(a, 'P1', 'Lot', 5, 10.5), (b, 'P1', 'Lot', 0, 20), (c, '', '', 3, '')])
+
+    first = run_import(oms, data)
+    second = run_import(oms, data)
+
+    assert (first.created, first.updated, first.unchanged) == (3, 0, 0)
+    assert (second.created, second.updated, second.unchanged) == (0, 0, 3)
+    assert stored(oms, [a, b, c]) == {a: ('P1', 'Lot', 5, 10.5), b: ('P1', 'Lot', 0, 20.0), c: (None, None, 3, None)}
+
+
+def test_only_changed_rows_are_updated(oms):
+    a, b = codes(2)
+    run_import(oms, sheet([(a, 'P1', 'Lot', 5, 10), (b, 'P1', 'Lot', 7, 10)]))
+
+    summary = run_import(oms, sheet([(a, 'P1', 'Lot', 4, 10), (b, 'P1', 'Lot', 7, 10)]))
+
+    assert (summary.created, summary.updated, summary.unchanged) == (0, 1, 1)
+    assert summary.preview()['updated'] == [{'lot_type_code': a, 'changes': {'quantity_available': [5, 4]}}]
+    assert stored(oms, [a])[a][2] == 4
+
+
+def test_blank_cells_keep_the_stored_values(oms):
+    a, = codes(1)
+    run_import(oms, sheet([(a, 'P1', 'Lot', 5, 10)]))
+
+    summary = run_import(oms, sheet([(a, '', '', 5, '')]))
+
+    assert (summary.updated, summary.unchanged) == (0, 1)
+    assert stored(oms, [a])[a] == ('P1', 'Lot', 5, 10.0)
+
+
+def test_a_code_repeated_in_a_later_batch_is_counted_once_and_its_last_row_wins(oms):
+    a, b, c = codes(3)
+    # batch_size=2 puts the second row for ``a`` in the second batch
+    summary = run_import(oms, sheet([(a, 'P1', 'Lot', 1, 10), (b, 'P1', 'Lot', 2, 10), (a, 'P1', 'Lot', 9, 10),
+                                     (c, 'P1', 'Lot', 3, 10)]))
+
+    assert (summary.rows, summary.created, summary.updated, summary.unchanged) == (4, 3, 0, 0)
+    assert stored(oms, [a])[a][2] == 9
+
+
+def test_rows_without_a_code_are_skipped_and_reported(oms):
+    a, = codes(1)
+    summary = run_import(oms, sheet([(a, 'P1', 'Lot', 'many', 10), ('', 'P1', 'Lot', 1, 10)]))
+
+    assert (summary.created, summary.skipped, summary.error_count) == (1, 1, 2)
+    assert [error['row'] for error in summary.errors] == [2, 3]
+    assert stored(oms, [a])[a][2] == 0
+
+
+def test_dry_run_writes_nothing_and_counts_like_the_real_import(oms):
+    a, b, c = codes(3)
+    run_import(oms, sheet([(a, 'P1', 'Lot', 5, 10), (b, 'P1', 'Lot', 5, 10)]))
+    # ``c`` is new and repeated in the second batch, which a dry run must not preview as new twice
+    data = sheet([(a, 'P1', 'Lot', 6, 10), (c, 'P1', 'Lot', 1, 10), (b, 'P1', 'Lot', 5, 10), (c, 'P1', 'Lot', 2, 10)])
+    with oms.app.app_context():
+        others = oms.Product.query.filter(oms.Product.lot_type_code.notin_([a, b, c])).count()
+
+    preview = run_import(oms, data, dry_run=True, delete_missing=True)
+
+    assert stored(oms, [a, b, c]) == {a: ('P1', 'Lot', 5, 10.0), b: ('P1', 'Lot', 5, 10.0)}
+    assert preview.counts() == {'created': 1, 'updated': 1, 'deleted': others, 'unchanged': 1, 'skipped': 0,
+                                'error_count': 0}
+    with oms.app.app_context():
+        assert oms.Product.query.filter(oms.Product.lot_type_code.notin_([a, b, c])).count() == others
+
+    applied = run_import(oms, data)
+    assert (applied.created, applied.updated, applied.unchanged) == (1, 1, 1)
@@ -0,0 +1,242 @@
+"""Background WhatsApp (Twilio) message dispatcher.
+
+Messages are queued in-process and sent by worker threads through a sender
+(by default ``TwilioSender``, one keep-alive ``requests.Session``) with
+bounded timeouts, so a slow Twilio response never stalls the request that
+triggered it. Order alerts that arrive
+within the coalescing window are merged into a single digest message.
+"""
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+
+from metrics import track_outbound
+
+TWILIO_API_URL = 'https://api.twilio.com'
+
+
+class TwilioSender:
+    """Post messages to the Twilio Messages API, or a stand-in serving the same path."""
+
+    def __init__(self, base_url=TWILIO_API_URL, pool_size=2):
+        self.url = base_url.rstrip('/') + '/2010-04-01/Accounts/{account_sid}/Messages.json'
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def send(self, account_sid, auth_token, data, timeout):
+        return self.session.post(self.url.format(account_sid=account_sid), data=data,
+                                 auth=HTTPBasicAuth(account_sid, auth_token), timeout=timeout)
+
+
+class WhatsAppDispatcher:
+    """Queue WhatsApp messages and send them from worker threads."""
+
+    def __init__(self, app, workers=2, timeout=10.0, coalesce_window=10.0, max_retries=2, queue_size=1000,
+                 sender=None):
+        self.app = app
+        self.workers = workers
+        self.timeout = (min(3.05, timeout), timeout)  # (connect, read)
+        self.coalesce_window = coalesce_window
+        self.max_retries = max_retries
+        self.sender = sender or TwilioSender(pool_size=workers)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._pending = {}  # to_number -> order alerts waiting for the coalescing window
+        self._lock = threading.Lock()
+        self._threads = []
+        self._latencies = deque(maxlen=500)
+        self._stats = {'queued': 0, 'sent': 0, 'failed': 0, 'retried': 0, 'coalesced': 0}
+
+    @property
+    def wait_timeout(self):
+        """Longest a caller should wait on a message future."""
+        return sum(self.timeout) * (self.max_retries + 1) + self.coalesce_window + 5
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'whatsapp-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Flush waiting digests, let workers drain the queue, then stop them."""
+        with self._lock:
+            targets = list(self._pending)
+        for to_number in targets:
+            self._flush(to_number)
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def send_order_alert(self, ba_username, to_number, order_id=None):
+        """Queue a new-order alert. Alerts within the coalescing window share one digest message."""
+        future = Future()
+        if self.coalesce_window <= 0:
+            self._put(self._message(f'YOU HAVE A NEW ORDER FROM {ba_username}', to_number, [future]))
+            return future
+
+        with self._lock:
+            batch = self._pending.get(to_number)
+            if batch is None:
+                batch = {'alerts': [], 'futures': []}
+                self._pending[to_number] = batch
+                timer = threading.Timer(self.coalesce_window, self._flush, args=(to_number,))
+                timer.daemon = True
+                timer.start()
+            batch['alerts'].append((order_id, ba_username))
+            batch['futures'].append(future)
+        return future
+
+    def send_message(self, body, to_number, from_number=None, account_sid=None, auth_token=None):
+        """Queue a single message. Credentials default to the current app config."""
+        future = Future()
+        self._put(self._message(body, to_number, [future], from_number, account_sid, auth_token))
+        return future
+
+    def metrics(self):
+        with self._lock:
+            waiting = sum(len(batch['alerts']) for batch in self._pending.values())
+            latencies = sorted(self._latencies)
+            stats = dict(self._stats)
+        stats.update({
+            'queue_depth': self._queue.qsize(),
+            'coalescing': waiting,
+            'workers': len(self._threads),
+            'latency_ms_p50': _percentile(latencies, 50),
+            'latency_ms_p95': _percentile(latencies, 95),
+            'latency_ms_max': latencies[-1] if latencies else None
+        })
+        return stats
+
+    def _message(self, body, to_number, futures, from_number=None, account_sid=None, auth_token=None):
+        return {
+            'body': body,
+            'to': to_number,
+            'from': from_number,
+            'account_sid': account_sid,
+            'auth_token': auth_token,
+            'futures': futures,
+            'enqueued_at': time.monotonic()
+        }
+
+    def _put(self, message):
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            self._finish(message, {'success': False, 'error': 'WhatsApp queue is full'})
+            return
+        with self._lock:
+            self._stats['queued'] += 1
+
+    def _flush(self, to_number):
+        with self._lock:
+            batch = self._pending.pop(to_number, None)
+            if batch and len(batch['alerts']) > 1:
+                self._stats['coalesced'] += len(batch['alerts']) - 1
+        if not batch:
+            return
+        alerts = batch['alerts']
+        if len(alerts) == 1:
+            body = f'YOU HAVE A NEW ORDER FROM {alerts[0][1]}'
+        else:
+            stores = ', '.join(dict.fromkeys(name for _, name in alerts))
+            order_ids = ', '.join(f'#{order_id}' for order_id, _ in alerts if order_id is not None)
+            body = f'YOU HAVE {len(alerts)} NEW ORDERS FROM {stores}'
+            if order_ids:
+                body += f' ({order_ids})'
+        self._put(self._message(body, to_number, batch['futures']))
+
+    def _run(self):
+        while True:
+            message = self._queue.get()
+            if message is None:
+                break
+            try:
+                result = self._deliver(message)
+            except Exception as e:
+                self.app.logger.error(f'[ERROR] Error sending WhatsApp notification: {str(e)}', exc_info=True)
+                result = {'success': False, 'error': str(e)}
+            self._finish(message, result)
+
+    def _finish(self, message, result):
+        latency_ms = round((time.monotonic() - message['enqueued_at']) * 1000, 1)
+        with self._lock:
+            self._stats['sent' if result['success'] else 'failed'] += 1
+            self._latencies.append(latency_ms)
+        for future in message['futures']:
+            future.set_result(result)
+
+    def _deliver(self, message):
+        config = self.app.config
+        account_sid = message['account_sid'] or config['TWILIO_ACCOUNT_SID']
+        auth_token = message['auth_token'] or config['TWILIO_AUTH_TOKEN']
+        from_number = message['from'] or config['TWILIO_WHATSAPP_FROM']
+        to_number = message['to']
+        if not from_number.startswith('whatsapp:'):
+            from_number = f'whatsapp:{from_number}'
+        if not to_number.startswith('whatsapp:'):
+            to_number = f'whatsapp:{to_number}'
+
+        data = {'To': to_number, 'From': from_number, 'Body': message['body']}
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                with track_outbound('twilio', 'send_message'):
+                    response = self.sender.send(account_sid, auth_token, data, self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt < self.max_retries:
+                    self._retry_wait(attempt)
+                    continue
+                error_msg = f'[ERROR] Twilio request failed: {str(e)}'
+                self.app.logger.error(error_msg)
+                return {'success': False, 'error': error_msg}
+
+            # Retry throttling and Twilio-side errors; anything else is final
+            if (response.status_code == 429 or response.status_code >= 500) and attempt < self.max_retries:
+                self._retry_wait(attempt)
+                continue
+            break
+
+        if response.status_code == 201:
+            sid = response.json().get('sid', 'unknown')
+            self.app.logger.info(f'[SUCCESS] WhatsApp notification sent successfully! Message SID: {sid}')
+            return {'success': True, 'sid': sid}
+
+        try:
+            error_data = response.json() if response.text else {}
+        except ValueError:
+            error_data = {}
+        error_code = error_data.get('code', 'unknown')
+        error_message = error_data.get('message', response.text)
+        if response.status_code == 401:
+            if error_code == 20003:
+                error_msg = '[ERROR] Twilio Authentication Error: Invalid Account SID or Auth Token. Please check your TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN in environment variables or admin settings.'
+            else:
+                error_msg = f'[ERROR] Twilio Authentication Error ({error_code}): {error_message}'
+        else:
+            error_msg = f'[ERROR] Twilio API error: {response.status_code} - {error_message}'
+        self.app.logger.error(error_msg)
+        return {'success': False, 'error': error_msg, 'status_code': response.status_code}
+
+    def _retry_wait(self, attempt):
+        with self._lock:
+            self._stats['retried'] += 1
+        time.sleep(min(2 ** attempt, 8))
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
@@ -0,0 +1,27 @@
+"""Production entry point.
+
+Linux (Render):  ``gunicorn wsgi:app`` - settings in gunicorn.conf.py
+Windows/local:   ``python wsgi.py``    - waitress, a multi-threaded WSGI server
+
+Startup (create_app) runs here once. With gunicorn's ``preload_app`` that is
+once in the master process before the workers fork, not once per worker.
+"""
+import os
+
+from app import create_app, db, stop_background_workers
+
+app = create_app()
+with app.app_context():
+    # Forked workers must open their own connections instead of sharing the master's
+    db.engine.dispose()
+
+
+if __name__ == '__main__':
+    from waitress import serve
+
+    port = int(os.environ.get('PORT', 5000))
+    threads = int(os.environ.get('WAITRESS_THREADS', 0)) or max(4, (os.cpu_count() or 1) * 4)
+    try:
+        serve(app, host='0.0.0.0', port=port, threads=threads)
+    finally:
+        stop_background_workers(timeout=int(os.environ.get('SHUTDOWN_TIMEOUT', 25)))